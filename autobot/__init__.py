@@ -20,6 +20,18 @@ event = Events()
 from .substitutions import Substitutions  # NOQA
 substitutions = Substitutions()
 
+from .metrics import Metrics  # NOQA
+metrics = Metrics()
+
+from .tracing import Tracer  # NOQA
+tracer = Tracer()
+
+from .profiling import Profiler  # NOQA
+profiler = Profiler()
+
+from .memory import Memory  # NOQA
+memory = Memory()
+
 # Then we move on to the factory
 from .factory import Factory  # NOQA
 
@@ -27,6 +39,7 @@ from .factory import Factory  # NOQA
 from . import core  # NOQA
 from . import scheduler  # NOQA
 from . import brain  # NOQA
+from .bot import Bot  # NOQA
 from .decorators import *  # NOQA
 
 # CONSTANTS
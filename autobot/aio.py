@@ -0,0 +1,253 @@
+import concurrent.futures
+import contextvars
+import functools
+import asyncio
+import logging
+import signal
+import queue
+import time
+
+import autobot
+from . import helpers
+from . import workers
+from .brain import Brain
+from .scheduler import Scheduler
+from autobot import event, metrics, tracer
+
+LOG = logging.getLogger(__name__)
+
+
+class AsyncBrain(Brain):
+    '''
+    The brain of the asyncio runtime. Matchers are tried on the loop, since
+    they are short and would only contend for the interpreter lock in
+    threads anyway. Async callbacks are awaited on the loop and the others,
+    as well as syncing the storage, run in the executor.
+    '''
+    def __init__(self, factory, matchers, catchalls, messageq, executor,
+                 match_cache_size=0, throttle=None):
+        super().__init__(factory, matchers, catchalls, messageq, None,
+                         match_cache_size, throttle=throttle)
+        self._executor = executor
+
+    def _in_executor(self, func, *args):
+        # Handlers in the executor see the trace of the message they handle
+        context = contextvars.copy_context()
+        return asyncio.get_running_loop().run_in_executor(
+            self._executor, functools.partial(context.run, func, *args))
+
+    async def process_async(self, message):
+        storage = self._factory.get_storage()
+        start_time = time.time()
+        trace = message.trace
+        if trace:
+            trace.add('queue', message.received, start_time)
+        matchers, catchalls = self._select(message)
+        if message.delayed and not catchalls:
+            LOG.debug('Skipping delayed message: %s', message)
+            if trace:
+                trace.finish()
+            return
+        if self._throttled(message):
+            if trace:
+                trace.finish()
+            return
+        event.trigger(event.MESSAGE_RECEIVED, self)
+
+        # Every message has a queue of its own, as several are handled at
+        # the same time
+        matchq = queue.PriorityQueue()
+        match_time = time.time()
+        cached, token = self._cached_matches(message, matchers)
+        if cached is not None:
+            self._match_cache.replay(cached, message, matchq)
+        else:
+            regexes = self._regexes
+            for matcher in matchers:
+                workers.regex_work(matcher, message, matchq,
+                                   regexes.get(id(matcher)))()
+        if token is not None:
+            self._match_cache.store(token, message, matchq)
+        for callback in catchalls:
+            matchq.put((callback.priority, callback))
+
+        callbacks_time = time.time()
+        with tracer.activate(trace):
+            await self.run_callbacks_async(storage, message, matchq)
+
+        sync_time = time.time()
+        await self._in_executor(storage.sync)
+        end_time = time.time()
+        if trace:
+            trace.add('match', match_time, callbacks_time)
+            trace.add('callbacks', callbacks_time, sync_time)
+            trace.add('sync', sync_time, end_time)
+            trace.finish()
+        event.trigger(event.MESSAGE_PROCESSED, self, {
+            'message': message,
+            'latency': end_time - message.received,
+        })
+        self._processing.observe(end_time - start_time)
+        LOG.debug('Processing took %0.2fms!', (end_time - start_time) * 1000)
+
+    async def run_callbacks_async(self, storage, message, matchq):
+        while not matchq.empty():
+            priority, matcher = matchq.get_nowait()
+            LOG.debug('Priority: %s Matcher: %s', priority, matcher)
+            callback = matcher.get_callback(self._factory)
+            try:
+                with self._measure(matcher, message):
+                    if helpers.is_async(callback):
+                        await callback(message)
+                    else:
+                        helpers.complete(
+                            await self._in_executor(callback, message))
+            except ImportError:
+                self._remove_matcher(matcher)
+                return
+            except Exception as e:
+                self._callback_failed(storage, message, matcher, e)
+                return
+            if priority > autobot.PRIORITY_ALWAYS:
+                return
+
+
+class _LoopQueue(object):
+    '''
+    Takes the place of the work queue of the scheduler, handing the jobs
+    that are due to the runtime.
+    '''
+    def __init__(self, runtime):
+        self._runtime = runtime
+
+    def put(self, work):
+        self._runtime.submit(work)
+
+
+class AsyncRuntime(object):
+    '''
+    Runs the brain, the scheduler and the services as coroutines on one
+    asyncio loop instead of each on threads of their own. Async plugin
+    handlers, that is ones defined with async def, run on the loop, so that
+    a great number of them can wait for I/O at the same time, while the
+    others are run in a thread pool of executor_workers threads (the
+    default of ThreadPoolExecutor when not given).
+    Up to concurrency messages are handled at the same time, which means
+    that replies to messages sent shortly after each other can be sent in
+    another order than with threads. A concurrency of 1 keeps the order.
+    Services with a run_async() coroutine, like the webhook service, run on
+    the loop as well, the others keep their threads and hand messages over
+    through the message queue as usual.
+    '''
+    def __init__(self, factory, matchers, catchalls, messageq, scheduleq,
+                 resolution, concurrency=100, executor_workers=None,
+                 match_cache_size=0, throttle=None):
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=executor_workers or None,
+            thread_name_prefix='handler')
+        # The message queue blocks, so it is read from a thread of its own
+        self._reader = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='ingress')
+        self.brain = AsyncBrain(factory, matchers, catchalls, messageq,
+                                self._executor, match_cache_size, throttle)
+        self.scheduler = Scheduler(factory, resolution, scheduleq,
+                                   _LoopQueue(self))
+        self._factory = factory
+        self._messageq = messageq
+        self._resolution = resolution
+        self._concurrency = concurrency
+        self._loop = None
+        self._stop = None
+        self._tasks = set()
+        metrics.gauge('autobot_messages_in_flight',
+                      'Messages being handled at the same time',
+                      function=lambda: len(self._tasks))
+
+    async def run(self, services, weights=None):
+        '''
+        Starts services, a mapping of names to services, and runs until
+        stop() is called or the process is interrupted.
+        '''
+        weights = weights or {}
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        try:
+            self._loop.add_signal_handler(signal.SIGINT, self.stop)
+        except (NotImplementedError, RuntimeError):
+            LOG.debug('Can not handle interrupts on this loop')
+        self.brain.register_events()
+        brain = self._loop.create_task(self._think())
+        scheduler = self._loop.create_task(self._tick())
+        started = []
+        try:
+            for name, service in services.items():
+                LOG.debug('Starting %s service listener!', name)
+                service.set_message_queue(
+                    self._messageq.channel(name, weights.get(name, 1)))
+                await service.start_async()
+                started.append(service)
+            await self._stop.wait()
+            LOG.info('\nI have been asked to quit nicely, and so I will!')
+        finally:
+            scheduler.cancel()
+            for service in started:
+                service.stop()
+            self._messageq.put(False)
+            await brain
+            self.brain.deregister_events()
+            self._executor.shutdown()
+            self._reader.shutdown()
+            self._factory.get_storage().close()
+
+    def stop(self):
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+    def submit(self, work):
+        '''
+        Runs a job, as a task on the loop if it is async and otherwise in the
+        executor.
+        '''
+        if helpers.is_async(work):
+            task = self._loop.create_task(work())
+        else:
+            task = self._loop.run_in_executor(
+                self._executor, lambda: helpers.complete(work()))
+        task.add_done_callback(self._job_done)
+
+    def _job_done(self, future):
+        if not future.cancelled() and future.exception():
+            LOG.error('Scheduled job failed: %s', future.exception())
+
+    async def _think(self):
+        slots = asyncio.Semaphore(self._concurrency)
+        while True:
+            message = await self._loop.run_in_executor(self._reader,
+                                                       self._messageq.get)
+            if type(message) is not autobot.Message:
+                self._messageq.task_done()
+                if not message:
+                    LOG.info('Shutting down brain...')
+                    break
+                LOG.warning('Found object in message queue that was not a '
+                            'message at all! Type: %s', type(message))
+                continue
+            await slots.acquire()
+            task = self._loop.create_task(self.brain.process_async(message))
+            self._tasks.add(task)
+            task.add_done_callback(functools.partial(self._processed, slots))
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _processed(self, slots, task):
+        self._tasks.discard(task)
+        slots.release()
+        self._messageq.task_done()
+        if not task.cancelled() and task.exception():
+            LOG.error('Handling a message failed: %s', task.exception())
+
+    async def _tick(self):
+        scheduled_events = []
+        while True:
+            self.scheduler.run_pending(scheduled_events)
+            await asyncio.sleep(self._resolution)
@@ -0,0 +1,140 @@
+import logging
+import queue
+import copy
+
+import autobot
+import autobot.config
+from . import throttle
+from . import workers
+from .brain import Brain
+from .factory import Factory
+from .scheduler import Scheduler
+
+LOG = logging.getLogger(__name__)
+
+
+class Bot(object):
+    '''
+    The bot without any of its threads, for embedding it in another program
+    and for testing plugins. The plugins are loaded by a Factory the same
+    way as when running autobot, but process() handles a message in the
+    calling thread, matchers included, and gives back the replies it
+    caused. Scheduled jobs only run when run_scheduled() is called.
+
+        bot = autobot.Bot({'plugin_path': 'plugins'})
+        assert bot.process('hello autobot') == ['Hi, user!']
+        bot.close()
+
+    Messages come from the rooms and users of the bot, which are made as
+    they are asked for, and only replies to those are collected. Replies a
+    plugin sends to the rooms of the configured service, like default_room,
+    go through that service, which is never started.
+
+    Plugins keep their state in memory unless another storage_plugin is
+    configured. The events and substitutions are shared by everything in
+    the process, so close() puts them back the way they were when the bot
+    was made, dropping the handlers and substitutions added since. Bots
+    open at the same time should be closed in the reverse order they were
+    made, which using them in with blocks takes care of.
+    '''
+    def __init__(self, config=None):
+        self._events = autobot.event.snapshot()
+        self._substitutions = dict(autobot.substitutions)
+        self.closed = False
+        self.config = copy.deepcopy(autobot.config.defaults)
+        self.config['storage_plugin'] = 'memory'
+        self.config.update(config or {})
+        self._rooms = {}
+        self._users = {}
+        self._replies = []
+        self._scheduled = []
+        self._scheduleq = queue.Queue()
+        matchers = []
+        catchalls = []
+        mapping = {
+            autobot.Callback: catchalls.append,
+            autobot.Matcher: matchers.append,
+            autobot.ScheduledCallback: self._scheduleq.put,
+            autobot.EventCallback: autobot.event.add_handler,
+        }
+        self.factory = Factory(self.config, mapping)
+        self.factory.start()
+
+        workq = workers.InlineQueue()
+        self.brain = Brain(self.factory, matchers, catchalls, None, workq,
+                           self.config['match_cache_size'], workq,
+                           throttle.from_config(self.config))
+        self.scheduler = Scheduler(self.factory,
+                                   self.config['scheduler_resolution'],
+                                   self._scheduleq, workq)
+        if 'mention_name' not in autobot.substitutions:
+            autobot.substitutions.add('mention_name', self.config.get(
+                'mention_name', 'autobot'))
+        self.name = autobot.substitutions['mention_name']
+        # Compiles the matchers, inline as the work queue does
+        self.brain.register_events()
+
+    def room(self, name):
+        if name not in self._rooms:
+            roster = [autobot.User(self.name, reply_handler=self._reply)]
+            self._rooms[name] = autobot.Room(name, roster=roster,
+                                             reply_handler=self._reply)
+        return self._rooms[name]
+
+    def user(self, name):
+        if name not in self._users:
+            self._users[name] = autobot.User(name, reply_handler=self._reply)
+        return self._users[name]
+
+    def process(self, text, author='user', room='bot', user=None,
+                mentions=(), delayed=False):
+        '''
+        Handles a message from author in room, or a direct message from user
+        if one is given, and gives the replies sent while handling it.
+        The bot being mentioned by name is noticed like a service would,
+        other users can be added to mentions.
+        '''
+        chat_room = self.room(room)
+        mentions = set(mentions) | chat_room.roster.mentions(text)
+        if self.name in mentions:
+            mentions.discard(self.name)
+            mentions.add(autobot.SELF_MENTION)
+        reply_path = self.user(user) if user else chat_room
+        message = autobot.Message(text, user or author,
+                                  reply_path=reply_path,
+                                  mentions=mentions,
+                                  delayed=delayed,
+                                  identity=user or author)
+        self._replies = []
+        self.brain.process(message)
+        return self._replies
+
+    def run_scheduled(self, unix_time=None):
+        '''
+        Runs the scheduled jobs due by unix_time, now if not given, and
+        gives the replies they sent to the rooms and users of the bot.
+        '''
+        self._replies = []
+        self.scheduler.run_pending(self._scheduled, unix_time)
+        return self._replies
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.brain.deregister_events()
+        self.factory.get_storage().close()
+        autobot.event.restore(self._events)
+        autobot.substitutions.clear()
+        autobot.substitutions.update(self._substitutions)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _reply(self, chat_object, message, *args):
+        text = message % args if args else message
+        LOG.debug('Reply to %s: %s', chat_object.name, text)
+        self._replies.append(text)
@@ -1,35 +1,68 @@
+import contextlib
+import functools
+import threading
 import queue
 import logging
 import datetime
 import time
+import regex
 
 import autobot
+from . import helpers
 from . import workers
-from autobot import event
+from .cache import MatchCache
+from autobot import event, metrics, tracer
 
 LOG = logging.getLogger(__name__)
 
 
 class Brain(object):
-    def __init__(self, factory, matchers, catchalls, messageq, workq):
+    '''
+    Runs messages through the matchers and callbacks. With a
+    match_cache_size the matchers that matched the latest message texts
+    are remembered, see autobot.cache.MatchCache.
+    Matchers are compiled once the substitutions their patterns use are
+    there, by the work put on compileq, which is a queue read by a thread
+    of the brain's own unless another is given. Matchers whose patterns
+    expand to the same regex share the compiled one. Messages never wait
+    for the compiling, they are matched against the regexes compiled so far
+    and the ones compiled for a new substitution are swapped in all at once
+    when the compiling is done.
+    Given a throttle, see autobot.throttle.Throttle, messages from authors
+    and rooms that are flooding the bot are dropped before matching.
+    '''
+    def __init__(self, factory, matchers, catchalls, messageq, workq,
+                 match_cache_size=0, compileq=None, throttle=None):
         self._factory = factory
+        self._throttle = throttle
         self.matchers = matchers
         self.catchalls = catchalls
         self._messageq = messageq
         self._workq = workq
-        self._dirty_substitutions = False
+        self._compileq = compileq
+        self._compiler = None
+        self._compiling = threading.Lock()
+        # The compiled regexes by the id of their matcher, only ever
+        # replaced as a whole
+        self._regexes = {}
         self._matchq = queue.PriorityQueue()
+        self._match_cache = (MatchCache(match_cache_size)
+                             if match_cache_size else None)
+        self._processing = metrics.histogram(
+            'autobot_message_seconds',
+            'Time taken to process a message, from matching to storage sync')
+        self._callback_time = metrics.histogram(
+            'autobot_callback_seconds', 'Time taken to run a callback')
+        self._callback_errors = metrics.counter(
+            'autobot_callback_errors_total', 'Callbacks that raised errors')
 
     def boot(self):
         LOG.debug('Booting brain!')
-        event.register(event.SERVICE_STARTED, self._compile_regexps)
-        event.register(event.MESSAGE_RECEIVED, self._compile_regexps)
-        event.register(event.SUBSTITUTIONS_ALTERED, self._track_substitutions)
+        self.register_events()
 
         storage = self._factory.get_storage()
         while True:
             message = self._messageq.get()
-            start_time = time.time()
             if type(message) is not autobot.Message:
                 if not message:
                     LOG.info('Shutting down brain thread...')
@@ -38,28 +71,127 @@ class Brain(object):
                 LOG.warning('Found object in message queue that was not a '
                             'message at all! Type: %s', type(message))
                 continue
-            event.trigger(event.MESSAGE_RECEIVED, self)
+            self.process(message)
+            self._messageq.task_done()
+
+        storage.close()
+
+    def register_events(self):
+        if self._compileq is None:
+            self._compileq = queue.Queue()
+            self._compiler = threading.Thread(name='compiler',
+                                              target=self._compile_loop)
+            self._compiler.daemon = True
+            self._compiler.start()
+        event.register(event.SERVICE_STARTED, self._compile_pending)
+        event.register(event.SUBSTITUTIONS_ALTERED, self._compile_affected)
+        self._compile_pending(self, {})
+
+    def deregister_events(self):
+        event.deregister(event.SERVICE_STARTED, self._compile_pending)
+        event.deregister(event.SUBSTITUTIONS_ALTERED, self._compile_affected)
+        if self._compiler:
+            self._compileq.put(False)
+            self._compiler.join()
+            self._compileq = None
+            self._compiler = None
+
+    def process(self, message):
+        '''
+        Runs a message through the matchers and callbacks and syncs the
+        storage. The matchers are put on the work queue, everything else
+        happens in the calling thread.
+        '''
+        storage = self._factory.get_storage()
+        start_time = time.time()
+        trace = message.trace
+        if trace:
+            trace.add('queue', message.received, start_time)
+        matchers, catchalls = self._select(message)
+        if message.delayed and not catchalls:
+            LOG.debug('Skipping delayed message: %s', message)
+            if trace:
+                trace.finish()
+            return
+        if self._throttled(message):
+            if trace:
+                trace.finish()
+            return
+        event.trigger(event.MESSAGE_RECEIVED, self)
 
-            LOG.debug('Processing message: %s', message)
-            LOG.debug('Number of matchers: %s', len(self.matchers))
+        LOG.debug('Processing message: %s', message)
+        LOG.debug('Number of matchers: %s', len(matchers))
 
-            for matcher in self.matchers:
-                work = workers.regex_work(matcher, message, self._matchq)
+        dispatch_time = time.time()
+        cached, token = self._cached_matches(message, matchers)
+        if cached is not None:
+            self._match_cache.replay(cached, message, self._matchq)
+        else:
+            # Looked up after the cache, which is invalidated after the
+            # regexes are swapped, so nothing matched by the regexes that
+            # were replaced is remembered
+            regexes = self._regexes
+            for matcher in matchers:
+                work = workers.regex_work(matcher, message, self._matchq,
+                                          regexes.get(id(matcher)))
                 self._workq.put(work)
 
-            for callback in self.catchalls:
-                self._matchq.put((callback.priority, callback))
+        join_time = time.time()
+        self._workq.join()  # This is mixed with schedule work
+        if token is not None:
+            self._match_cache.store(token, message, self._matchq)
 
-            self._workq.join()  # This is mixed with schedule work
+        for callback in catchalls:
+            self._matchq.put((callback.priority, callback))
 
+        callbacks_time = time.time()
+        with tracer.activate(trace):
             self.run_callbacks(self._factory, storage, message)
 
-            storage.sync()
-            self._messageq.task_done()
-            proc_time = (time.time() - start_time) * 1000
-            LOG.debug('Processing took %0.2fms!' % proc_time)
+        sync_time = time.time()
+        storage.sync()
+        end_time = time.time()
+        if trace:
+            trace.add('dispatch', dispatch_time, join_time)
+            trace.add('join', join_time, callbacks_time)
+            trace.add('callbacks', callbacks_time, sync_time)
+            trace.add('sync', sync_time, end_time)
+            trace.finish()
+        event.trigger(event.MESSAGE_PROCESSED, self, {
+            'message': message,
+            'latency': end_time - message.received,
+        })
+        self._processing.observe(end_time - start_time)
+        proc_time = (end_time - start_time) * 1000
+        LOG.debug('Processing took %0.2fms!' % proc_time)
 
-        storage.close()
+    def _select(self, message):
+        '''
+        The matchers and catchalls to run a message through.
+        '''
+        if message.delayed:
+            # History is only of interest to those who asked for it, and
+            # must not cause replies to things that were answered already
+            return [], [c for c in self.catchalls if c.history]
+        return self.matchers, self.catchalls
+
+    def _throttled(self, message):
+        # History was sent long before, so it can not be flooding the bot
+        if self._throttle is None or message.delayed:
+            return False
+        if self._throttle.allow(message):
+            return False
+        LOG.debug('Dropping throttled message: %s', message)
+        return True
+
+    def _cached_matches(self, message, matchers):
+        '''
+        The cache entry for a message, or None and the token to store what
+        matched it with when it is worth caching.
+        '''
+        if self._match_cache is None or not matchers:
+            return None, None
+        return self._match_cache.lookup(message, matchers)
 
     def shutdown(self):
         self._messageq.put(False)
@@ -71,37 +203,120 @@ class Brain(object):
                 priority, matcher = self._matchq.get_nowait()
                 LOG.debug('Priority: %s Matcher: %s', priority, matcher)
                 callback = matcher.get_callback(factory)
-                callback(message)
+                with self._measure(matcher, message):
+                    helpers.complete(callback(message))
                 if priority <= autobot.PRIORITY_ALWAYS:
                     continue
                 with self._matchq.mutex:
                     self._matchq.queue.clear()
         except ImportError:
-            LOG.warning('Removing matcher with regex %s and method: %s from '
-                        'class %s because it broke.',
-                        matcher.pattern,
-                        matcher._func.__name__,
-                        matcher.__func__._class_name)
-            del(self.matchers[self.matchers.index(matcher)])
+            self._remove_matcher(matcher)
         except queue.Empty:
             pass
         except Exception as e:
-            # TODO: This breaks with "no .find() on builtin object or method"
-            LOG.error(e)
-            now = datetime.datetime.now()
-            storage['_internal']['last_error'] = {'timestamp': now,
-                                                  'exception': e}
-            message.reply('Ouch! That went straight to the brain! '
-                          'Judging by the mechanics involved it will '
-                          'probably happen if you try again as well... '
-                          'so please don\'t...')
-
-    def _track_substitutions(self, context, event_args):
-        self._dirty_substitutions = True
-
-    def _compile_regexps(self, context, event_args):
-        if isinstance(context, autobot.Service) or self._dirty_substitutions:
-            LOG.debug('Compiling regex with substitutions: %s',
-                      autobot.substitutions)
-            [m.compile(**autobot.substitutions) for m in self.matchers]
-            self._dirty_substitutions = False
+            self._callback_failed(storage, message, matcher, e)
+
+    @contextlib.contextmanager
+    def _measure(self, matcher, message):
+        callback_start = time.time()
+        try:
+            yield
+        finally:
+            callback_end = time.time()
+            self._callback_time.observe(callback_end - callback_start,
+                                        callback=matcher.full_name)
+            if message.trace:
+                message.trace.add('callback', callback_start, callback_end,
+                                  callback=matcher.full_name)
+
+    def _remove_matcher(self, matcher):
+        LOG.warning('Removing matcher with regex %s and method: %s from '
+                    'class %s because it broke.',
+                    matcher.pattern,
+                    matcher._func.__name__,
+                    getattr(matcher._func, '_class_name', None))
+        with self._compiling:
+            del(self.matchers[self.matchers.index(matcher)])
+            regexes = dict(self._regexes)
+            regexes.pop(id(matcher), None)
+            self._regexes = regexes
+        if self._match_cache is not None:
+            self._match_cache.invalidate()
+
+    def _callback_failed(self, storage, message, matcher, e):
+        # TODO: This breaks with "no .find() on builtin object or method"
+        LOG.error(e)
+        self._callback_errors.inc(callback=matcher.full_name)
+        now = datetime.datetime.now()
+        internal = storage.namespace('_internal')
+        internal['last_error'] = {'timestamp': now, 'exception': e}
+        message.reply('Ouch! That went straight to the brain! '
+                      'Judging by the mechanics involved it will '
+                      'probably happen if you try again as well... '
+                      'so please don\'t...')
+
+    def _compile_pending(self, context, event_args):
+        '''
+        Compiles the matchers that have not been, like the ones of plugins
+        loaded after the substitutions they use were added.
+        '''
+        regexes = self._regexes
+        self._submit_compile([m for m in self.matchers
+                              if id(m) not in regexes])
+
+    def _compile_affected(self, context, event_args):
+        key = event_args.get('key')
+        self._submit_compile([m for m in self.matchers
+                              if key in m.substitutions])
+
+    def _submit_compile(self, matchers):
+        if not matchers:
+            return
+        self._compileq.put(functools.partial(self._compile, matchers))
+
+    def _compile_loop(self):
+        while True:
+            work = self._compileq.get()
+            try:
+                if not work:
+                    return
+                work()
+            except Exception as e:
+                LOG.error('Compiling matchers failed: %s', e)
+            finally:
+                self._compileq.task_done()
+
+    def compile_regexps(self):
+        '''
+        Compiles every matcher in the calling thread.
+        '''
+        self._compile(list(self.matchers))
+
+    def _compile(self, matchers):
+        start_time = time.time()
+        compiled = 0
+        with self._compiling:
+            substitutions = dict(autobot.substitutions)
+            patterns = {r.pattern: r for r in self._regexes.values()}
+            # Leaving out the regexes of matchers that were removed
+            regexes = {id(m): self._regexes[id(m)] for m in self.matchers
+                       if id(m) in self._regexes}
+            for matcher in matchers:
+                missing = matcher.substitutions.difference(substitutions)
+                if missing:
+                    LOG.debug('Not compiling %s until there are '
+                              'substitutions for %s', matcher.pattern,
+                              ', '.join(sorted(missing)))
+                    continue
+                pattern = matcher.expand(**substitutions)
+                if pattern not in patterns:
+                    patterns[pattern] = regex.compile(pattern)
+                regexes[id(matcher)] = patterns[pattern]
+                compiled += 1
+            self._regexes = regexes
+        if self._match_cache is not None:
+            self._match_cache.invalidate()
+        LOG.debug('Compiled %s of %s matchers in %0.2fms, %s distinct '
+                  'regexes', compiled, len(matchers),
+                  (time.time() - start_time) * 1000,
+                  len({r.pattern for r in regexes.values()}))
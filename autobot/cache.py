@@ -0,0 +1,244 @@
+import collections
+import threading
+import logging
+
+import autobot
+from . import helpers
+
+LOG = logging.getLogger(__name__)
+
+WRITE_BACK = 'write-back'
+WRITE_THROUGH = 'write-through'
+
+
+class CachedStorage(autobot.Storage):
+    '''
+    Sits in front of another storage plugin and keeps the namespaces that
+    were used most recently loaded, up to max_size bytes. When the limit is
+    passed the least recently used namespaces are written to the backend
+    and dropped from memory, to be read again on their next access.
+    In write-back mode the backend only sees changes on sync and eviction,
+    in write-through mode every key set or deleted through a namespace is
+    written immediately. Values that are changed in place are always
+    written on the next sync.
+    '''
+    def __init__(self, backend, max_size, mode=WRITE_BACK):
+        if mode not in (WRITE_BACK, WRITE_THROUGH):
+            raise ValueError('Unknown cache mode {}'.format(mode))
+        super().__init__(backend._config)
+        self._backend = backend
+        self._max_size = max_size
+        self._mode = mode
+        self._lru = collections.OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def open(self):
+        return self._backend
+
+    def load(self, name):
+        with self.lock(name):
+            if name in self._loaded:
+                self._hits += 1
+                with self._guard:
+                    self._lru.move_to_end(name)
+                return self._loaded[name]
+            self._misses += 1
+            value = super().load(name)
+            with self._guard:
+                self._lru[name] = helpers.sizeof(value)
+        self._evict(keep=name)
+        return value
+
+    def sync(self):
+        super().sync()
+        self._evict()
+
+    def store(self, name, value):
+        self.data.store(name, value)
+        with self._guard:
+            if self._loaded.get(name) is value:
+                self._lru[name] = helpers.sizeof(value)
+            else:
+                self._lru.pop(name, None)
+
+    def changed(self, name):
+        if self._mode == WRITE_THROUGH:
+            self.data.store(name, self._loaded[name])
+            self.data.flush()
+
+    def fetch(self, name):
+        return self.data.fetch(name)
+
+    def remove(self, name):
+        with self._guard:
+            self._lru.pop(name, None)
+        self.data.remove(name)
+
+    def exists(self, name):
+        return self.data.exists(name)
+
+    def names(self):
+        return self.data.names()
+
+    def namespace_size(self, name):
+        return self.data.namespace_size(name)
+
+    def flush(self):
+        self.data.flush()
+
+    def close(self):
+        if self.opened:
+            self.sync()
+            self.data.close()
+
+    def cache_stats(self):
+        with self._guard:
+            requests = self._hits + self._misses
+            return {
+                'mode': self._mode,
+                'max_size': self._max_size,
+                'size': sum(self._lru.values()),
+                'namespaces': len(self._lru),
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / requests if requests else None,
+                'evictions': self._evictions,
+            }
+
+    def _evict(self, keep=None):
+        with self._guard:
+            size = sum(self._lru.values())
+            candidates = [name for name in self._lru if name != keep]
+
+        for name in candidates:
+            if size <= self._max_size:
+                break
+            lock = self.lock(name)
+            # Never wait for a namespace that is in use, since whoever holds
+            # it might be waiting for the one we hold
+            if not lock.acquire(blocking=False):
+                continue
+            try:
+                if name not in self._loaded:
+                    continue
+                LOG.debug('Evicting namespace %s from the cache', name)
+                self.data.store(name, self._loaded[name])
+                self.data.flush()
+                del self._loaded[name]
+                with self._guard:
+                    size -= self._lru.pop(name, 0)
+                    self._evictions += 1
+            finally:
+                lock.release()
+
+
+class MatchCache(object):
+    '''
+    Remembers which matchers matched a message, so that text the bot sees
+    over and over, like commands and greetings, is not run through every
+    regex again. Entries are keyed on the text as it was received together
+    with the outcome of the conditions of the matchers, each distinct one
+    evaluated once per message, and hold the matchers that hit and the text
+    their preprocessors left. Up to max_size entries are kept, dropping the
+    least recently used. The brain invalidates the cache whenever it
+    recompiles the regexes or a matcher is removed, and the cache does so
+    itself when matchers are added.
+    Conditions and preprocessors are expected to only depend on the message
+    and the substitutions, since their outcome is remembered as well.
+    '''
+    def __init__(self, max_size):
+        self._max_size = max_size
+        self._lru = collections.OrderedDict()
+        self._guard = threading.Lock()
+        self._version = 0
+        self._conditions = None
+        self._matcher_count = None
+        self._hits = 0
+        self._misses = 0
+        self._requests = autobot.metrics.counter(
+            'autobot_match_cache_requests_total',
+            'Messages looked up in the match cache, by result')
+        autobot.metrics.gauge('autobot_match_cache_entries',
+                              'Message texts in the match cache',
+                              function=lambda: len(self._lru))
+
+    def invalidate(self):
+        with self._guard:
+            self._version += 1
+            self._lru.clear()
+            self._conditions = None
+
+    def lookup(self, message, matchers):
+        '''
+        Gives the remembered entry for message, or None and a token to hand
+        to store() once the matchers have been run.
+        '''
+        with self._guard:
+            if self._matcher_count != len(matchers):
+                self._version += 1
+                self._lru.clear()
+                self._conditions = None
+                self._matcher_count = len(matchers)
+            if self._conditions is None:
+                conditions = collections.OrderedDict()
+                for matcher in matchers:
+                    conditions.setdefault(id(matcher.condition),
+                                          matcher.condition)
+                self._conditions = list(conditions.values())
+            conditions = self._conditions
+            version = self._version
+
+        key = (str(message),
+               tuple(bool(condition(message)) for condition in conditions))
+        with self._guard:
+            entry = self._lru.get(key)
+            if entry is not None:
+                self._lru.move_to_end(key)
+                self._hits += 1
+            else:
+                self._misses += 1
+        self._requests.inc(result='hit' if entry is not None else 'miss')
+        if entry is not None:
+            return entry, None
+        return None, (version, key)
+
+    def replay(self, entry, message, matchq):
+        '''
+        Puts the matchers of an entry on matchq as if they had just matched.
+        '''
+        text, matchers = entry
+        if text != str(message):
+            message.process(lambda _: text)
+        for matcher in matchers:
+            matchq.put((matcher.priority, matcher))
+
+    def store(self, token, message, matchq):
+        '''
+        Remembers the matchers on matchq, which must hold nothing but what
+        matched the message looked up.
+        '''
+        version, key = token
+        with matchq.mutex:
+            matchers = tuple(matcher for _, matcher in matchq.queue)
+        with self._guard:
+            # The matchers were compiled again while this message was
+            # matched, so what matched might have changed
+            if version != self._version:
+                return
+            self._lru[key] = (str(message), matchers)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self._max_size:
+                self._lru.popitem(last=False)
+
+    def stats(self):
+        with self._guard:
+            requests = self._hits + self._misses
+            return {
+                'max_size': self._max_size,
+                'entries': len(self._lru),
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / requests if requests else None,
+            }
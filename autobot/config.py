@@ -3,8 +3,42 @@ import autobot
 
 defaults = {
     'scheduler_resolution': 0.5,
+    # threads, or asyncio to run on one loop, see autobot.aio.AsyncRuntime
+    'runtime': 'threads',
+    # Messages handled at the same time and handler threads with asyncio
+    'async_concurrency': 100,
+    'async_executor_workers': 0,
+    # Message texts whose matches are remembered, 0 turns the cache off
+    'match_cache_size': 1024,
+    # Messages per second allowed from one author and from one room or user
+    # on average, 0 for no limit, see autobot.throttle.Throttle
+    'throttle_author_rate': 0,
+    'throttle_author_burst': 10,
+    'throttle_room_rate': 0,
+    'throttle_room_burst': 20,
+    # Authors, rooms and users that are never throttled
+    'throttle_exempt': [],
     'storage_plugin': 'shelve',
+    # Bytes of namespaces kept in memory, 0 keeps everything that was loaded
+    'storage_cache_size': 0,
+    'storage_cache_mode': 'write-back',
+    # A name or a list of names to run several services at the same time
     'service_plugin': 'stdio',
-    'core_path': os.path.join(autobot.__path__.pop(), 'core'),
+    # How many turns each service gets at the brain, by name, defaulting to 1
+    'service_weights': {},
+    # Messages waiting per service before the policy kicks in, 0 for no limit
+    'message_queue_size': 0,
+    # One of block, drop-oldest or drop-priority, see autobot.ingress.Ingress
+    'message_queue_policy': 'block',
+    # Serve metrics for Prometheus on http://metrics_host:metrics_port/metrics
+    'metrics_port': 0,
+    'metrics_host': '127.0.0.1',
+    # The share of messages traced from 0 to 1, see autobot.tracing.Tracer
+    'trace_sample_rate': 0.0,
+    # A JSON-lines file finished traces are appended to
+    'trace_file': None,
+    # Where profiling reports are written, see autobot.profiling.Profiler
+    'profile_dir': 'profiles',
+    'core_path': os.path.join(os.path.dirname(autobot.__file__), 'core'),
     'plugin_path': os.path.join(os.path.curdir, 'plugins'),
 }
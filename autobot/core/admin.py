@@ -0,0 +1,160 @@
+import logging
+
+import autobot
+
+LOG = logging.getLogger(__name__)
+
+
+class AdminPlugin(autobot.Plugin):
+    '''
+    Commands for looking into how the bot itself is doing, which only the
+    identities listed in admins may use, see autobot.Message. Names people
+    can pick for themselves, like nicks in rooms, are never enough.
+    '''
+    config_defaults = {
+        # Identities allowed to use the commands, like bare JIDs, nobody by
+        # default
+        'admins': [],
+    }
+
+    def __init__(self, factory, config):
+        super().__init__(factory)
+        self._config = config
+
+    def _admin(self, message):
+        '''
+        Whether the author of a message may use the commands, telling them
+        off if not.
+        '''
+        identity = message.identity
+        if identity is not None and identity in self._config['admins']:
+            return True
+        LOG.warning('Refused %s (%s), who is not an admin: %s',
+                    message.author, identity, str(message).strip())
+        message.reply('Sorry, only admins can do that')
+        return False
+
+    @autobot.respond_to(r'^metrics\b')
+    def metrics(self, message):
+        '''
+        Shows the current metrics in the Prometheus text format. Give a
+        prefix to only see the metrics starting with it, like "metrics
+        autobot_storage".
+        '''
+        if not self._admin(message):
+            return
+        prefix = _argument(message, 'metrics')
+        text = autobot.metrics.render(prefix).strip()
+        message.reply(text or 'No metrics starting with {}'.format(prefix))
+
+    @autobot.respond_to(r'^traces\b')
+    def traces(self, message):
+        '''
+        Shows the latest traced messages with the time spent in every stage,
+        or the slowest of them with "traces slowest". Takes the number of
+        traces to show, like "traces slowest 5", 3 by default.
+        '''
+        if not self._admin(message):
+            return
+        words = _argument(message, 'traces').split()
+        count = int(words[-1]) if words and words[-1].isdigit() else 3
+        if 'slowest' in words:
+            traces = autobot.tracer.slowest(count)
+        else:
+            traces = autobot.tracer.recent(count)
+        if not traces:
+            message.reply('No traces yet, tracing samples {:.0%} of messages'
+                          .format(autobot.tracer.sample_rate))
+            return
+        message.reply('\n'.join(_format_trace(trace) for trace in traces))
+
+    @autobot.respond_to(r'^profile\b')
+    def profile(self, message):
+        '''
+        Profiles the methods of all plugins with "profile start" until
+        "profile stop", which writes a report to disk like "profile report"
+        does without stopping. "profile reset" throws away what was gathered
+        and "profile" on its own shows the slowest methods so far.
+        '''
+        if not self._admin(message):
+            return
+        profiler = autobot.profiler
+        command = _argument(message, 'profile')
+        if command == 'start':
+            profiler.start()
+            message.reply('Profiling plugins, "profile stop" writes a report')
+            return
+        if command in ('stop', 'report'):
+            if command == 'stop':
+                profiler.stop()
+            message.reply('Wrote profiling report to {}'.format(
+                profiler.report()))
+            return
+        if command == 'reset':
+            profiler.reset()
+            message.reply('Profiling data cleared')
+            return
+        lines = ['Profiling is {}'.format('on' if profiler.enabled
+                                          else 'off')]
+        for name, calls, seconds in profiler.summary()[:10]:
+            lines.append('{} {} calls {:.2f}ms'.format(name, calls,
+                                                        seconds * 1000))
+        message.reply('\n'.join(lines))
+
+    @autobot.respond_to(r'^memory\b')
+    def memory(self, message):
+        '''
+        Shows roughly how much memory every plugin, loaded storage namespace
+        and queue holds. "memory start" traces allocations from then on,
+        "memory top" shows the lines that allocated the most since, taking
+        the number of lines to show like "memory top 20", and "memory stop"
+        stops tracing again.
+        '''
+        if not self._admin(message):
+            return
+        memory = autobot.memory
+        words = _argument(message, 'memory').split()
+        command = words[0] if words else ''
+        if command == 'start':
+            memory.start_tracing()
+            message.reply('Tracing memory allocations, "memory top" shows '
+                          'where they come from')
+            return
+        if command == 'stop':
+            memory.stop_tracing()
+            message.reply('Stopped tracing memory allocations')
+            return
+        if command == 'top':
+            if not memory.tracing:
+                message.reply('Not tracing, "memory start" starts it')
+                return
+            count = int(words[-1]) if words[-1].isdigit() else 10
+            message.reply('\n'.join(str(statistic) for statistic
+                                    in memory.top(count)) or
+                          'Nothing allocated since tracing started')
+            return
+        message.reply(memory.report(self._factory).rstrip())
+
+
+def _argument(message, command):
+    '''
+    The text following command in a message, or an empty string.
+    '''
+    text = str(message).strip()
+    if command in text:
+        text = text[text.index(command) + len(command):]
+    return text.strip()
+
+
+def _format_trace(trace):
+    lines = ['{} {:.2f}ms "{}" from {}'.format(
+        trace['trace_id'], trace['duration_ms'], trace['message'].strip(),
+        trace['author'])]
+    for span in trace['spans']:
+        details = ' '.join('{}={}'.format(key, value)
+                           for key, value in sorted(span.items())
+                           if key not in ('name', 'start_ms', 'duration_ms'))
+        lines.append('  +{:.2f}ms {} {:.2f}ms {}'.format(
+            span['start_ms'], span['name'], span['duration_ms'],
+            details).rstrip())
+    return '\n'.join(lines)
@@ -8,16 +8,18 @@ class HelloPlugin(autobot.Plugin):
 
     def __init__(self, factory):
         super().__init__(factory)
-        if 'hello_replies' not in self.storage or (
-                not isinstance(self.storage['hello_replies'], set)):
-            self.storage['hello_replies'] = set()
+        with self.storage.transaction() as storage:
+            if 'hello_replies' not in storage or (
+                    not isinstance(storage['hello_replies'], set)):
+                storage['hello_replies'] = set()
 
     @autobot.respond_to('^(H|h)i')
     @autobot.respond_to('^(H|h)i,? ({mention_name})')
     @autobot.respond_to('^(H|h)ello,? ({mention_name})')
     def hi(self, message):
         message.reply('Hi, %s!', message.author)
-        self.storage['hello_replies'].add(message.author)
+        with self.storage.transaction() as storage:
+            storage['hello_replies'].add(message.author)
 
     @autobot.eavesdrop(always=True)
     def listen(self, message):
@@ -9,10 +9,10 @@ class HipChatService(XMPPService):
         super().__init__(config)
         self.mention_regexp = regex.compile('@\w+')
 
-    def _mention_parse(self, message):
-        mentions = []
+    def _mention_parse(self, message, room=None):
+        mentions = set()
         if self._config['mention_name'] in message:
-            mentions.append(autobot.SELF_MENTION)
+            mentions.add(autobot.SELF_MENTION)
 
         return mentions
 
@@ -0,0 +1,331 @@
+import collections.abc
+import threading
+import logging
+import struct
+import zlib
+import io
+import os
+
+import autobot
+
+LOG = logging.getLogger(__name__)
+
+_SET = 1
+_DELETE = 2
+_CREATE = 3
+_DROP = 4
+# Checksum, operation and the lengths of namespace, key and value
+_HEADER = struct.Struct('>IBHHI')
+
+
+class JournalStorage(autobot.Storage):
+    '''
+    Appends a record for every changed key to a journal file instead of
+    rewriting whole namespaces, which keeps the cost of a write close to
+    constant for plugins that update a few keys often. Where the latest
+    value of every key is in the journal is kept in memory and rebuilt by
+    replaying the journal when it is opened, and a background thread
+    compacts the journal once it has grown to compact_ratio times the size
+    of the live data.
+    Only keys accessed since the previous sync are checked for changes, so
+    plugins should keep their namespace around rather than the values in it.
+    '''
+    config_defaults = {
+        'path': './autobot.journal',
+        'fsync': False,
+        'compact_ratio': 2.0,
+        'compact_min_size': 1024 * 1024,
+        'compact_interval': 60,
+    }
+
+    partial_reads = True
+
+    def __init__(self, config):
+        super().__init__(config)
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        # Changes are written in the order they were snapshotted
+        self._flush_lock = threading.Lock()
+
+    def open(self):
+        return _Journal(self._config)
+
+    def namespace_size(self, name):
+        return self.data.size(name)
+
+    def store(self, name, value):
+        if not isinstance(value, _JournalNamespace):
+            self.data[name] = value
+            value = self.data[name]
+        # The namespace lock is held, so this is a consistent snapshot
+        changes = value.changes()
+        with self._pending_lock:
+            self._pending.append((value, changes))
+
+    def flush(self):
+        with self._flush_lock:
+            with self._pending_lock:
+                pending, self._pending = self._pending, []
+            self.data.write(pending)
+
+    def close(self):
+        if self.opened:
+            LOG.debug('Closing journal...')
+            self.data.close()
+
+
+class _Journal(collections.abc.MutableMapping):
+    '''
+    The mapping of namespace names to namespaces, along with the journal file
+    and the index of where the value of every key is in it.
+    '''
+    def __init__(self, config):
+        self._path = config['path']
+        self._fsync = config['fsync']
+        self._compact_ratio = config['compact_ratio']
+        self._compact_min_size = config['compact_min_size']
+        self._index = {}
+        self._created = {}
+        self._dropped = set()
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+
+        self._file = open(self._path, 'a+b')
+        self._size = self._replay()
+        self._compactor = threading.Thread(
+            name='journal-compactor', target=self._compact_loop,
+            args=(config['compact_interval'],))
+        self._compactor.daemon = True
+        self._compactor.start()
+
+    def _replay(self):
+        size = 0
+        records = 0
+        with open(self._path, 'rb') as reader:
+            for record in _read_records(reader):
+                size = _apply(self._index, size, *record)
+                records += 1
+        total = os.fstat(self._file.fileno()).st_size
+        if size < total:
+            LOG.warning('Truncating %d bytes of broken records at the end of '
+                        '%s', total - size, self._path)
+            self._file.truncate(size)
+        LOG.debug('Replayed %d records from %s', records, self._path)
+        return size
+
+    def read(self, name, key):
+        with self._lock:
+            location = self._index.get(name, {}).get(key)
+            if location is None:
+                return None
+            offset, length = location
+            return os.pread(self._file.fileno(), length, offset)
+
+    def keys_of(self, name):
+        with self._lock:
+            return list(self._index.get(name, {}))
+
+    def size(self, name):
+        with self._lock:
+            if name not in self._index:
+                return None
+            return sum(length for _, length in self._index[name].values())
+
+    def __getitem__(self, name):
+        with self._lock:
+            if name in self._created:
+                return self._created[name]
+            if name in self._dropped or name not in self._index:
+                raise KeyError(name)
+            return _JournalNamespace(self, name)
+
+    def __setitem__(self, name, value):
+        with self._lock:
+            namespace = _JournalNamespace(self, name, replace=True)
+            namespace.update(value)
+            self._created[name] = namespace
+            self._dropped.discard(name)
+
+    def __delitem__(self, name):
+        with self._lock:
+            if name not in self:
+                raise KeyError(name)
+            self._created.pop(name, None)
+            self._dropped.add(name)
+
+    def __contains__(self, name):
+        with self._lock:
+            if name in self._created:
+                return True
+            return name not in self._dropped and name in self._index
+
+    def __iter__(self):
+        with self._lock:
+            names = set(self._created)
+            names.update(self._index)
+            names.difference_update(self._dropped)
+        return iter(sorted(names))
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def write(self, changes):
+        '''
+        Appends the records for the changes snapshotted from the namespaces,
+        and for the namespaces removed since the last write, in one go.
+        '''
+        with self._lock:
+            records = [(_DROP, name, '', b'') for name in self._dropped]
+            self._dropped = set()
+            for namespace, (replace, upserts, deletes) in changes:
+                name = namespace.name
+                if replace:
+                    records.append((_DROP, name, '', b''))
+                if replace or name not in self._index:
+                    records.append((_CREATE, name, '', b''))
+                records.extend((_SET, name, key, blob)
+                               for key, blob in upserts)
+                records.extend((_DELETE, name, key, b'') for key in deletes)
+            if records:
+                self._append(records)
+
+            for namespace, (replace, upserts, deletes) in changes:
+                namespace.committed(upserts, deletes)
+                if self._created.get(namespace.name) is namespace:
+                    del self._created[namespace.name]
+
+    def _append(self, records):
+        data = b''.join(_pack(*record) for record in records)
+        self._file.write(data)
+        self._file.flush()
+        if self._fsync:
+            os.fsync(self._file.fileno())
+        offset = self._size
+        for record in records:
+            offset = _apply(self._index, offset, *record)
+        self._size = offset
+
+    def _compact_loop(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                if self._needs_compaction():
+                    self.compact()
+            except Exception as e:
+                LOG.error('Compacting %s failed: %s', self._path, e)
+
+    def _needs_compaction(self):
+        with self._lock:
+            live = sum(length for keys in self._index.values()
+                       for _, length in keys.values())
+            size = self._size
+        if size < self._compact_min_size:
+            return False
+        return size > live * self._compact_ratio
+
+    def compact(self):
+        '''
+        Writes the live records to a new journal and swaps it in. The copying
+        is done without holding the lock, and whatever was appended meanwhile
+        is copied over before the swap.
+        '''
+        with self._lock:
+            end = self._size
+            index = {name: dict(keys) for name, keys in self._index.items()}
+        LOG.debug('Compacting %s (%d bytes)', self._path, end)
+
+        path = self._path + '.compact'
+        compacted = {}
+        offset = 0
+        with open(path, 'wb') as out:
+            fd = self._file.fileno()
+            for name, keys in index.items():
+                records = [(_CREATE, name, '', b'')]
+                for key, (value_offset, length) in keys.items():
+                    blob = os.pread(fd, length, value_offset)
+                    records.append((_SET, name, key, blob))
+                out.write(b''.join(_pack(*record) for record in records))
+                for record in records:
+                    offset = _apply(compacted, offset, *record)
+
+            with self._lock:
+                if self._stop.is_set():
+                    return
+                tail = os.pread(fd, self._size - end, end)
+                out.write(tail)
+                for record in _read_records(io.BytesIO(tail)):
+                    offset = _apply(compacted, offset, *record)
+                out.flush()
+                os.fsync(out.fileno())
+                os.replace(path, self._path)
+                old, self._file = self._file, open(self._path, 'a+b')
+                old.close()
+                self._index = compacted
+                self._size = offset
+        LOG.debug('Compacted %s from %d to %d bytes', self._path, end, offset)
+
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            self._file.close()
+
+
+class _JournalNamespace(autobot.KeyedNamespace):
+    only_touched = True
+
+    def __init__(self, journal, name, replace=False):
+        super().__init__(name, replace)
+        self._journal = journal
+
+    def read(self, key):
+        return self._journal.read(self.name, key)
+
+    def stored_keys(self):
+        return self._journal.keys_of(self.name)
+
+
+def _pack(operation, name, key, value):
+    name = name.encode('utf-8')
+    key = key.encode('utf-8')
+    header = _HEADER.pack(0, operation, len(name), len(key), len(value))
+    body = header[4:] + name + key + value
+    return struct.pack('>I', zlib.crc32(body)) + body
+
+
+def _read_records(reader):
+    '''
+    Yields the operation, namespace, key and value of every record, stopping
+    at the first one that is incomplete or does not match its checksum.
+    '''
+    while True:
+        header = reader.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            return
+        checksum, operation, name_len, key_len, value_len = (
+            _HEADER.unpack(header))
+        rest = reader.read(name_len + key_len + value_len)
+        if len(rest) < name_len + key_len + value_len:
+            return
+        if zlib.crc32(header[4:] + rest) != checksum:
+            return
+        name = rest[:name_len].decode('utf-8')
+        key = rest[name_len:name_len + key_len].decode('utf-8')
+        yield operation, name, key, rest[name_len + key_len:]
+
+
+def _apply(index, offset, operation, name, key, value):
+    '''
+    Updates the index with a record written at offset and gives the offset
+    of the record following it.
+    '''
+    name_len = len(name.encode('utf-8'))
+    key_len = len(key.encode('utf-8'))
+    value_offset = offset + _HEADER.size + name_len + key_len
+    if operation == _SET:
+        index.setdefault(name, {})[key] = (value_offset, len(value))
+    elif operation == _DELETE:
+        index.get(name, {}).pop(key, None)
+    elif operation == _CREATE:
+        index.setdefault(name, {})
+    elif operation == _DROP:
+        index.pop(name, None)
+    return value_offset + len(value)
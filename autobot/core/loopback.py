@@ -0,0 +1,341 @@
+import collections
+import itertools
+import threading
+import random
+import logging
+import queue
+import time
+import xml.etree.ElementTree as ET
+
+import autobot
+from .xmpp import XMPPService, _XMPPClient
+
+LOG = logging.getLogger(__name__)
+
+
+class LoopbackService(XMPPService):
+    '''
+    The XMPP service talking to an in-process stand-in for the server instead
+    of a real one, to measure the XMPP path without a network. Messages can
+    be injected with inject() on the client once the service is started,
+    which has the stand-in deliver them as stanzas, and everything the bot
+    sends is recorded on the client.
+    With load_messages set, that many messages are injected when the session
+    starts, at load_rate messages per second (0 for as fast as possible)
+    from load_users different users, of which load_direct_ratio are direct
+    messages and load_mention_ratio mention the bot. load_text is the text
+    of the messages, where {n} is replaced by the number of the message.
+    Once the brain has processed them the throughput and latencies are
+    logged, and kept in load_report.
+    '''
+    config_defaults = {
+        'username': 'autobot',
+        'server': 'loopback',
+        'real_name': 'Autobot',
+        'rooms': ['loadtest@conference.loopback'],
+        'send_rate': 0,
+        'load_messages': 0,
+        'load_rate': 0,
+        'load_users': 10,
+        'load_direct_ratio': 0.0,
+        'load_mention_ratio': 0.0,
+        'load_text': 'load message {n}',
+    }
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.load_report = None
+        self._latencies = []
+        self._latency_lock = threading.Lock()
+
+    def _create_client(self):
+        return _LoopbackClient(self)
+
+    @property
+    def client(self):
+        return self._client
+
+    def _session_start(self, *args):
+        super()._session_start(*args)
+        if self._config['load_messages']:
+            thread = threading.Thread(name='loopback-load', target=self._load)
+            thread.daemon = True
+            thread.start()
+
+    def _processed(self, context, event_args):
+        with self._latency_lock:
+            self._latencies.append(event_args['latency'])
+
+    def _load(self):
+        count = self._config['load_messages']
+        rate = self._config['load_rate']
+        rng = random.Random(0)
+        autobot.event.register(autobot.event.MESSAGE_PROCESSED,
+                               self._processed)
+        start_time = time.time()
+        for i in range(count):
+            if rate:
+                delay = start_time + i / rate - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            body = self._config['load_text'].format(n=i)
+            if rng.random() < self._config['load_mention_ratio']:
+                body = '{}: {}'.format(self.mention_name, body)
+            self._client.inject(
+                body,
+                nick='user{}'.format(i % self._config['load_users']),
+                direct=rng.random() < self._config['load_direct_ratio'])
+        inject_time = time.time() - start_time
+
+        # Wait for the client to queue every message, then for the brain to
+        # be done with them. Messages shed from a full queue are not counted
+        self._client.idle()
+        self._messageq.join()
+        total_time = time.time() - start_time
+        autobot.event.deregister(autobot.event.MESSAGE_PROCESSED,
+                                 self._processed)
+
+        with self._latency_lock:
+            latencies, self._latencies = self._latencies, []
+        self.load_report = {
+            'injected': count,
+            'processed': len(latencies),
+            'sent': self._client.sent_count,
+            'inject_rate': count / inject_time if inject_time else 0.0,
+            'throughput': len(latencies) / total_time,
+            'p50': autobot.helpers.percentile(latencies, 50),
+            'p95': autobot.helpers.percentile(latencies, 95),
+            'p99': autobot.helpers.percentile(latencies, 99),
+        }
+        LOG.info('Loopback load: %(processed)s of %(injected)s messages '
+                 'processed at %(throughput).1f/s, %(sent)s stanzas sent',
+                 self.load_report)
+        if latencies:
+            LOG.info('Loopback latency: p50 %.2fms p95 %.2fms p99 %.2fms',
+                     *(self.load_report[p] * 1000
+                       for p in ('p50', 'p95', 'p99')))
+
+
+class _EventQueue(queue.Queue):
+    '''
+    The event queue of the loopback client. The event runner coming back for
+    the next event marks the last one done, so join() returns once every
+    handler has run, including those of events queued by other handlers.
+    '''
+    def __init__(self):
+        super().__init__()
+        self._handling = False
+
+    def get(self, *args, **kwargs):
+        if self._handling:
+            self._handling = False
+            self.task_done()
+        item = super().get(*args, **kwargs)
+        self._handling = True
+        return item
+
+
+class _LoopbackClient(_XMPPClient):
+    '''
+    The XMPP client of the service, streaming to a _LoopbackServer instead
+    of a socket. Connecting starts the session right away, without
+    negotiating features or authenticating, and everything after that goes
+    through the stanza handlers of the client like it does for a server.
+    Sent messages are kept in sent as (timestamp, to, body, type), holding
+    the last max_sent of them.
+    '''
+    def __init__(self, service, max_sent=10000):
+        super().__init__(service.jid, service._config['password'], service)
+        self.event_queue = _EventQueue()
+        self._server = _LoopbackServer(self, service._config['server'],
+                                       max_sent)
+
+    @property
+    def sent(self):
+        return self._server.sent
+
+    @property
+    def sent_count(self):
+        return self._server.sent_count
+
+    def connect(self):
+        self.connected = True
+        self.set_socket(self._server)
+
+    def process(self):
+        self.session_bind_event.set()
+        self.session_started_event.set()
+        super().process(threaded=True)
+        self.event('session_start')
+
+    def disconnect(self):
+        self.connected = False
+        super().disconnect(wait=True)
+
+    def inject(self, body, nick='user', room=None, direct=False,
+               delayed=False):
+        '''
+        Delivers a message to the client as the server would, from nick in
+        room, or as a direct message from nick. Someone new to the room
+        joins it first.
+        '''
+        room = room or self._service.default_room.name
+        self._server.deliver(body, nick, room, direct, delayed)
+
+    def idle(self, timeout=10):
+        '''
+        Waits until the client has handled everything delivered so far.
+        '''
+        self._server.ping(timeout)
+        self.event_queue.join()
+
+
+class _LoopbackServer(object):
+    '''
+    Stands in for both the socket and the server at the other end of it.
+    The client reads what the server writes from read(), and the server
+    answers what the client writes to send(): the roster request, joining
+    a room and pings. Presence and messages from other users are made up
+    by deliver().
+    '''
+    MUC_USER = '{http://jabber.org/protocol/muc#user}'
+    HEADER = ('<?xml version="1.0"?><stream:stream xmlns="jabber:client" '
+              'xmlns:stream="http://etherx.jabber.org/streams" '
+              'from="{}" id="loopback" version="1.0">')
+    FOOTER = '</stream:stream>'
+
+    def __init__(self, client, domain, max_sent):
+        self.sent = collections.deque(maxlen=max_sent)
+        self.sent_count = 0
+        self._client = client
+        self._domain = domain
+        self._incoming = queue.Queue()
+        self._buffer = b''
+        self._occupants = collections.defaultdict(set)
+        self._pings = {}
+        self._ping_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._write(self.HEADER.format(domain))
+
+    # The socket, as the client sees it
+
+    def makefile(self, *args):
+        return self
+
+    def read(self, size=-1):
+        if not self._buffer:
+            self._buffer = self._incoming.get()
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def send(self, data):
+        text = data.decode('utf-8').strip()
+        if text == self.FOOTER:
+            self._write(self.FOOTER)
+        elif text:
+            self._receive(ET.fromstring(text))
+        return len(data)
+
+    def shutdown(self, how):
+        pass
+
+    def close(self):
+        self._incoming.put(b'')
+
+    # The server
+
+    def deliver(self, body, nick, room, direct, delayed):
+        if direct:
+            sender = '{}@{}/loopback'.format(nick, self._domain)
+            message_type = 'chat'
+        else:
+            sender = '{}/{}'.format(room, nick)
+            message_type = 'groupchat'
+            with self._lock:
+                joining = nick not in self._occupants[room]
+                self._occupants[room].add(nick)
+            if joining:
+                self._write(self._presence(room, nick, '{}@{}/loopback'.format(
+                    nick, self._domain)))
+        message = ET.Element('message', {
+            'from': sender,
+            'to': self._client.boundjid.full,
+            'type': message_type,
+        })
+        ET.SubElement(message, 'body').text = body
+        if delayed:
+            ET.SubElement(message, '{urn:xmpp:delay}delay', {
+                'from': room,
+                'stamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            })
+        self._write(message)
+
+    def ping(self, timeout):
+        ping_id = 'loopback-ping-{}'.format(next(self._ping_ids))
+        answered = threading.Event()
+        with self._lock:
+            self._pings[ping_id] = answered
+        iq = ET.Element('iq', {
+            'from': self._domain,
+            'to': self._client.boundjid.full,
+            'type': 'get',
+            'id': ping_id,
+        })
+        ET.SubElement(iq, '{urn:xmpp:ping}ping')
+        self._write(iq)
+        if not answered.wait(timeout):
+            LOG.warning('Loopback client did not answer ping %s', ping_id)
+        with self._lock:
+            self._pings.pop(ping_id, None)
+
+    def _receive(self, stanza):
+        kind = _local_name(stanza)
+        if kind == 'message':
+            body = next((child.text for child in stanza
+                         if _local_name(child) == 'body'), None)
+            with self._lock:
+                self.sent.append((time.time(), stanza.get('to'), body,
+                                  stanza.get('type')))
+                self.sent_count += 1
+        elif kind == 'presence' and stanza.get('to'):
+            room, _, nick = stanza.get('to').partition('/')
+            with self._lock:
+                self._occupants[room].add(nick)
+            self._write(self._presence(room, nick,
+                                       self._client.boundjid.full))
+        elif kind == 'iq' and stanza.get('type') == 'get':
+            # The roster, and anything else asked for, is empty
+            self._write(ET.Element('iq', {
+                'to': self._client.boundjid.full,
+                'type': 'result',
+                'id': stanza.get('id'),
+            }))
+        elif kind == 'iq' and stanza.get('type') == 'result':
+            with self._lock:
+                answered = self._pings.get(stanza.get('id'))
+            if answered:
+                answered.set()
+
+    def _presence(self, room, nick, jid):
+        presence = ET.Element('presence', {
+            'from': '{}/{}'.format(room, nick),
+            'to': self._client.boundjid.full,
+        })
+        x = ET.SubElement(presence, self.MUC_USER + 'x')
+        ET.SubElement(x, self.MUC_USER + 'item', {
+            'jid': jid,
+            'affiliation': 'member',
+            'role': 'participant',
+        })
+        return presence
+
+    def _write(self, data):
+        if not isinstance(data, str):
+            data = ET.tostring(data, encoding='unicode')
+        self._incoming.put(data.encode('utf-8'))
+
+
+def _local_name(element):
+    return element.tag.rpartition('}')[2]
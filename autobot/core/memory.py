@@ -0,0 +1,21 @@
+import logging
+
+import autobot
+
+LOG = logging.getLogger(__name__)
+
+
+class MemoryStorage(autobot.Storage):
+    '''
+    Keeps every namespace in memory only, so nothing is left behind once
+    the bot is closed. Meant for tests and for autobot.Bot, which uses it
+    unless another storage_plugin is given.
+    '''
+    def open(self):
+        return {}
+
+    def store(self, name, value):
+        self.data[name] = value
+
+    def close(self):
+        pass
@@ -0,0 +1,186 @@
+import collections.abc
+import importlib
+import threading
+import logging
+import pickle
+
+import redis
+import autobot
+
+LOG = logging.getLogger(__name__)
+
+
+class RedisStorage(autobot.Storage):
+    '''
+    Keeps every namespace in a Redis hash with a field per key, so that
+    several bot instances can share their storage. Keys are read when they
+    are first accessed, and a sync sends only the keys that changed, for all
+    namespaces at once, as a single pipelined transaction. Connections are
+    taken from a pool shared by all threads.
+    client_class can point at any class with a redis.StrictRedis compatible
+    from_url(), such as fakeredis.FakeStrictRedis for running without a
+    Redis server.
+    Only keys accessed since the previous sync are checked for changes, so
+    plugins should keep their namespace around rather than the values in it.
+    '''
+    config_defaults = {
+        'url': 'redis://localhost:6379/0',
+        'prefix': 'autobot',
+        'max_connections': 16,
+        'client_class': 'redis.StrictRedis',
+    }
+
+    partial_reads = True
+
+    def __init__(self, config):
+        super().__init__(config)
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        # Changes are written in the order they were snapshotted
+        self._flush_lock = threading.Lock()
+
+    def open(self):
+        module, _, name = self._config['client_class'].rpartition('.')
+        client_class = getattr(importlib.import_module(module), name)
+        LOG.debug('Connecting to %s', self._config['url'])
+        client = client_class.from_url(
+            self._config['url'],
+            max_connections=self._config['max_connections'])
+        return _RedisDatabase(client, self._config['prefix'])
+
+    def store(self, name, value):
+        if not isinstance(value, _RedisNamespace):
+            self.data[name] = value
+            value = self.data[name]
+        # The namespace lock is held, so this is a consistent snapshot
+        changes = value.changes()
+        with self._pending_lock:
+            self._pending.append((value, changes))
+
+    def flush(self):
+        with self._flush_lock:
+            with self._pending_lock:
+                pending, self._pending = self._pending, []
+            self.data.write(pending)
+
+    def close(self):
+        if self.opened:
+            LOG.debug('Disconnecting from redis...')
+            self.data.close()
+
+
+class _RedisDatabase(collections.abc.MutableMapping):
+    '''
+    The mapping of namespace names to namespaces. The names are kept in a
+    set, so that empty namespaces exist as well, and new namespaces are kept
+    here until they have been written.
+    '''
+    def __init__(self, client, prefix):
+        self.client = client
+        self._prefix = prefix
+        self._names_key = '{}:namespaces'.format(prefix)
+        self._created = {}
+        self._dropped = set()
+        self._lock = threading.RLock()
+
+    def hash_key(self, name):
+        return '{}:ns:{}'.format(self._prefix, name)
+
+    def __getitem__(self, name):
+        with self._lock:
+            if name in self._created:
+                return self._created[name]
+            if name in self._dropped or (
+                    not self.client.sismember(self._names_key, name)):
+                raise KeyError(name)
+            return _RedisNamespace(self, name)
+
+    def __setitem__(self, name, value):
+        with self._lock:
+            namespace = _RedisNamespace(self, name, replace=True)
+            namespace.update(value)
+            self._created[name] = namespace
+            self._dropped.discard(name)
+
+    def __delitem__(self, name):
+        with self._lock:
+            if name not in self:
+                raise KeyError(name)
+            self._created.pop(name, None)
+            self._dropped.add(name)
+
+    def __contains__(self, name):
+        with self._lock:
+            if name in self._created:
+                return True
+            if name in self._dropped:
+                return False
+            return bool(self.client.sismember(self._names_key, name))
+
+    def __iter__(self):
+        with self._lock:
+            names = set(self._created)
+            names.update(name.decode('utf-8')
+                         for name in self.client.smembers(self._names_key))
+            names.difference_update(self._dropped)
+        return iter(sorted(names))
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def write(self, changes):
+        '''
+        Sends the changes snapshotted from the namespaces, and the removal of
+        namespaces dropped since the last write, in one pipeline.
+        '''
+        with self._lock:
+            dropped = list(self._dropped)
+        if not dropped and not any(upserts or deletes or replace
+                                   for _, (replace, upserts, deletes)
+                                   in changes):
+            return
+
+        pipeline = self.client.pipeline()
+        for name in dropped:
+            pipeline.delete(self.hash_key(name))
+            pipeline.srem(self._names_key, name)
+        for namespace, (replace, upserts, deletes) in changes:
+            key = self.hash_key(namespace.name)
+            if replace:
+                pipeline.delete(key)
+                pipeline.sadd(self._names_key, namespace.name)
+            if upserts:
+                pipeline.hset(key, mapping=dict(upserts))
+            if deletes:
+                pipeline.hdel(key, *deletes)
+        pipeline.execute()
+
+        with self._lock:
+            for namespace, (replace, upserts, deletes) in changes:
+                namespace.committed(upserts, deletes)
+                if self._created.get(namespace.name) is namespace:
+                    del self._created[namespace.name]
+            self._dropped.difference_update(dropped)
+
+    def close(self):
+        self.client.connection_pool.disconnect()
+
+
+class _RedisNamespace(autobot.KeyedNamespace):
+    only_touched = True
+
+    def __init__(self, database, name, replace=False):
+        super().__init__(name, replace)
+        self._database = database
+        self._key = database.hash_key(name)
+
+    def read(self, key):
+        return self._database.client.hget(self._key, key)
+
+    def stored_keys(self):
+        return [key.decode('utf-8')
+                for key in self._database.client.hkeys(self._key)]
+
+    def stream(self):
+        for key, blob in self._database.client.hscan_iter(self._key):
+            yield key.decode('utf-8'), pickle.loads(blob)
@@ -1,5 +1,6 @@
 import shelve
 import logging
+import threading
 
 import autobot
 
@@ -7,15 +8,54 @@ LOG = logging.getLogger(__name__)
 
 
 class ShelveStorage(autobot.Storage):
+    '''
+    Keeps every namespace as one pickled object in a shelve. The dbm behind
+    it is not safe to use from several threads, so all access to it goes
+    through a lock, while the loaded namespaces are handled by autobot.Storage.
+    '''
     config_defaults = {'path': './shelve'}
 
     def __init__(self, config):
-        self.data = shelve.open(config['path'], writeback=True)
-        LOG.debug('Loading file with contents: %s', dict(self.data))
+        super().__init__(config)
+        self._io_lock = threading.Lock()
 
-    def sync(self):
-        self.data.sync()
+    def open(self):
+        LOG.debug('Opening shelve at %s', self._config['path'])
+        return shelve.open(self._config['path'])
+
+    def namespace_size(self, name):
+        key = name.encode(self.data.keyencoding)
+        with self._io_lock:
+            if key not in self.data.dict:
+                return None
+            return len(self.data.dict[key])
+
+    def fetch(self, name):
+        with self._io_lock:
+            return self.data[name]
+
+    def store(self, name, value):
+        with self._io_lock:
+            self.data[name] = value
+
+    def remove(self, name):
+        with self._io_lock:
+            del self.data[name]
+
+    def exists(self, name):
+        with self._io_lock:
+            return name in self.data
+
+    def names(self):
+        with self._io_lock:
+            return list(self.data)
+
+    def flush(self):
+        with self._io_lock:
+            self.data.sync()
 
     def close(self):
-        LOG.debug('Closing database...')
-        self.data.close()
+        if self.opened:
+            LOG.debug('Closing database...')
+            with self._io_lock:
+                self.data.close()
@@ -0,0 +1,246 @@
+import collections.abc
+import threading
+import logging
+import pickle
+import sqlite3
+
+import autobot
+
+LOG = logging.getLogger(__name__)
+
+
+class SQLiteStorage(autobot.Storage):
+    '''
+    Keeps every plugin namespace in a table of its own in a SQLite database
+    running in WAL mode. Values are pickled per key, so reading one key does
+    not mean unpickling everything else the plugin has stored. Every thread
+    gets a connection of its own, which means that handlers running in the
+    worker threads can read while the brain thread is syncing.
+    Only keys accessed since the previous sync are checked for changes, so
+    plugins should keep their namespace around rather than the values in it.
+    '''
+    config_defaults = {'path': './autobot.sqlite', 'timeout': 5.0}
+
+    partial_reads = True
+
+    def __init__(self, config):
+        super().__init__(config)
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        # Changes are written in the order they were snapshotted
+        self._flush_lock = threading.Lock()
+
+    def open(self):
+        return _SQLiteDatabase(self._config['path'], self._config['timeout'])
+
+    def namespace_size(self, name):
+        return self.data.size(name)
+
+    def store(self, name, value):
+        if not isinstance(value, _SQLiteNamespace):
+            self.data[name] = value
+            value = self.data[name]
+        # The namespace lock is held, so this is a consistent snapshot
+        changes = value.changes()
+        with self._pending_lock:
+            self._pending.append((value, changes))
+
+    def flush(self):
+        with self._flush_lock:
+            with self._pending_lock:
+                pending, self._pending = self._pending, []
+            self.data.write(pending)
+
+    def close(self):
+        if self.opened:
+            LOG.debug('Closing database...')
+            self.data.close()
+
+
+class _SQLiteDatabase(collections.abc.MutableMapping):
+    '''
+    The mapping of namespace names to namespaces. Namespaces are only read
+    from the database when they are first accessed, and a table is only
+    created for them on the first write after they were added, which is why
+    new namespaces are kept here until then.
+    '''
+    def __init__(self, path, timeout):
+        self._path = path
+        self._timeout = timeout
+        self._local = threading.local()
+        self._connections = []
+        self._created = {}
+        self._dropped = set()
+        self._lock = threading.RLock()
+
+    def connection(self):
+        conn = getattr(self._local, 'connection', None)
+        if conn is None:
+            LOG.debug('Opening database %s for thread %s', self._path,
+                      threading.current_thread().name)
+            # The connection is only ever used from this thread, except when
+            # closing the database, which is why the check is turned off
+            conn = sqlite3.connect(self._path, timeout=self._timeout,
+                                   check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def tables(self):
+        cursor = self.connection().execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'")
+        return [_namespace_name(row[0]) for row in cursor
+                if _namespace_name(row[0]) is not None]
+
+    def has_table(self, name):
+        cursor = self.connection().execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+            (_table_name(name),))
+        return cursor.fetchone() is not None
+
+    def size(self, name):
+        if not self.has_table(name):
+            return None
+        cursor = self.connection().execute(
+            'SELECT COALESCE(SUM(LENGTH(value)), 0) FROM {}'.format(
+                _quote(_table_name(name))))
+        return cursor.fetchone()[0]
+
+    def __getitem__(self, name):
+        with self._lock:
+            if name in self._created:
+                return self._created[name]
+            if name in self._dropped or not self.has_table(name):
+                raise KeyError(name)
+            return _SQLiteNamespace(self, name)
+
+    def __setitem__(self, name, value):
+        if not isinstance(name, str):
+            raise TypeError('Namespace names must be strings')
+        with self._lock:
+            namespace = _SQLiteNamespace(self, name, replace=True)
+            namespace.update(value)
+            self._created[name] = namespace
+            self._dropped.discard(name)
+
+    def __delitem__(self, name):
+        with self._lock:
+            if name not in self:
+                raise KeyError(name)
+            self._created.pop(name, None)
+            self._dropped.add(name)
+
+    def __contains__(self, name):
+        with self._lock:
+            if name in self._created:
+                return True
+            return name not in self._dropped and self.has_table(name)
+
+    def __iter__(self):
+        with self._lock:
+            names = set(self._created)
+            names.update(self.tables())
+            names.difference_update(self._dropped)
+        return iter(sorted(names))
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def write(self, changes):
+        '''
+        Writes the changes snapshotted from the namespaces, and drops the
+        tables of removed namespaces, in a single transaction.
+        '''
+        with self._lock:
+            dropped = list(self._dropped)
+
+        conn = self.connection()
+        with conn:
+            for name in dropped:
+                conn.execute('DROP TABLE IF EXISTS {}'.format(
+                    _quote(_table_name(name))))
+            for namespace, (replace, upserts, deletes) in changes:
+                table = _quote(_table_name(namespace.name))
+                conn.execute('CREATE TABLE IF NOT EXISTS {} ('
+                             'key TEXT PRIMARY KEY, '
+                             'value BLOB NOT NULL)'.format(table))
+                if replace:
+                    conn.execute('DELETE FROM {}'.format(table))
+                if upserts:
+                    conn.executemany(
+                        'INSERT OR REPLACE INTO {} (key, value) '
+                        'VALUES (?, ?)'.format(table), upserts)
+                if deletes:
+                    conn.executemany(
+                        'DELETE FROM {} WHERE key = ?'.format(table),
+                        [(key,) for key in deletes])
+
+        with self._lock:
+            for namespace, (replace, upserts, deletes) in changes:
+                namespace.committed(upserts, deletes)
+                if self._created.get(namespace.name) is namespace:
+                    del self._created[namespace.name]
+            self._dropped.difference_update(dropped)
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+            self._local = threading.local()
+
+
+class _SQLiteNamespace(autobot.KeyedNamespace):
+    '''
+    A namespace whose keys are rows in its own table.
+    '''
+    only_touched = True
+
+    def __init__(self, database, name, replace=False):
+        super().__init__(name, replace)
+        self._database = database
+        self._table = _quote(_table_name(name))
+
+    def _select(self, query, *args):
+        try:
+            return self._database.connection().execute(
+                query.format(self._table), args).fetchall()
+        except sqlite3.OperationalError:
+            # The table has not been created yet
+            return []
+
+    def read(self, key):
+        rows = self._select('SELECT value FROM {} WHERE key = ?', key)
+        return rows[0][0] if rows else None
+
+    def stored_keys(self):
+        return [row[0] for row in self._select('SELECT key FROM {}')]
+
+    def stream(self):
+        try:
+            cursor = self._database.connection().execute(
+                'SELECT key, value FROM {}'.format(self._table))
+        except sqlite3.OperationalError:
+            return
+        rows = cursor.fetchmany()
+        while rows:
+            for key, blob in rows:
+                yield key, pickle.loads(blob)
+            rows = cursor.fetchmany()
+
+
+def _table_name(name):
+    return 'ns_' + name
+
+
+def _namespace_name(table):
+    if table.startswith('ns_'):
+        return table[len('ns_'):]
+    return None
+
+
+def _quote(identifier):
+    return '"{}"'.format(identifier.replace('"', '""'))
@@ -1,13 +1,30 @@
 import sys
 import threading
 import logging
+import json
+import time
 import autobot
 
 LOG = logging.getLogger(__name__)
 
 
 class StdioService(autobot.Service):
-    config_defaults = {'rooms': ['stdin']}
+    '''
+    With replay set to the path of a transcript, the service reads the
+    messages from that instead of stdin, waits for the brain to process all
+    of them, prints the throughput and latencies and quits. A transcript has
+    a JSON object per line, like:
+
+        {"time": 12.5, "author": "alice", "room": "ops", "text": "hi",
+         "mention": true}
+
+    where "user" instead of "room" makes it a direct message from that user
+    and "mention" marks it as mentioning the bot. With replay_speed at 0 the
+    messages are sent as fast as possible, otherwise at the pace recorded in
+    time (in seconds), sped up replay_speed times. Once the brain is done
+    with all of them the bot is asked to quit.
+    '''
+    config_defaults = {'rooms': ['stdin'], 'replay': None, 'replay_speed': 0}
 
     def __init__(self, config):
         super().__init__(config)
@@ -16,43 +33,106 @@ class StdioService(autobot.Service):
         self._init_rooms()
 
     def _init_rooms(self):
+        self._create_room('stdin', topic='stdin fake room')
+
+    def _create_room(self, name, topic=None):
         users = [self._config['mention_name'], 'system']
         roster = []
         for user in users:
             roster.append(autobot.User(
-                user, user, reply_handler=self._send_to_user))
+                user, user, reply_handler=self.outbound(self._send_to_user)))
 
-        room = autobot.Room('stdin',
-                            topic='stdin fake room',
+        room = autobot.Room(name,
+                            topic=topic,
                             roster=roster,
-                            reply_handler=self._send_to_room)
+                            reply_handler=self.outbound(self._send_to_room))
         self._rooms[room.name] = room
+        return room
 
-    def _loop(self):
-        room = self.default_room
+    def _mention_parse(self, message, room):
+        matches = room.roster.mentions(message)
+        mention_name = self._config['mention_name']
+        if mention_name in matches:
+            matches.discard(mention_name)
+            matches.add(autobot.SELF_MENTION)
 
-        def mention_parse(message):
-            matches = [u.name for u in room.roster if u.name in message]
-            mention_name = self._config['mention_name']
-            if mention_name in matches:
-                self_index = matches.index(mention_name)
-                matches[self_index] = autobot.SELF_MENTION
+        return matches
 
-            return matches
+    def _loop(self):
+        if self._config['replay']:
+            self._replay(self._config['replay'])
+            return
 
+        room = self.default_room
         for line in sys.stdin:
             reply_path = room
             private_match = '{}:'.format(self._config['mention_name'])
             if line.startswith(private_match):
                 line = line[len(private_match):].lstrip()
-                user = [u for u in room.roster if u.name == 'system']
-                reply_path = user.pop()
+                reply_path = room.roster.get('system')
             msg = autobot.Message(line,
                                   'system',
                                   reply_path=reply_path,
-                                  mentions=mention_parse(line))
+                                  mentions=self._mention_parse(line, room),
+                                  identity='system')
             self._messageq.put(msg)
 
+    def _replay_message(self, record):
+        text = record['text']
+        room = self.get_room(record.get('room', self.default_room.name))
+        if record.get('user'):
+            reply_path = autobot.User(
+                record['user'],
+                reply_handler=self.outbound(self._send_to_user))
+        else:
+            reply_path = room
+        mentions = self._mention_parse(text, room)
+        mentions.update(record.get('mentions', []))
+        if record.get('mention'):
+            mentions.add(autobot.SELF_MENTION)
+        author = record.get('author', 'system')
+        return autobot.Message(text,
+                               author,
+                               reply_path=reply_path,
+                               mentions=mentions,
+                               identity=author)
+
+    def _replay(self, path):
+        with open(path) as transcript:
+            records = [json.loads(line) for line in transcript
+                       if line.strip()]
+        latencies = []
+
+        def processed(context, event_args):
+            latencies.append(event_args['latency'])
+
+        autobot.event.register(autobot.event.MESSAGE_PROCESSED, processed)
+        speed = self._config['replay_speed']
+        first_time = records[0].get('time', 0) if records else 0
+        start_time = time.time()
+        for record in records:
+            if speed and 'time' in record:
+                delay = (start_time + (record['time'] - first_time) / speed -
+                         time.time())
+                if delay > 0:
+                    time.sleep(delay)
+            self._messageq.put(self._replay_message(record))
+
+        # Wait for the brain to be done with every message, however long the
+        # handlers take, which includes messages shed from a full queue
+        self._messageq.join()
+        total_time = time.time() - start_time
+        autobot.event.deregister(autobot.event.MESSAGE_PROCESSED, processed)
+
+        print('Replayed {} of {} messages in {:.2f}s, {:.1f} messages/s'
+              .format(len(latencies), len(records), total_time,
+                      len(latencies) / total_time))
+        if latencies:
+            print('Latency p50 {:.2f}ms p95 {:.2f}ms p99 {:.2f}ms'.format(
+                *(autobot.helpers.percentile(latencies, p) * 1000
+                  for p in (50, 95, 99))))
+        autobot.event.trigger(autobot.event.QUIT_REQUESTED, self)
+
     def run(self):
         self._thread.daemon = True
         try:
@@ -63,11 +143,13 @@ class StdioService(autobot.Service):
     def shutdown(self):
         pass
 
-    def _send_to_user(self, user, message, *args):
-        sys.stdout.write('{}: {}\n'.format(user, message % args))
+    def _send_to_user(self, user, message):
+        sys.stdout.write('{}: {}\n'.format(user, message))
 
-    def _send_to_room(self, room, message, *args):
-        sys.stdout.write(message % args + '\n')
+    def _send_to_room(self, room, message):
+        sys.stdout.write(message + '\n')
 
     def get_room(self, room):
+        if room not in self._rooms:
+            return self._create_room(room)
         return self._rooms[room]
@@ -0,0 +1,309 @@
+import collections
+import threading
+import asyncio
+import logging
+import json
+import urllib.parse
+
+import autobot
+
+LOG = logging.getLogger(__name__)
+
+_REASONS = {
+    200: 'OK',
+    202: 'Accepted',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    429: 'Too Many Requests',
+    500: 'Internal Server Error',
+}
+
+
+class WebhookService(autobot.Service):
+    '''
+    Takes messages over HTTP, for pushing alerts and CI events into the bot.
+    An asyncio server accepts POST /messages with a JSON object, or a list
+    of them, like:
+
+        {"text": "build 42 failed", "author": "ci", "room": "builds"}
+
+    where room defaults to the default room, "user" instead of "room" makes
+    it a direct message from that user, "mentions" lists the names of the
+    users mentioned and "mention": true marks it as mentioning the bot, as
+    does the mention name in the text. A batch with a message that is not
+    like this is refused with 400, and otherwise put on the message queue at
+    once. Replies are buffered per room and user, up to reply_buffer of
+    them, and handed out by GET /rooms/<name> and GET /users/<name>.
+    Clients name rooms and users as they like, so only the max_rooms rooms
+    and the max_reply_buffers reply buffers used last are kept, and the
+    replies nobody came for are dropped with the buffer.
+    Batches larger than max_batch are refused with 413, and requests are
+    turned away with 429 while more than max_pending messages are waiting
+    already, so clients back off instead of the queue growing without end.
+    Both are checked before any message is built.
+    '''
+    config_defaults = {
+        'host': '127.0.0.1',
+        'port': 8080,
+        'rooms': ['webhook'],
+        'max_batch': 1000,
+        'max_pending': 10000,
+        'max_body_size': 1048576,
+        'reply_buffer': 100,
+        'max_rooms': 1000,
+        'max_reply_buffers': 1000,
+    }
+
+    def __init__(self, config):
+        super().__init__(config)
+        self._rooms = collections.OrderedDict()
+        self._replies = collections.OrderedDict()
+        self._replies_lock = threading.Lock()
+        self._loop = None
+        self._server = None
+        self._writers = set()
+        self._thread = threading.Thread(name='webhook', target=self._serve)
+        self._thread.daemon = True
+        self._ready = threading.Event()
+
+    def run(self):
+        self._thread.start()
+        self._ready.wait()
+
+    async def run_async(self):
+        # With the asyncio runtime the server runs on its loop instead
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(
+            self._handle, self._config['host'], self._config['port'])
+        LOG.info('Listening for webhooks on %s:%s',
+                 self._config['host'], self.port)
+
+    def shutdown(self):
+        if self._thread.is_alive():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+        elif self._server:
+            self._server.close()
+            for writer in list(self._writers):
+                writer.close()
+
+    def _serve(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._server = self._loop.run_until_complete(asyncio.start_server(
+                self._handle, self._config['host'], self._config['port']))
+            LOG.info('Listening for webhooks on %s:%s',
+                     self._config['host'], self.port)
+        finally:
+            self._ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            # Hang up on clients still connected and let their handlers end
+            for writer in list(self._writers):
+                writer.close()
+            tasks = asyncio.all_tasks(self._loop)
+            self._loop.run_until_complete(
+                asyncio.gather(*tasks, return_exceptions=True))
+            self._loop.run_until_complete(self._server.wait_closed())
+            self._loop.close()
+
+    @property
+    def port(self):
+        '''
+        The port listened on, which is picked by the system when configured
+        as 0.
+        '''
+        if self._server and self._server.sockets:
+            return self._server.sockets[0].getsockname()[1]
+        return self._config['port']
+
+    def get_room(self, room_name):
+        if room_name not in self._rooms:
+            self._rooms[room_name] = autobot.Room(
+                room_name, reply_handler=self.outbound(self._send_to_room))
+            while len(self._rooms) > self._config['max_rooms']:
+                self._rooms.popitem(last=False)
+        else:
+            self._rooms.move_to_end(room_name)
+        return self._rooms[room_name]
+
+    def _send_to_room(self, room, message):
+        self._buffer('rooms', room.name, message)
+
+    def _send_to_user(self, user, message):
+        self._buffer('users', user.name, message)
+
+    def _buffer(self, kind, name, message):
+        with self._replies_lock:
+            key = (kind, name)
+            if key not in self._replies:
+                self._replies[key] = collections.deque(
+                    maxlen=self._config['reply_buffer'])
+                while len(self._replies) > self._config['max_reply_buffers']:
+                    dropped, _ = self._replies.popitem(last=False)
+                    LOG.debug('Dropping the replies to %s %s', *dropped)
+            else:
+                self._replies.move_to_end(key)
+            self._replies[key].append(message)
+
+    def _take_replies(self, kind, name):
+        with self._replies_lock:
+            replies = self._replies.pop((kind, name), ())
+        return list(replies)
+
+    def _to_message(self, data):
+        if not isinstance(data, dict) or not isinstance(
+                data.get('text'), str):
+            raise ValueError('Every message needs a text')
+        for field in ('author', 'room', 'user'):
+            if not isinstance(data.get(field, ''), str):
+                raise ValueError('{} must be a string'.format(field))
+        mentions = data.get('mentions', [])
+        if not isinstance(mentions, list) or not all(
+                isinstance(name, str) for name in mentions):
+            raise ValueError('mentions must be a list of names')
+        if not isinstance(data.get('mention', False), bool):
+            raise ValueError('mention must be true or false')
+        text = data['text']
+        if data.get('user'):
+            reply_path = autobot.User(
+                data['user'], reply_handler=self.outbound(self._send_to_user))
+            author = data.get('author', data['user'])
+        else:
+            room_name = data.get('room')
+            if room_name:
+                reply_path = self.get_room(room_name)
+            else:
+                reply_path = self.default_room
+            author = data.get('author', 'webhook')
+        mentions = set(mentions)
+        if data.get('mention') or self.mention_name in text:
+            mentions.add(autobot.SELF_MENTION)
+        return autobot.Message(text, author, reply_path=reply_path,
+                               mentions=mentions)
+
+    def _enqueue(self, messages):
+        if hasattr(self._messageq, 'put_many'):
+            self._messageq.put_many(messages)
+        else:
+            for message in messages:
+                self._messageq.put(message)
+
+    async def _handle(self, reader, writer):
+        self._writers.add(writer)
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except ValueError as e:
+                    self._respond(writer, 400, {'error': str(e)}, False)
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                method, path, body, keep_alive = request
+                try:
+                    status, response = await self._route(method, path, body)
+                except Exception as e:
+                    LOG.error('Webhook request failed: %s', e)
+                    status, response = 500, {'error': 'Internal error'}
+                    keep_alive = False
+                self._respond(writer, status, response, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _read_request(self, reader):
+        '''
+        The method, path and body of the next request on a connection and
+        whether to keep the connection open after it, or None once the
+        client is done. The body is None when it is too large to be read.
+        Raises ValueError for requests that cannot be made sense of.
+        '''
+        line = await reader.readline()
+        if not line.strip():
+            return None
+        try:
+            method, path, version = line.decode('latin-1').split()
+        except ValueError:
+            raise ValueError('Malformed request line')
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if not line.strip():
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            length = -1
+        if length < 0:
+            raise ValueError('Malformed Content-Length')
+        if length > self._config['max_body_size']:
+            return method, path, None, False
+        body = await reader.readexactly(length) if length else b''
+        keep_alive = (version == 'HTTP/1.1' and
+                      headers.get('connection', '').lower() != 'close')
+        return method, path, body, keep_alive
+
+    async def _route(self, method, path, body):
+        if body is None:
+            return 413, {'error': 'Body too large'}
+        parts = path.split('?')[0].strip('/').split('/')
+        if parts == ['messages']:
+            if method != 'POST':
+                return 405, {'error': 'Use POST'}
+            return await self._post_messages(body)
+        if len(parts) == 2 and parts[0] in ('rooms', 'users'):
+            if method != 'GET':
+                return 405, {'error': 'Use GET'}
+            replies = self._take_replies(parts[0],
+                                         urllib.parse.unquote(parts[1]))
+            return 200, {'replies': replies}
+        return 404, {'error': 'Not found'}
+
+    async def _post_messages(self, body):
+        if self._messageq.qsize() >= self._config['max_pending']:
+            return 429, {'error': 'Too many messages waiting'}
+        try:
+            data = json.loads(body.decode('utf-8'))
+        except ValueError as e:
+            return 400, {'error': str(e)}
+        if not isinstance(data, list):
+            data = [data]
+        if len(data) > self._config['max_batch']:
+            return 413, {'error': 'Batches are limited to {} messages'.format(
+                self._config['max_batch'])}
+        if self._messageq.qsize() + len(data) > self._config['max_pending']:
+            return 429, {'error': 'Too many messages waiting'}
+        try:
+            messages = [self._to_message(item) for item in data]
+        except ValueError as e:
+            return 400, {'error': str(e)}
+        # Putting may block on a full queue, which must not stop the loop
+        await self._loop.run_in_executor(None, self._enqueue, messages)
+        return 202, {'accepted': len(messages)}
+
+    def _respond(self, writer, status, body, keep_alive):
+        payload = json.dumps(body).encode('utf-8')
+        headers = [
+            'HTTP/1.1 {} {}'.format(status, _REASONS[status]),
+            'Content-Type: application/json',
+            'Content-Length: {}'.format(len(payload)),
+            'Connection: {}'.format('keep-alive' if keep_alive else 'close'),
+        ]
+        if status == 429:
+            headers.append('Retry-After: 1')
+        writer.write('\r\n'.join(headers).encode('latin-1') +
+                     b'\r\n\r\n' + payload)
@@ -7,11 +7,24 @@ LOG = logging.getLogger(__name__)
 
 
 class XMPPService(autobot.Service):
+    '''
+    history decides what happens to delayed messages, like the history a
+    room replays when it is joined: drop them right away, pass them only to
+    callbacks registered with eavesdrop(history=True), or process them like
+    any other message.
+    '''
+    HISTORY_DROP = 'drop'
+    HISTORY_EAVESDROP = 'eavesdrop'
+    HISTORY_PROCESS = 'process'
+
     config_defaults = {
         'server': None,
         'username': None,
         'password': None,
         'real_name': None,
+        'send_rate': 2,
+        'send_burst': 5,
+        'history': 'drop',
     }
 
     def __init__(self, config):
@@ -20,9 +33,12 @@ class XMPPService(autobot.Service):
             self._config['username'],
             self._config['server'])
         LOG.debug('Initialising client with jid: %s', self.jid)
-        self._client = _XMPPClient(self.jid, self._config['password'], self)
+        self._client = self._create_client()
         self.real_name = self._config['real_name']
-        self.rooms = []
+        self._rooms = {}
+
+    def _create_client(self):
+        return _XMPPClient(self.jid, self._config['password'], self)
 
     def run(self):
         LOG.debug('Starting client with jid: %s', self.jid)
@@ -33,33 +49,47 @@ class XMPPService(autobot.Service):
         LOG.debug('Disconnecting from xmpp...')
         self._client.disconnect()
 
-    def _send_to_room(self, room, message, *args):
+    def _send_to_room(self, room, message):
         self._client.send_message(
             mto=room._internal.name,
-            mbody=message % args,
+            mbody=message,
             mtype='groupchat')
 
-    def _send_to_user(self, user, message, *args):
+    def _send_to_user(self, user, message):
         self._client.send_message(
             mto=user._internal.name,
-            mbody=message % args,
+            mbody=message,
             mtype='message')
 
     def get_room(self, room_name):
         # TODO: Decide what name of room we should use as input here
         # TODO: validate room existence here
-        room_obj = autobot.Room(room_name, reply_handler=self.send_to_room)
-        for u in self._client._room_plugin.rooms[room_name].values():
-            user = autobot.User(u.name, u.real_name)
-            room_obj.roster.append(user)
-
-        room_obj._internal.name = room_name
-        return room_obj
-
-    def _mention_parse(self, message):
-        mentions = []
+        if room_name not in self._rooms:
+            room_obj = autobot.Room(
+                room_name, reply_handler=self.outbound(self._send_to_room))
+            room_obj._internal.name = room_name
+            # Start from whoever the MUC plugin knows about, presence changes
+            # keep the roster up to date after that
+            occupants = self._client._room_plugin.rooms.get(room_name, {})
+            for nick in occupants:
+                room_obj.roster.add(self._occupant(room_name, nick))
+            self._rooms[room_name] = room_obj
+        return self._rooms[room_name]
+
+    def _occupant(self, room_name, nick):
+        user = autobot.User(nick,
+                            reply_handler=self.outbound(self._send_to_user))
+        user._internal.name = '{}/{}'.format(room_name, nick)
+        return user
+
+    def _mention_parse(self, message, room=None):
+        mentions = set()
+        if room:
+            mentions = room.roster.mentions(message)
+            mentions.discard(self.real_name)
+            mentions.discard(self._config['mention_name'])
         if self._config['mention_name'] in message:
-            mentions.append(autobot.SELF_MENTION)
+            mentions.add(autobot.SELF_MENTION)
 
         return mentions
 
@@ -70,31 +100,78 @@ class XMPPService(autobot.Service):
         return self._author
 
     def _message_received(self, xmpp_message):
-        LOG.debug('Message received from %s.', xmpp_message['from'].full)
-        if not xmpp_message['from'].resource == self.real_name:
+        sender = xmpp_message['from']
+        LOG.debug('Message received from %s.', sender.full)
+        if xmpp_message['type'] == 'groupchat':
+            if sender.resource == self.real_name:
+                return
+            room = self.get_room(sender.bare)
+            reply_path = room
+            author = sender.resource
+            identity = self._occupant_jid(sender.bare, sender.resource)
+        elif xmpp_message['type'] in ('chat', 'normal'):
             # TODO: Get User object and its parameters from server
-            msg = autobot.Message(xmpp_message['body'],
-                                  xmpp_message['from'],
-                                  reply_path=self.default_room,
-                                  mention_parse=self._mention_parse(xmpp_message['body']))
-            autobot.brain.messageq.put(msg)
+            room = None
+            reply_path = autobot.User(
+                sender.bare, reply_handler=self.outbound(self._send_to_user))
+            reply_path._internal.name = sender.full
+            author = sender.bare
+            identity = sender.bare
+        else:
+            return
+        delayed = bool(xmpp_message['delay']['stamp'])
+        history = self._config['history']
+        if delayed and history == self.HISTORY_DROP:
+            LOG.debug('Dropping delayed message from %s.', sender.full)
+            return
+        body = xmpp_message['body']
+        msg = autobot.Message(body,
+                              author,
+                              reply_path=reply_path,
+                              mentions=self._mention_parse(body, room),
+                              delayed=delayed and (
+                                  history != self.HISTORY_PROCESS),
+                              identity=identity)
+        self._messageq.put(msg)
+
+    def _occupant_jid(self, room_name, nick):
+        '''
+        The bare JID behind a nick in a room, which anyone can take, or None
+        when the room does not tell.
+        '''
+        occupant = self._client._room_plugin.rooms.get(room_name, {}).get(
+            nick, {})
+        jid = occupant.get('jid')
+        if not jid:
+            return None
+        if isinstance(jid, str):
+            jid = sleekxmpp.JID(jid)
+        return jid.bare
 
     def _session_start(self, *args):
         self._client.send_presence()
         self._client.get_roster()
-        self._client.join_room(self.default_room)
+        self._client.join_room(self.default_room.name)
 
     def _disconnected(self, *args):
         pass
 
-    def _user_online(self, *args):
-        pass
+    def _user_online(self, presence):
+        room = self._rooms.get(presence['from'].bare)
+        nick = presence['from'].resource
+        if room and nick and nick not in room.roster:
+            room.roster.add(self._occupant(room.name, nick))
 
-    def _user_offline(self, *args):
-        pass
+    def _user_offline(self, presence):
+        room = self._rooms.get(presence['from'].bare)
+        if room:
+            room.roster.remove(presence['from'].resource)
 
-    def _user_changed_status(self, *args):
-        pass
+    def _user_changed_status(self, presence):
+        if presence['type'] == 'unavailable':
+            self._user_offline(presence)
+        else:
+            self._user_online(presence)
 
     def _chat_topic(self, *args):
         pass
@@ -125,6 +202,8 @@ class _XMPPClient(sleekxmpp.ClientXMPP):
         self.add_event_handler("got_online", handlers._user_online)
         self.add_event_handler("got_offline", handlers._user_offline)
         self.add_event_handler("changed_status", handlers._user_changed_status)
+        self.add_event_handler("groupchat_presence",
+                               handlers._user_changed_status)
         # MUC subject events
         self.add_event_handler("groupchat_subject", handlers._chat_topic)
 
@@ -7,16 +7,19 @@ import autobot
 LOG = logging.getLogger(__name__)
 
 
-def eavesdrop(always=False, priority=1000):
+def eavesdrop(always=False, priority=1000, history=False):
     '''
     Always receive messages. Set priority to autobot.PRIORITY_ALWAYS if you
     want to catch all messages no matter if there is another match or not.
+    Set history to also receive delayed messages, such as the history
+    replayed when joining a room, which no other callback gets to see.
     '''
     if always:
         priority = autobot.PRIORITY_ALWAYS
 
     def wrapper(func):
         func._priority = priority
+        func._history = history
         callback = autobot.Callback(func)
         _add_callback(func, callback)
         return func
@@ -43,27 +46,31 @@ def respond_to(pattern, always=False, priority=30):
         priority = autobot.PRIORITY_ALWAYS
 
     def wrapper(func):
-        def condition(message):
-            return message.mentions_self() or message.direct_message()
-
-        def preprocessor(message):
-            mention_name = autobot.substitutions['mention_name']
-            if message.startswith(mention_name):
-                message = message[len(mention_name):].strip()
-            return message
-
         matcher = autobot.Matcher(
                 func,
                 pattern,
                 priority=priority,
-                condition=condition,
-                preprocessor=preprocessor
+                condition=_addressed,
+                preprocessor=_strip_mention
                 )
         _pattern_handler(matcher)
         return func
     return wrapper
 
 
+# Shared by all respond_to matchers, so that the brain's match cache only
+# has to evaluate them once per message
+def _addressed(message):
+    return message.mentions_self() or message.direct_message()
+
+
+def _strip_mention(message):
+    mention_name = autobot.substitutions['mention_name']
+    if message.startswith(mention_name):
+        message = message[len(mention_name):].strip()
+    return message
+
+
 def hear(pattern, always=False, priority=50):
     '''
     It will match the pattern provided against all messages processed.
@@ -21,6 +21,12 @@ class Events(DictObj):
     SUBSTITUTIONS_ALTERED = ('Triggers every time the substitutions object '
                              'is modified')
     MESSAGE_RECEIVED = 'A message has been posted on the message queue'
+    MESSAGE_PROCESSED = ('A message has been through all matchers and '
+                         'callbacks')
+    QUIT_REQUESTED = ('Something asked the bot to shut down, like a service '
+                      'that has no more messages')
+    THROTTLING_STARTED = ('Messages from an author or room are dropped for '
+                          'coming too fast')
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -49,11 +55,18 @@ class Events(DictObj):
                                 'event: %s which happens before before '
                                 'factory is available... skipping', event)
                     continue
-                handler.get_callback(self._factory)(context, event_args)
+                autobot.helpers.complete(
+                    handler.get_callback(self._factory)(context, event_args))
             else:
-                handler(context, event_args)
+                name = getattr(handler, '__qualname__', repr(handler))
+                autobot.helpers.complete(autobot.profiler.call(
+                    name, handler, context, event_args))
 
     def add_handler(self, handler):
+        # Every factory hands over the same plugin callbacks
+        event = self._find_key(handler.event)
+        if any(h is handler for h in self._handlers.get(event, [])):
+            return
         self.register(handler.event, handler)
 
     def register(self, event_ref, handler):
@@ -68,8 +81,22 @@ class Events(DictObj):
             return
         del(self._handlers[event][self._handlers[event].index(handler)])
 
+    def snapshot(self):
+        '''
+        The events, their handlers and the factory plugin handlers are run
+        with as they are now, to be put back by restore().
+        '''
+        handlers = {event: list(h) for event, h in self._handlers.items()}
+        return dict(self), handlers, self._factory
+
+    def restore(self, snapshot):
+        events, handlers, factory = snapshot
+        self.clear()
+        self.update(events)
+        self._handlers = handlers
+        self._factory = factory
+
     def _get_factory(self, context, event_args):
-        if not self._factory:
-            self._factory = context
-        else:
-            LOG.warn('Factory already exists when trying to add a new one...')
+        if self._factory:
+            LOG.debug('Replacing the factory plugin handlers are run with')
+        self._factory = context
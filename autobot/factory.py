@@ -1,3 +1,4 @@
+import collections
 import inspect
 import pkgutil
 import logging
@@ -6,6 +7,7 @@ import os
 import traceback
 
 from autobot import event, helpers, Plugin
+from autobot.cache import CachedStorage
 
 LOG = logging.getLogger(__name__)
 
@@ -16,6 +18,7 @@ class Factory(object):
         self._defaults = {}
         self._plugins = {}
         self._mapping = mapping
+        self._storage = None
 
     def start(self):
         path = self._config['core_path']
@@ -35,15 +38,17 @@ class Factory(object):
             full_name = 'autobot.{}.{}'.format(namespace, name)
             LOG.debug('Found plugin: %s', name)
 
-            if full_name in sys.modules:
-                continue
-            LOG.debug('Importing plugin: %s', name)
-            module = finder.find_module(full_name).load_module(full_name)
+            # Modules imported by other plugins or by an earlier factory are
+            # loaded already, and only the classes they define are plugins
+            module = sys.modules.get(full_name)
+            if module is None:
+                LOG.debug('Importing plugin: %s', name)
+                module = finder.find_module(full_name).load_module(full_name)
             classes = inspect.getmembers(module, inspect.isclass)
 
             for name, cls in classes:
                 name = name.lower()
-                if name.startswith('_'):
+                if name.startswith('_') or cls.__module__ != full_name:
                     continue
                 try:
                     plugin_config = self._get_plugin_config(cls)
@@ -90,8 +95,11 @@ class Factory(object):
                 instance = cls(plugin_config)
             else:
                 instance = cls()
-        methods = inspect.getmembers(instance, inspect.ismethod)
-        for m in [m[1] for m in methods if hasattr(m[1], '_callback_objects')]:
+        # Look the methods up on the class, as getting every member of the
+        # instance would evaluate properties, like the storage connections
+        functions = inspect.getmembers(type(instance), inspect.isfunction)
+        methods = [getattr(instance, name) for name, _ in functions]
+        for m in [m for m in methods if hasattr(m, '_callback_objects')]:
             for callback_obj in m._callback_objects:
                 if callback_obj.__class__ in self._mapping:
                     self._mapping[callback_obj.__class__](callback_obj)
@@ -105,7 +113,8 @@ class Factory(object):
         config = {}
 
         for base in cls.__bases__:
-            config.update(self._get_plugin_config(base, config=False))
+            config.update(self._get_plugin_config(base, defaults=defaults,
+                                                  config=False))
 
         if hasattr(cls, 'config_defaults') and defaults:
             config.update(cls.config_defaults)
@@ -119,6 +128,10 @@ class Factory(object):
 
         return config
 
+    @property
+    def plugins(self):
+        return dict(self._plugins)
+
     def get(self, plugin):
         plugin = plugin.lower()
         if plugin in self._plugins:
@@ -135,15 +148,33 @@ class Factory(object):
         return getattr(obj, func.__name__)
 
     def get_service(self):
-        plugin_name = self._config['service_plugin'] + 'service'
-        return self.get(plugin_name)
-
-    def get_storage(self):
-        plugin_name = self._config['storage_plugin'] + 'storage'
-        storage = self.get(plugin_name)
-        if '_internal' not in storage:
-            storage['_internal'] = {}
-        return storage
+        '''
+        The first of the configured services, which plugins reply through
+        unless they were handed a message from another one.
+        '''
+        return next(iter(self.get_services().values()))
+
+    def get_services(self):
+        names = self._config['service_plugin']
+        if isinstance(names, str):
+            names = [names]
+        services = collections.OrderedDict()
+        for name in names:
+            services[name] = self.get(name + 'service')
+        return services
+
+    def get_storage(self, plugin=None):
+        if plugin:
+            return self.get(plugin + 'storage')
+        if self._storage is None:
+            plugin_name = self._config['storage_plugin'] + 'storage'
+            storage = self.get(plugin_name)
+            cache_size = self._config.get('storage_cache_size')
+            if cache_size:
+                storage = CachedStorage(storage, cache_size,
+                                        self._config['storage_cache_mode'])
+            self._storage = storage
+        return self._storage
 
     def get_config(self):
         return self._config
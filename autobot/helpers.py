@@ -1,5 +1,11 @@
 import os.path
+import asyncio
+import collections
 import inspect
+import threading
+import math
+import time
+import sys
 
 def abs_path(dir):
     if not dir:
@@ -12,6 +18,195 @@ def abs_path(dir):
     return os.path.realpath(dir)
 
 
+def sizeof(obj, _seen=None):
+    '''
+    Approximates the memory held by an object by following the builtin
+    containers. Other objects are expected to account for what they hold in
+    their __sizeof__.
+    '''
+    seen = set() if _seen is None else _seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(sizeof(key, seen) + sizeof(value, seen)
+                    for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(sizeof(item, seen) for item in obj)
+    return size
+
+
+def percentile(values, percent):
+    '''
+    The nearest-rank percentile of a list of numbers, or None when empty.
+    '''
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(percent / 100.0 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def is_async(func):
+    '''
+    Whether calling func gives a coroutine, looking through wrappers like
+    the ones of the profiler.
+    '''
+    return asyncio.iscoroutinefunction(inspect.unwrap(func))
+
+
+class LoopThread(object):
+    '''
+    An asyncio loop running in a thread of its own, started when it is
+    first used. The coroutines of async handlers run in the threaded
+    runtime are all run on it, so that they share one loop along with the
+    async clients plugins keep around.
+    '''
+    def __init__(self, name='async'):
+        self._name = name
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    name=self._name, target=self._loop.run_forever)
+                self._thread.daemon = True
+                self._thread.start()
+            return self._loop
+
+    def run(self, coroutine):
+        '''
+        Runs a coroutine on the loop and waits for its result.
+        '''
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def stop(self):
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None:
+            return
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+loop_thread = LoopThread()
+
+
+def complete(result):
+    '''
+    Sees a coroutine given by an async handler through, as a task on the
+    loop running in this thread if there is one and otherwise on the loop of
+    loop_thread, waiting until it is done. Anything else is given back as
+    it is.
+    '''
+    if not asyncio.iscoroutine(result):
+        return result
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return loop_thread.run(result)
+    return loop.create_task(result)
+
+
+class TokenBucket(object):
+    '''
+    Allows rate events per second on average, with bursts of up to burst
+    events.
+    '''
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+        self._updated = now
+
+    def delay(self, now=None):
+        '''
+        Seconds until the next event is allowed.
+        '''
+        self._refill(now or time.monotonic())
+        if self._tokens >= 1:
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    def consume(self, now=None):
+        self._refill(now or time.monotonic())
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def full(self, now=None):
+        '''
+        Whether the bucket has refilled completely, as if it was never used.
+        '''
+        self._refill(now or time.monotonic())
+        return self._tokens >= self.burst
+
+
+class AhoCorasick(object):
+    '''
+    Finds which of a set of words occur in a text in a single pass over the
+    text, no matter how many words there are.
+    '''
+    def __init__(self, words):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [set()]
+        for word in words:
+            self._add(word)
+        self._link()
+
+    def _add(self, word):
+        state = 0
+        for char in word:
+            if char not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(set())
+                self._goto[state][char] = len(self._goto) - 1
+            state = self._goto[state][char]
+        if word:
+            self._output[state].add(word)
+
+    def _link(self):
+        queue = collections.deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                if self._fail[next_state] == next_state:
+                    self._fail[next_state] = 0
+                self._output[next_state] |= (
+                    self._output[self._fail[next_state]])
+
+    def find(self, text):
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            found |= self._output[state]
+        return found
+
+
 class DictObj(dict):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
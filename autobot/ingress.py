@@ -0,0 +1,228 @@
+import collections
+import threading
+import logging
+import time
+
+import autobot
+
+LOG = logging.getLogger(__name__)
+
+
+class Ingress(object):
+    '''
+    The message queue the brain reads from when several services run at the
+    same time. Every service puts its messages on a channel of its own, and
+    get() takes turns between the channels that have messages waiting using
+    smooth weighted round-robin, so a service with weight 2 gets twice the
+    turns of one with weight 1 while it is busy, and a flood on one service
+    cannot starve the others.
+    It has the same get(), put(), task_done() and join() as a queue.Queue,
+    where put() bypasses the channels, for things like shutdown signals.
+
+    With maxsize set every channel holds at most that many messages, and
+    policy decides what happens when a service puts a message on a full one:
+    BLOCK makes the service wait for room, DROP_OLDEST throws away the
+    message that has waited the longest, and DROP_PRIORITY throws away the
+    oldest message that neither mentions the bot nor is a direct message,
+    and only drops mentions when there is nothing else to drop.
+    '''
+    BLOCK = 'block'
+    DROP_OLDEST = 'drop-oldest'
+    DROP_PRIORITY = 'drop-priority'
+
+    def __init__(self, maxsize=0, policy=BLOCK):
+        if policy not in (self.BLOCK, self.DROP_OLDEST, self.DROP_PRIORITY):
+            raise ValueError('Unknown message queue policy: {}'.format(
+                policy))
+        self.maxsize = maxsize
+        self.policy = policy
+        self._channels = []
+        self._control = collections.deque()
+        self._mutex = threading.Lock()
+        self._not_empty = threading.Condition(self._mutex)
+        self._not_full = threading.Condition(self._mutex)
+        self._all_tasks_done = threading.Condition(self._mutex)
+        self._unfinished = 0
+        self._received = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+        self._shed_count = autobot.metrics.counter(
+            'autobot_messages_shed_total',
+            'Messages dropped from a full message queue')
+        self._queue_wait = autobot.metrics.histogram(
+            'autobot_message_queue_wait_seconds',
+            'Time messages waited in the message queue')
+        autobot.metrics.gauge('autobot_message_queue_size',
+                              'Messages waiting for the brain',
+                              function=self.qsize)
+
+    def channel(self, name, weight=1):
+        with self._mutex:
+            channel = _Channel(self, name, weight)
+            self._channels.append(channel)
+            return channel
+
+    @property
+    def channels(self):
+        return list(self._channels)
+
+    def put(self, item):
+        with self._mutex:
+            self._control.append(item)
+            self._unfinished += 1
+            self._not_empty.notify()
+
+    def _put(self, channel, items):
+        with self._mutex:
+            for item in items:
+                if self.maxsize and len(channel.items) >= self.maxsize:
+                    if self.policy == self.BLOCK:
+                        while len(channel.items) >= self.maxsize:
+                            self._not_full.wait()
+                    elif not self._shed(channel, item):
+                        continue
+                channel.items.append((time.time(), item))
+                self._unfinished += 1
+                self._not_empty.notify()
+
+    def _shed(self, channel, item):
+        '''
+        Makes room on a full channel by dropping a message, and tells whether
+        the new message should still be put on it.
+        '''
+        index = 0
+        if self.policy == self.DROP_PRIORITY:
+            index = next((i for i, (_, queued) in enumerate(channel.items)
+                          if not _important(queued)), None)
+            if index is None and not _important(item):
+                channel.shed += 1
+                self._count_shed(channel)
+                LOG.debug('Channel %s is full, dropped incoming message',
+                          channel.name)
+                return False
+            index = index or 0
+        del channel.items[index]
+        # The dropped message will never be marked done by the brain
+        self._unfinished -= 1
+        if not self._unfinished:
+            self._all_tasks_done.notify_all()
+        channel.shed += 1
+        self._count_shed(channel)
+        LOG.debug('Channel %s is full, dropped a queued message',
+                  channel.name)
+        return True
+
+    def get(self):
+        with self._mutex:
+            while True:
+                if self._control:
+                    return self._control.popleft()
+                channel = self._next_channel()
+                if channel:
+                    queued_at, item = channel.items.popleft()
+                    self._track_wait(time.time() - queued_at)
+                    self._not_full.notify_all()
+                    return item
+                self._not_empty.wait()
+
+    def _count_shed(self, channel):
+        self._shed_count.inc(service=channel.name)
+
+    def _track_wait(self, wait_time):
+        self._received += 1
+        self._wait_time += wait_time
+        self._max_wait_time = max(self._max_wait_time, wait_time)
+        self._queue_wait.observe(wait_time)
+
+    def _next_channel(self):
+        waiting = [c for c in self._channels if c.items]
+        if not waiting:
+            return None
+        total = 0
+        for channel in waiting:
+            channel.current += channel.weight
+            total += channel.weight
+        chosen = max(waiting, key=lambda c: c.current)
+        chosen.current -= total
+        return chosen
+
+    def task_done(self):
+        with self._mutex:
+            if self._unfinished <= 0:
+                raise ValueError('task_done() called too many times')
+            self._unfinished -= 1
+            if not self._unfinished:
+                self._all_tasks_done.notify_all()
+
+    def join(self):
+        with self._mutex:
+            while self._unfinished:
+                self._all_tasks_done.wait()
+
+    def qsize(self):
+        with self._mutex:
+            return len(self._control) + sum(len(c.items)
+                                            for c in self._channels)
+
+    def queued(self):
+        '''
+        Everything waiting in the queue, control items first and then the
+        messages of each channel.
+        '''
+        with self._mutex:
+            items = list(self._control)
+            for channel in self._channels:
+                items.extend(item for _, item in channel.items)
+            return items
+
+    def stats(self):
+        '''
+        The number of messages handed to the brain, how long they waited in
+        the queue on average and at most in seconds, and per channel the
+        number of messages waiting and the number shed.
+        '''
+        with self._mutex:
+            received = self._received
+            return {
+                'received': received,
+                'average_wait_time': (self._wait_time / received
+                                      if received else 0.0),
+                'max_wait_time': self._max_wait_time,
+                'channels': {c.name: {'queued': len(c.items),
+                                      'shed': c.shed}
+                             for c in self._channels},
+            }
+
+
+def _important(item):
+    return (getattr(item, 'mentions_self', None) is not None and
+            (item.mentions_self() or item.direct_message()))
+
+
+class _Channel(object):
+    def __init__(self, ingress, name, weight):
+        self.name = name
+        self.weight = weight
+        self.current = 0
+        self.shed = 0
+        self.items = collections.deque()
+        self._ingress = ingress
+
+    def put(self, item):
+        self._ingress._put(self, (item,))
+
+    def put_many(self, items):
+        '''
+        Puts several messages on the channel while taking the lock once.
+        '''
+        self._ingress._put(self, items)
+
+    def join(self):
+        '''
+        Waits until the brain is done with everything on the message queue,
+        not only with the messages of this channel.
+        '''
+        self._ingress.join()
+
+    def qsize(self):
+        return len(self.items)
@@ -1,5 +1,6 @@
 import os
 import sys
+import asyncio
 import threading
 import logging
 import toml
@@ -7,20 +8,21 @@ import argparse
 import queue
 
 import autobot
+import autobot.aio
 import autobot.config
+import autobot.ingress
+import autobot.migrate
+import autobot.throttle
 
 LOG = logging.getLogger(__name__)
 
 # TODO: Output formatter system
 # TODO: Make dev help and normal help output different things
 # TODO: HipChat Plugin
-# TODO: Core Admin Plugin
 # TODO: Plugin folder scaffolding script
 # TODO: Live plugin reloads using inotify
 # TODO: Testing using Behave
-# TODO: Create fake factory that satisfies the needs of the brain thread
 # TODO: Documentation using Sphinx
-# TODO: Redis Plugin
 # TODO: ACL..?
 # TODO: Nicer CLI than logger?
 
@@ -35,9 +37,61 @@ def parse_args():
     parser.add_argument('--custom-plugins', help='The folder in which '
                         'to look for custom plugins to execute with.',
                         default=os.curdir)
+    parser.add_argument('--profile', action='store_true',
+                        help='Profile plugins from the start and write a '
+                        'report when quitting')
+    parser.add_argument('--runtime', choices=('threads', 'asyncio'),
+                        help='Run on threads or on one asyncio loop, '
+                        'overriding the runtime setting')
+    parser.add_argument('--replay', metavar='TRANSCRIPT',
+                        help='Run the messages of a transcript through the '
+                        'stdio service and report throughput and latency')
+    parser.add_argument('--replay-speed', type=float, default=0,
+                        help='Replay at the recorded pace sped up this many '
+                        'times, 0 (the default) for as fast as possible')
+    commands = parser.add_subparsers(dest='command')
+    migrate = commands.add_parser(
+        'migrate', help='Copy all namespaces from one storage plugin to '
+        'another, e.g. "autobot migrate shelve sqlite"')
+    migrate.add_argument('source', help='The storage plugin to copy from')
+    migrate.add_argument('destination', help='The storage plugin to copy to')
+    migrate.add_argument('--chunk-size', type=int, default=1000,
+                         help='The number of keys to copy at a time')
     return parser.parse_args()
 
 
+def migrate_storage(factory, args):
+    source = factory.get_storage(args.source)
+    destination = factory.get_storage(args.destination)
+    try:
+        autobot.migrate.migrate(source, destination, args.chunk_size)
+    except autobot.migrate.MigrationError as e:
+        LOG.error(e)
+        sys.exit(1)
+    finally:
+        source.close()
+        destination.close()
+
+
+def run_async(factory, config, matchers, catchalls, messageq, scheduleq):
+    runtime = autobot.aio.AsyncRuntime(
+        factory, matchers, catchalls, messageq, scheduleq,
+        config.get('scheduler_resolution'),
+        config.get('async_concurrency', 100),
+        config.get('async_executor_workers'),
+        config.get('match_cache_size', 0),
+        autobot.throttle.from_config(config))
+    autobot.event.register(autobot.event.QUIT_REQUESTED,
+                           lambda context, event_args: runtime.stop())
+    try:
+        asyncio.run(runtime.run(factory.get_services(),
+                                config.get('service_weights', {})))
+    except KeyboardInterrupt:
+        pass
+    if autobot.profiler.enabled:
+        autobot.profiler.report()
+
+
 def main():
     args = parse_args()
     if args.debug:
@@ -51,12 +105,23 @@ def main():
         with open(f) as conf:
             config.update(toml.loads(conf.read()))
 
+    if args.replay:
+        config['service_plugin'] = 'stdio'
+        stdio = config.setdefault('StdioService', {})
+        stdio['replay'] = args.replay
+        stdio['replay_speed'] = args.replay_speed
+
     matchers = []
     catchalls = []
     event_callbacks = autobot.event
     workq = queue.Queue()
-    messageq = queue.Queue()
+    messageq = autobot.ingress.Ingress(config.get('message_queue_size', 0),
+                                       config.get('message_queue_policy',
+                                                  'block'))
     scheduleq = queue.Queue()
+    autobot.memory.track('messages', messageq)
+    autobot.memory.track('work', workq)
+    autobot.memory.track('schedule', scheduleq)
     mapping = {
             autobot.Callback: catchalls.append,
             autobot.Matcher: matchers.append,
@@ -68,7 +133,26 @@ def main():
     LOG.debug('Importing plugins!')
     factory.start()
 
-    brain = autobot.brain.Brain(factory, matchers, catchalls, messageq, workq)
+    if args.command == 'migrate':
+        return migrate_storage(factory, args)
+
+    autobot.tracer.configure(config.get('trace_sample_rate'),
+                             config.get('trace_file'))
+    autobot.profiler.directory = config.get('profile_dir', 'profiles')
+    if args.profile:
+        autobot.profiler.start()
+
+    if config.get('metrics_port'):
+        autobot.metrics.serve(config['metrics_port'],
+                              config.get('metrics_host', '127.0.0.1'))
+
+    if (args.runtime or config.get('runtime')) == 'asyncio':
+        return run_async(factory, config, matchers, catchalls, messageq,
+                         scheduleq)
+
+    brain = autobot.brain.Brain(factory, matchers, catchalls, messageq, workq,
+                                config.get('match_cache_size', 0),
+                                throttle=autobot.throttle.from_config(config))
     brain_thread = threading.Thread(name='brain', target=brain.boot)
 
     scheduler = autobot.scheduler.Scheduler(
@@ -77,28 +161,39 @@ def main():
     scheduler_thread = threading.Thread(name='timer', target=scheduler.boot)
 
     worker_pool = autobot.workers.WorkerPool(workq)
+    services = []
+    quit_requested = threading.Event()
+    autobot.event.register(autobot.event.QUIT_REQUESTED,
+                           lambda context, event_args: quit_requested.set())
 
     try:
         worker_pool.start()
         brain_thread.start()
         scheduler_thread.start()
 
-        LOG.debug('Starting service listener!')
-        service = factory.get_service()
-        service.set_message_queue(messageq)
-        service.start()
+        weights = config.get('service_weights', {})
+        for name, service in factory.get_services().items():
+            LOG.debug('Starting %s service listener!', name)
+            service.set_message_queue(
+                messageq.channel(name, weights.get(name, 1)))
+            service.start()
+            services.append(service)
 
         # Make sure the main thread is blocking so we can catch the interrupt
-        brain_thread.join()
-        scheduler_thread.join()
-
+        quit_requested.wait()
     except (KeyboardInterrupt, SystemExit):
-        LOG.info('\nI have been asked to quit nicely, and so I will!')
-        scheduler.shutdown()
-        service.shutdown()
-        brain.shutdown()
-        worker_pool.shutdown()
-        sys.exit()
+        pass
+
+    LOG.info('\nI have been asked to quit nicely, and so I will!')
+    scheduler.shutdown()
+    for service in services:
+        service.stop()
+    brain.shutdown()
+    worker_pool.shutdown()
+    autobot.helpers.loop_thread.stop()
+    if autobot.profiler.enabled:
+        autobot.profiler.report()
+    sys.exit()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,202 @@
+import collections
+import tracemalloc
+import threading
+import logging
+import types
+import sys
+import os
+import io
+
+import autobot
+
+LOG = logging.getLogger(__name__)
+
+# Never followed when sizing, as they are shared by everything
+_OPAQUE = (types.ModuleType, type, types.FunctionType, types.MethodType,
+           types.BuiltinFunctionType, threading.Thread)
+
+
+def _deep_size(root, seen=None):
+    '''
+    Approximates the memory held by root, following builtin containers and
+    the attributes of plain objects. Other plugins, services, storage and
+    the factory are left out, so that a plugin is not blamed for what it
+    only refers to.
+    '''
+    shared = (autobot.Plugin, autobot.Service, autobot.Storage,
+              autobot.Factory)
+    seen = set() if seen is None else seen
+    size = 0
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, _OPAQUE):
+            continue
+        if obj is not root and isinstance(obj, shared):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            for key, value in list(obj.items()):
+                stack.append(key)
+                stack.append(value)
+        elif isinstance(obj, (list, tuple, set, frozenset,
+                              collections.deque)):
+            stack.extend(list(obj))
+        elif (hasattr(obj, '__dict__') and
+                type(obj).__sizeof__ is object.__sizeof__):
+            # Objects with a __sizeof__ of their own already count what
+            # they hold
+            stack.append(vars(obj))
+    return size
+
+
+def _queued(queue):
+    if hasattr(queue, 'queued'):
+        return queue.queued()
+    with queue.mutex:
+        return list(queue.queue)
+
+
+def _rss():
+    '''
+    The resident set size of the process in bytes, where /proc has it.
+    '''
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+
+def _format_size(size):
+    if abs(size) < 1024:
+        return '{}B'.format(size)
+    for unit in ('KiB', 'MiB', 'GiB'):
+        size /= 1024
+        if abs(size) < 1024:
+            break
+    return '{:.1f}{}'.format(size, unit)
+
+
+class Memory(object):
+    '''
+    Approximates what the bot is holding on to, to find out where memory
+    goes when a long running bot keeps growing: every loaded plugin, the
+    storage namespaces read into memory and the queues between the threads,
+    which main() registers with track(). Sizes are found by walking the
+    objects, so they are estimates and asking for them takes a while with
+    a lot of state.
+    For what the sizes miss, start_tracing() turns on tracemalloc, after
+    which top() gives the lines that allocated the most since. tracemalloc
+    slows down every allocation, so it is only on while asked for.
+    '''
+    def __init__(self):
+        self._queues = collections.OrderedDict()
+        self._baseline = None
+        self._lock = threading.Lock()
+
+    def track(self, name, queue):
+        self._queues[name] = queue
+
+    def plugins(self, factory):
+        '''
+        The approximate bytes held by each loaded plugin, largest first.
+        '''
+        sizes = [(name, _deep_size(plugin))
+                 for name, plugin in factory.plugins.items()]
+        return sorted(sizes, key=lambda entry: entry[1], reverse=True)
+
+    def namespaces(self, storage):
+        '''
+        The bytes each namespace read into memory holds and the bytes it
+        took in the backend when it was read, largest first.
+        '''
+        stats = storage.stats()
+        sizes = [(name, size, stats.get(name, {}).get('size'))
+                 for name, size in storage.memory_usage().items()]
+        return sorted(sizes, key=lambda entry: entry[1], reverse=True)
+
+    def queues(self):
+        '''
+        The number of items waiting in each tracked queue and the bytes
+        they hold.
+        '''
+        sizes = []
+        for name, queue in list(self._queues.items()):
+            items = _queued(queue)
+            sizes.append((name, len(items), _deep_size(items)))
+        return sizes
+
+    @property
+    def tracing(self):
+        return tracemalloc.is_tracing()
+
+    def start_tracing(self, frames=1):
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+            self._baseline = tracemalloc.take_snapshot()
+        LOG.info('Tracing memory allocations')
+
+    def stop_tracing(self):
+        with self._lock:
+            tracemalloc.stop()
+            self._baseline = None
+        LOG.info('Stopped tracing memory allocations')
+
+    def top(self, count=10):
+        '''
+        The lines that allocated the most memory still held since tracing
+        was started, as tracemalloc statistics.
+        '''
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                return []
+            snapshot = tracemalloc.take_snapshot()
+            baseline = self._baseline
+        # Leave out what tracing and sizing allocate themselves
+        ignore = (tracemalloc.Filter(False, tracemalloc.__file__),
+                  tracemalloc.Filter(False, __file__),
+                  tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+                  tracemalloc.Filter(False, '<unknown>'))
+        snapshot = snapshot.filter_traces(ignore)
+        if baseline is None:
+            statistics = snapshot.statistics('lineno')
+        else:
+            statistics = snapshot.compare_to(baseline.filter_traces(ignore),
+                                             'lineno')
+        return statistics[:count]
+
+    def report(self, factory, top=10):
+        out = io.StringIO()
+        rss = _rss()
+        if rss is not None:
+            out.write('Resident set size {}\n'.format(_format_size(rss)))
+
+        out.write('Plugins\n')
+        for name, size in self.plugins(factory)[:top]:
+            out.write('  {:<30} {:>10}\n'.format(name, _format_size(size)))
+
+        storage = factory.get_storage()
+        out.write('Storage namespaces ({})\n'.format(type(storage).__name__))
+        for name, size, stored in self.namespaces(storage)[:top]:
+            out.write('  {:<30} {:>10} {:>10} stored\n'.format(
+                name, _format_size(size),
+                _format_size(stored) if stored is not None else '?'))
+        if hasattr(storage, 'cache_stats'):
+            cache = storage.cache_stats()
+            out.write('  cache holds {} of {} in {} namespaces\n'.format(
+                _format_size(cache['size']), _format_size(cache['max_size']),
+                cache['namespaces']))
+
+        out.write('Queues\n')
+        for name, length, size in self.queues():
+            out.write('  {:<30} {:>10} {:>6} items\n'.format(
+                name, _format_size(size), length))
+
+        if self.tracing:
+            out.write('Top allocations since tracing started\n')
+            for statistic in self.top(top):
+                out.write('  {}\n'.format(statistic))
+        return out.getvalue()
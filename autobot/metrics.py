@@ -0,0 +1,256 @@
+import collections
+import http.server
+import threading
+import bisect
+import logging
+
+LOG = logging.getLogger(__name__)
+
+# Seconds, from a tenth of a millisecond up to ten seconds
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs))
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(object):
+    kind = None
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._lock = threading.Lock()
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.description),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        lines.extend(self._samples())
+        return '\n'.join(lines)
+
+    def _samples(self):
+        raise NotImplementedError()
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, description):
+        super().__init__(name, description)
+        self._values = collections.defaultdict(int)
+
+    def inc(self, amount=1, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] += amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return ['{}{} {}'.format(self.name, _format_labels(key),
+                                 _format_value(value))
+                for key, value in values]
+
+
+class Gauge(_Metric):
+    '''
+    A value that goes up and down, or is read from function when rendered.
+    '''
+    kind = 'gauge'
+
+    def __init__(self, name, description, function=None):
+        super().__init__(name, description)
+        self._values = collections.defaultdict(int)
+        self._function = function
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] += amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        self._function = function
+
+    def value(self, **labels):
+        if self._function:
+            return self._function()
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+
+    def _samples(self):
+        if self._function:
+            try:
+                values = [((), self._function())]
+            except Exception as e:
+                LOG.debug('Could not read gauge %s: %s', self.name, e)
+                values = []
+        else:
+            with self._lock:
+                values = sorted(self._values.items())
+        return ['{}{} {}'.format(self.name, _format_labels(key),
+                                 _format_value(value))
+                for key, value in values]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            if key not in self._series:
+                self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series = self._series[key]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels):
+        with self._lock:
+            series = self._series.get(_label_key(labels))
+            return series[2] if series else 0
+
+    def total(self, **labels):
+        with self._lock:
+            series = self._series.get(_label_key(labels))
+            return series[1] if series else 0.0
+
+    def _samples(self):
+        with self._lock:
+            series = sorted((key, (list(counts), total, count))
+                            for key, (counts, total, count)
+                            in self._series.items())
+        lines = []
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            bounds = self.buckets + (float('inf'),)
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                lines.append('{}_bucket{} {}'.format(
+                    self.name, _format_labels(key, [('le', _format_value(
+                        float(bound)))]), cumulative))
+            lines.append('{}_sum{} {}'.format(
+                self.name, _format_labels(key), _format_value(total)))
+            lines.append('{}_count{} {}'.format(
+                self.name, _format_labels(key), count))
+        return lines
+
+
+class Metrics(object):
+    '''
+    Keeps the counters, gauges and histograms measuring the bot, and renders
+    them in the Prometheus text format. Metrics are created the first time
+    they are asked for and the same one is handed out after that, so code
+    can ask for its metrics by name wherever it measures something.
+    serve() makes them available over HTTP for Prometheus to scrape.
+    '''
+    def __init__(self):
+        self._metrics = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._server = None
+
+    def _get(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, *args, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, cls):
+                raise ValueError('{} is a {}, not a {}'.format(
+                    name, metric.kind, cls.kind))
+            return metric
+
+    def counter(self, name, description=''):
+        return self._get(Counter, name, description)
+
+    def gauge(self, name, description='', function=None):
+        gauge = self._get(Gauge, name, description)
+        if function:
+            gauge.set_function(function)
+        return gauge
+
+    def histogram(self, name, description='', buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, description, buckets)
+
+    def __getitem__(self, name):
+        return self._metrics[name]
+
+    def __contains__(self, name):
+        return name in self._metrics
+
+    def __iter__(self):
+        return iter(list(self._metrics))
+
+    def render(self, prefix=''):
+        with self._lock:
+            metrics = [m for name, m in self._metrics.items()
+                       if name.startswith(prefix)]
+        return ''.join(metric.render() + '\n' for metric in metrics)
+
+    def serve(self, port, host='127.0.0.1'):
+        '''
+        Serves the metrics on http://host:port/metrics from a thread.
+        '''
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                LOG.debug('Metrics request: ' + format, *args)
+
+        self._server = http.server.ThreadingHTTPServer((host, port), Handler)
+        thread = threading.Thread(name='metrics',
+                                  target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        LOG.info('Serving metrics on http://%s:%s/metrics', host,
+                 self._server.server_address[1])
+        return self._server.server_address[1]
+
+    def shutdown(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -0,0 +1,55 @@
+import logging
+import time
+
+LOG = logging.getLogger(__name__)
+
+
+class MigrationError(Exception):
+    pass
+
+
+def migrate(source, destination, chunk_size=1000, progress=print):
+    '''
+    Copies every namespace of one storage to another, replacing namespaces
+    with the same name in the destination. Namespaces are streamed from the
+    source in chunks and written to the destination chunk by chunk, so only
+    about a chunk of data is held in memory if both backends support partial
+    reads. A destination without them writes whole namespaces, so those are
+    built up in memory and written once. Afterwards the number of keys in
+    every copied namespace is compared to what was read from the source.
+    '''
+    start_time = time.time()
+    if not destination.partial_reads:
+        LOG.warning('%s writes whole namespaces, every namespace is kept in '
+                    'memory until it is copied', type(destination).__name__)
+    counts = {}
+    for name in source.names():
+        if name in destination:
+            del destination[name]
+        destination[name] = {}
+        destination.sync()
+        copied = 0
+        for chunk in source.stream(name, chunk_size):
+            destination[name].update(chunk)
+            copied += len(chunk)
+            if destination.partial_reads:
+                destination.unload(name)
+            progress('{}: {} keys copied'.format(name, copied))
+        destination.unload(name)
+        counts[name] = copied
+
+    mismatches = []
+    for name, copied in counts.items():
+        stored = len(destination[name])
+        destination.unload(name)
+        if stored != copied:
+            mismatches.append(name)
+            progress('{}: {} keys read but {} stored!'.format(
+                name, copied, stored))
+
+    progress('Copied {} keys in {} namespaces in {:.1f}s'.format(
+        sum(counts.values()), len(counts), time.time() - start_time))
+    if mismatches:
+        raise MigrationError('Key counts differ for namespaces: {}'.format(
+            ', '.join(mismatches)))
+    return counts
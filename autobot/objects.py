@@ -1,23 +1,45 @@
 import functools
 import collections
+import collections.abc
+import contextlib
 import datetime
+import threading
 import logging
+import string
+import time
 import regex
 import autobot
 from autobot.errors import ConfigurationMissingError
 import hashlib
+import pickle
+from . import helpers
+from . import outbound
 from .helpers import DictObj
 
 LOG = logging.getLogger(__name__)
 
 
 class Message(object):
-    def __init__(self, message, author, reply_path=None, mentions=[]):
+    '''
+    A delayed message is one that was sent before the bot saw it, such as
+    the history a chat server replays when joining a room. Those only reach
+    callbacks that asked for history, see autobot.eavesdrop.
+    The identity is who the service vouches the message is from, like the
+    bare JID of an XMPP account, unlike the author it is not up to whoever
+    sent the message. It is None when the service can not tell, like for a
+    nick in a room that hides the JIDs of its occupants.
+    '''
+    def __init__(self, message, author, reply_path=None, mentions=[],
+                 delayed=False, identity=None):
         assert issubclass(type(reply_path), ChatObject)
         self._message = message
         self._author = author
+        self._identity = identity
         self._reply_path = reply_path
         self._mentions = mentions
+        self._delayed = delayed
+        self._received = time.time()
+        self.trace = autobot.tracer.start(self)
 
     def mentions(self, username):
         return username in self._mentions
@@ -46,6 +68,22 @@ class Message(object):
     def author(self):
         return self._author
 
+    @property
+    def identity(self):
+        return self._identity
+
+    @property
+    def reply_path(self):
+        return self._reply_path
+
+    @property
+    def delayed(self):
+        return self._delayed
+
+    @property
+    def received(self):
+        return self._received
+
 
 class ChatObject(object):
     def __init__(self, name, reply_handler):
@@ -56,12 +94,19 @@ class ChatObject(object):
     def say(self, message, *args):
         if not self._reply_handler:
             raise NotImplementedError()
-        self._reply_handler(self, message, *args)
+        trace = autobot.tracer.current()
+        if trace:
+            with trace.span('say', target=self.name):
+                self._reply_handler(self, message, *args)
+        else:
+            self._reply_handler(self, message, *args)
 
 
 class Room(ChatObject):
     def __init__(self, name, topic=None, roster=None, reply_handler=None):
         super().__init__(name, reply_handler)
+        if not isinstance(roster, Roster):
+            roster = Roster(roster)
         self.roster = roster
         self.topic = topic
 
@@ -84,6 +129,57 @@ class User(ChatObject):
         return self.name
 
 
+class Roster(object):
+    '''
+    The users of a room, indexed by name so that services can keep it up to
+    date from presence changes. Mentions are found with an automaton over the
+    names that is rebuilt on first use after the roster has changed, so that
+    finding them does not get slower with the size of the room.
+    '''
+    def __init__(self, users=None):
+        self._users = {}
+        self._automaton = None
+        self._lock = threading.Lock()
+        for user in users or []:
+            self.add(user)
+
+    def add(self, user):
+        with self._lock:
+            self._users[user.name] = user
+            self._automaton = None
+
+    # For code treating the roster as a list
+    append = add
+
+    def remove(self, name):
+        with self._lock:
+            self._automaton = None
+            return self._users.pop(name, None)
+
+    def get(self, name, default=None):
+        return self._users.get(name, default)
+
+    def mentions(self, text):
+        '''
+        Gives the names of the users mentioned anywhere in the text.
+        '''
+        automaton = self._automaton
+        if automaton is None:
+            with self._lock:
+                automaton = helpers.AhoCorasick(list(self._users))
+                self._automaton = automaton
+        return automaton.find(text)
+
+    def __contains__(self, name):
+        return name in self._users
+
+    def __iter__(self):
+        return iter(list(self._users.values()))
+
+    def __len__(self):
+        return len(self._users)
+
+
 class MetaPlugin(type):
     def __new__(cls, name, bases, namespace, **kwargs):
         for method in namespace.values():
@@ -107,51 +203,481 @@ class Plugin(metaclass=MetaPlugin):
 
     @property
     def storage(self):
-        if not self._storage:
+        if self._storage is None:
             storage = self._factory.get_storage()
             # Let's namespace the plugin's storage
-            name = type(self).__name__
-            if name not in storage:
-                storage[name] = {}
-            self._storage = storage[name]
+            self._storage = storage.namespace(type(self).__name__)
 
         return self._storage
 
 
 class Storage(collections.UserDict):
+    '''
+    Storage plugins map namespace names, one per plugin, to the mappings the
+    plugins keep their state in. Since every storage plugin on the path is
+    loaded at boot, the backend is not opened until it is first used, and a
+    namespace is not read until it is first accessed. The time it took to
+    load each namespace and its size in the backend is kept in stats().
+
+    Plugins are handled on the brain thread, the worker threads and the
+    scheduler at the same time, so every namespace has a lock of its own.
+    Looking up a namespace gives a Namespace which holds that lock for every
+    operation, and sync() only holds it while the namespace is handed to
+    store(), which means that syncing one namespace never blocks handlers
+    working on another.
+    Backends implement open(), close() and store(), plus flush() if writes
+    are batched. The rest defaults to using the mapping open() returned.
+    Backends whose namespaces can be read a key at a time set partial_reads.
+    '''
+    partial_reads = False
+
+    def __init__(self, config=None):
+        self._config = config
+        self._handle = None
+        self._stats = {}
+        self._loaded = {}
+        self._namespaces = {}
+        self._locks = {}
+        self._guard = threading.RLock()
+        self._sync_time = autobot.metrics.histogram(
+            'autobot_storage_sync_seconds',
+            'Time taken to write loaded namespaces to storage')
+
+    @property
+    def data(self):
+        with self._guard:
+            if self._handle is None:
+                LOG.debug('Opening %s...', type(self).__name__)
+                self._handle = self.open()
+        return self._handle
+
+    @property
+    def opened(self):
+        return self._handle is not None
+
+    def lock(self, name):
+        with self._guard:
+            if name not in self._locks:
+                self._locks[name] = threading.RLock()
+            return self._locks[name]
+
+    def transaction(self, name):
+        return self[name].transaction()
+
+    def load(self, name):
+        '''
+        Gives the backend mapping of a namespace, reading it on first access.
+        '''
+        with self.lock(name):
+            if name not in self._loaded:
+                start_time = time.time()
+                self._loaded[name] = self.fetch(name)
+                self._stats[name] = {
+                    'load_time': (time.time() - start_time) * 1000,
+                    'size': self.namespace_size(name),
+                }
+                LOG.debug('Loaded namespace %s in %0.2fms (%s bytes)', name,
+                          self._stats[name]['load_time'],
+                          self._stats[name]['size'])
+            return self._loaded[name]
+
+    def __getitem__(self, name):
+        self.load(name)
+        with self._guard:
+            if name not in self._namespaces:
+                self._namespaces[name] = Namespace(self, name)
+            return self._namespaces[name]
+
+    def __setitem__(self, name, value):
+        with self.lock(name):
+            self._loaded.pop(name, None)
+            self.store(name, value)
+
+    def __delitem__(self, name):
+        with self.lock(name):
+            self._loaded.pop(name, None)
+            self.remove(name)
+
+    def __contains__(self, name):
+        return name in self._loaded or self.exists(name)
+
+    def __iter__(self):
+        return iter(self.names())
+
+    def __len__(self):
+        return len(self.names())
+
+    def namespace(self, name):
+        with self.lock(name):
+            if name not in self:
+                self[name] = {}
+            return self[name]
+
+    def stats(self):
+        return {name: dict(stats) for name, stats in self._stats.items()}
+
+    def memory_usage(self):
+        '''
+        The approximate bytes held in memory by each loaded namespace.
+        '''
+        with self._guard:
+            names = list(self._loaded)
+        sizes = {}
+        for name in names:
+            with self.lock(name):
+                if name in self._loaded:
+                    sizes[name] = helpers.sizeof(self._loaded[name])
+        return sizes
+
+    def stream(self, name, chunk_size=1000):
+        '''
+        Yields the stored items of a namespace in lists of at most chunk_size
+        without loading the namespace. Backends without partial reads still
+        have to read the whole namespace to do this.
+        '''
+        namespace = self.fetch(name)
+        if self.partial_reads:
+            items = namespace.stream()
+        else:
+            items = namespace.items()
+        chunk = []
+        for item in items:
+            chunk.append(item)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def unload(self, name):
+        '''
+        Writes a loaded namespace and drops it from memory.
+        '''
+        with self.lock(name):
+            if name in self._loaded:
+                self.store(name, self._loaded.pop(name))
+        self.flush()
+
     def sync(self):
+        if not self.opened:
+            return
+        start_time = time.time()
+        for name in list(self._loaded):
+            with self.lock(name):
+                if name in self._loaded:
+                    self.store(name, self._loaded[name])
+        self.flush()
+        self._sync_time.observe(time.time() - start_time,
+                                storage=type(self).__name__)
+
+    def namespace_size(self, name):
+        '''
+        The size of the stored namespace in bytes, if the backend knows it.
+        '''
+        return None
+
+    def changed(self, name):
+        '''
+        Called with the namespace lock held after a key has been set or
+        deleted through a Namespace.
+        '''
+        pass
+
+    def fetch(self, name):
+        return self.data[name]
+
+    def store(self, name, value):
+        '''
+        Called with the namespace lock held, either with a new namespace or
+        with a loaded one which should be written (or snapshotted for writing
+        in flush()).
+        '''
+        raise NotImplementedError()
+
+    def remove(self, name):
+        del self.data[name]
+
+    def exists(self, name):
+        return name in self.data
+
+    def names(self):
+        return list(self.data)
+
+    def flush(self):
+        pass
+
+    def open(self):
         raise NotImplementedError()
 
     def close(self):
         raise NotImplementedError()
 
 
+class Namespace(collections.abc.MutableMapping):
+    '''
+    A plugin's view of its part of the storage. Every operation holds the
+    namespace lock, and transaction() holds it for a whole block so that a
+    plugin can read and modify stored values without another thread or a
+    sync seeing them half-way:
+
+        with self.storage.transaction() as storage:
+            storage['counter'] += 1
+    '''
+    def __init__(self, storage, name):
+        self.name = name
+        self._storage = storage
+        self._lock = storage.lock(name)
+
+    @property
+    def data(self):
+        return self._storage.load(self.name)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self._lock:
+            yield self
+
+    def __getitem__(self, key):
+        with self._lock:
+            return self.data[key]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self.data[key] = value
+            self._storage.changed(self.name)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self.data[key]
+            self._storage.changed(self.name)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self.data
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self.data))
+
+    def __len__(self):
+        with self._lock:
+            return len(self.data)
+
+    def __repr__(self):
+        return '<Namespace {}>'.format(self.name)
+
+
+class KeyedNamespace(collections.abc.MutableMapping):
+    '''
+    Base for backends that store every key of a namespace on its own. Keys
+    are read the first time they are accessed. Since plugins change stored
+    values in place, changes() pickles the loaded values and compares them
+    to what was last written, so only the keys that changed get written.
+    With only_touched set, just the keys accessed since the previous
+    changes() are considered, which keeps the cost of a sync proportional
+    to what was used rather than to what was loaded.
+    Backends implement read(key), giving the stored pickle or None, and
+    stored_keys().
+    '''
+    only_touched = False
+
+    def __init__(self, name, replace=False):
+        self.name = name
+        self._values = {}
+        self._written = {}
+        self._deleted = set()
+        self._touched = set()
+        self._replace = replace
+        self._lock = threading.RLock()
+
+    def read(self, key):
+        raise NotImplementedError()
+
+    def stored_keys(self):
+        raise NotImplementedError()
+
+    def _load(self, key):
+        if key in self._values:
+            return True
+        if key in self._deleted or self._replace:
+            return False
+        blob = self.read(key)
+        if blob is None:
+            return False
+        self._values[key] = pickle.loads(blob)
+        self._written[key] = blob
+        return True
+
+    def __getitem__(self, key):
+        with self._lock:
+            if not self._load(key):
+                raise KeyError(key)
+            self._touched.add(key)
+            return self._values[key]
+
+    def __setitem__(self, key, value):
+        if not isinstance(key, str):
+            raise TypeError('Storage keys must be strings')
+        with self._lock:
+            self._values[key] = value
+            self._deleted.discard(key)
+            self._touched.add(key)
+
+    def __delitem__(self, key):
+        with self._lock:
+            if not self._load(key):
+                raise KeyError(key)
+            del self._values[key]
+            self._written.pop(key, None)
+            self._touched.discard(key)
+            self._deleted.add(key)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._load(key)
+
+    def __iter__(self):
+        with self._lock:
+            keys = set(self._values)
+            if not self._replace:
+                keys.update(self.stored_keys())
+            keys.difference_update(self._deleted)
+        return iter(sorted(keys))
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def stream(self):
+        '''
+        Yields the stored items without keeping them loaded.
+        '''
+        for key in self.stored_keys():
+            blob = self.read(key)
+            if blob is not None:
+                yield key, pickle.loads(blob)
+
+    def __sizeof__(self):
+        # Only what has been loaded is held in memory
+        return (object.__sizeof__(self) + helpers.sizeof(self._values) +
+                helpers.sizeof(self._written))
+
+    def changes(self):
+        '''
+        Gives whether the stored namespace should be cleared, the keys to
+        write along with their pickles and the keys to delete.
+        '''
+        with self._lock:
+            keys = self._touched if self.only_touched else self._values
+            upserts = []
+            for key in keys:
+                if key not in self._values:
+                    continue
+                blob = pickle.dumps(self._values[key], pickle.HIGHEST_PROTOCOL)
+                if self._written.get(key) != blob:
+                    upserts.append((key, blob))
+            self._touched = set()
+            return self._replace, upserts, list(self._deleted)
+
+    def committed(self, upserts, deletes):
+        with self._lock:
+            self._written.update(upserts)
+            self._deleted.difference_update(deletes)
+            self._replace = False
+
+
 class Service(object):
-    config_defaults = {'mention_name': 'autobot', 'rooms': []}
+    '''
+    Replies are sent through an outbound queue with a sender thread of its
+    own, see autobot.outbound.Outbox. send_rate is the number of messages per
+    second allowed to each room or user (0 for no limit), send_burst how many
+    may be sent at once, and coalesce_length the length up to which queued
+    replies to the same target are joined into one message (0 to not join).
+    '''
+    config_defaults = {
+        'mention_name': 'autobot',
+        'rooms': [],
+        'send_rate': 0,
+        'send_burst': 1,
+        'coalesce_length': 0,
+    }
 
     def __init__(self, config=None):
         self._config = config
         self._default_room = False
         self._author = None
         self._messageq = None
+        self._outbox = None
 
     def start(self):
+        self._open_outbox()
+        self.run()
+        self._started()
+
+    async def start_async(self):
+        '''
+        Starts the service from the asyncio runtime, see autobot.aio.
+        '''
+        self._open_outbox()
+        await self.run_async()
+        self._started()
+
+    def _open_outbox(self):
         if 'rooms' not in self._config:
             raise ConfigurationMissingError('No rooms to join defined!')
         if not self._messageq:
             raise Exception('Cannot start service without message queue')
-        self.run()
+        self._outbox = outbound.Outbox(
+            type(self).__name__.lower(),
+            rate=self._config.get('send_rate', 0),
+            burst=self._config.get('send_burst', 1),
+            coalesce_length=self._config.get('coalesce_length', 0))
+        self._outbox.start()
+
+    def _started(self):
         # This is done down here to make sure we don't overwrite mention_name
-        # when we have multiple service modules on the path
-        autobot.substitutions.add('mention_name', self.mention_name)
+        # when we have multiple service modules on the path, and only the
+        # first service started gets to set it when several are running
+        if 'mention_name' not in autobot.substitutions:
+            autobot.substitutions.add('mention_name', self.mention_name)
         autobot.event.trigger(autobot.event.SERVICE_STARTED, self)
 
     def set_message_queue(self, messageq):
         self._messageq = messageq
 
+    def stop(self):
+        self.shutdown()
+        if self._outbox:
+            self._outbox.shutdown()
+
+    def outbound(self, handler):
+        '''
+        Wraps a reply handler taking a chat object and the text to send, so
+        that replies go through the outbound queue once the service has been
+        started.
+        '''
+        def enqueue(chat_object, message, *args):
+            text = message % args if args else message
+            if self._outbox:
+                self._outbox.put(handler, chat_object, text,
+                                 autobot.tracer.current())
+            else:
+                handler(chat_object, text)
+        return enqueue
+
+    @property
+    def outbox(self):
+        return self._outbox
+
     def run(self):
         raise NotImplementedError()
 
+    async def run_async(self):
+        '''
+        Runs the service on the loop of the asyncio runtime. Services that
+        do not have a coroutine version run in their own threads as usual.
+        '''
+        self.run()
+
     def shutdown(self):
         raise NotImplementedError()
 
@@ -195,19 +721,30 @@ class Service(object):
 class Callback(object):
     def __init__(self, func, priority=100):
         self._callback = None
+        self._factory = None
         self._func = func
         self.priority = priority
         if hasattr(func, '_priority'):
             self.priority = func._priority
+        self.history = getattr(func, '_history', False)
         self.lock = ''
 
     @property
     def __name__(self):
         return self._func.__name__
 
+    @property
+    def full_name(self):
+        return '{}.{}'.format(getattr(self._func, '_class_name', None),
+                              self._func.__name__)
+
     def get_callback(self, factory):
-        if not self._callback:
-            self._callback = factory.get_callback(self._func)
+        # The same callback is bound again when a new factory asks for it,
+        # as when several autobot.Bot are made in one process
+        if not self._callback or factory is not self._factory:
+            self._factory = factory
+            self._callback = autobot.profiler.wrap(
+                self.full_name, factory.get_callback(self._func))
         return self._callback
 
     def _is_comparable(self, other, attr):
@@ -238,6 +775,9 @@ class Matcher(Callback):
     more specific, thus resulting in that when there's two matchers with the
     same priority value, the one with the longer pattern gets picked from the
     queue.
+    The substitutions a pattern uses are found when the matcher is made, so
+    that only the matchers using a substitution are compiled when it is
+    added.
     '''
     def __init__(self, func, pattern, priority=50, condition=lambda x: True,
                  preprocessor=None):
@@ -246,9 +786,13 @@ class Matcher(Callback):
         self.condition = condition
         self.preprocessor = preprocessor
         self.regex = None
+        self.substitutions = _format_keys(pattern)
+
+    def expand(self, **format_args):
+        return self.pattern.format(**format_args)
 
     def compile(self, **format_args):
-        self.regex = regex.compile(self.pattern.format(**format_args))
+        self.regex = regex.compile(self.expand(**format_args))
 
     def __eq__(self, other):
         self._is_comparable(other, 'pattern')
@@ -262,6 +806,20 @@ class Matcher(Callback):
         return self.pattern
 
 
+def _format_keys(pattern):
+    '''
+    The names of the replacement fields in a format string, like
+    mention_name in "^{mention_name}: hi".
+    '''
+    try:
+        fields = [field for _, field, _, _ in string.Formatter().parse(pattern)
+                  if field]
+    except ValueError:
+        # Broken patterns fail when they are compiled instead
+        return frozenset()
+    return frozenset(regex.split(r'[.\[]', field)[0] for field in fields)
+
+
 class ScheduledCallback(Callback):
     def __init__(self, func, cron):
         self._cron = cron
@@ -0,0 +1,139 @@
+import collections
+import threading
+import logging
+import time
+
+from .helpers import TokenBucket
+
+LOG = logging.getLogger(__name__)
+
+# Seconds between throwing away the buckets of rooms and users that have
+# been quiet long enough for them to be full again
+PRUNE_INTERVAL = 60
+
+
+class Outbox(object):
+    '''
+    Sends the replies of a service from a thread of its own, so that a burst
+    of replies from handlers or scheduled jobs does not hit the chat server
+    all at once. Every room or user gets a token bucket allowing rate
+    messages per second with bursts of burst messages, and targets take
+    turns so that one busy room does not hold up the others.
+    With coalesce_length set, replies queued up for the same target are
+    joined by newlines into messages of at most that length.
+    Replies to traced messages hold the trace open until they are sent.
+    '''
+    def __init__(self, name, rate=0, burst=1, coalesce_length=0):
+        self._name = name
+        self._rate = rate
+        self._burst = burst
+        self._coalesce_length = coalesce_length
+        self._pending = collections.OrderedDict()
+        self._buckets = {}
+        self._pruned = time.monotonic()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(name='{}-sender'.format(name),
+                                        target=self._loop)
+        self._thread.daemon = True
+        self.sent = 0
+        self.coalesced = 0
+
+    def start(self):
+        self._thread.start()
+
+    def put(self, handler, target, text, trace=None):
+        key = (handler, type(target).__name__, target.name)
+        if trace:
+            trace.hold()
+        with self._condition:
+            if key not in self._pending:
+                self._pending[key] = collections.deque()
+            self._pending[key].append(
+                (handler, target, text, trace, time.time()))
+            self._condition.notify()
+
+    def qsize(self):
+        with self._condition:
+            return sum(len(replies) for replies in self._pending.values())
+
+    def shutdown(self):
+        '''
+        Stops the sender once everything queued has been sent.
+        '''
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _delay(self, key):
+        if not self._rate:
+            return 0
+        if key not in self._buckets:
+            self._buckets[key] = TokenBucket(self._rate, self._burst)
+        return self._buckets[key].delay()
+
+    def _next(self):
+        '''
+        Waits for a target that has replies queued and is allowed to send,
+        and gives its next reply, or None once closed and drained.
+        '''
+        with self._condition:
+            while True:
+                self._prune(time.monotonic())
+                if not self._pending:
+                    if self._closed:
+                        return None
+                    self._condition.wait()
+                    continue
+                delays = [(self._delay(key), key) for key in self._pending]
+                delay, key = min(delays, key=lambda d: d[0])
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                if self._rate:
+                    self._buckets[key].consume()
+                return self._pop(key)
+
+    def _prune(self, now):
+        if now - self._pruned < PRUNE_INTERVAL:
+            return
+        self._pruned = now
+        for key, bucket in list(self._buckets.items()):
+            if key not in self._pending and bucket.full(now):
+                del self._buckets[key]
+
+    def _pop(self, key):
+        replies = self._pending.pop(key)
+        handler, target, text, trace, queued = replies.popleft()
+        traces = [(trace, queued)] if trace else []
+        while replies and self._coalesce_length:
+            next_text = replies[0][2]
+            if len(text) + 1 + len(next_text) > self._coalesce_length:
+                break
+            text = '{}\n{}'.format(text, next_text)
+            _, _, _, trace, queued = replies.popleft()
+            if trace:
+                traces.append((trace, queued))
+            self.coalesced += 1
+        if replies:
+            # Back of the line, so other targets get their turn
+            self._pending[key] = replies
+        return handler, target, text, traces
+
+    def _loop(self):
+        while True:
+            reply = self._next()
+            if reply is None:
+                break
+            handler, target, text, traces = reply
+            try:
+                handler(target, text)
+                self.sent += 1
+            except Exception as e:
+                LOG.error('Could not send reply to %s: %s', target.name, e)
+            sent_time = time.time()
+            for trace, queued in traces:
+                trace.add('send', queued, sent_time, target=target.name)
+                trace.release()
@@ -0,0 +1,164 @@
+import collections
+import threading
+import cProfile
+import logging
+import pstats
+import time
+import os
+import io
+
+from . import helpers
+
+LOG = logging.getLogger(__name__)
+
+
+class Profiler(object):
+    '''
+    Profiles the plugin methods run by the bot while it is enabled, which can
+    be toggled at any time. Every callback handed out by Callback and every
+    event handler goes through wrap() or call(), which only runs them under
+    cProfile while enabled, so it costs next to nothing otherwise.
+    Only one cProfile can be active in a process at a time, which Python
+    3.12 and later enforce, so a method is only profiled when no other one
+    is being profiled in another thread. Methods running at the same time
+    are still counted and timed, but get no breakdown of where their time
+    went. When a profiled method calls another one, the time is counted for
+    the outer one.
+    Async handlers are counted and timed from the start to the end of the
+    coroutine, waiting included, and never run under cProfile, which would
+    blame them for everything else the loop runs in the meantime.
+    '''
+    def __init__(self, directory='profiles'):
+        self.directory = directory
+        self.enabled = False
+        self._profiles = {}
+        self._calls = collections.Counter()
+        self._times = collections.Counter()
+        self._running = None
+        self._lock = threading.Lock()
+        # Held while a profile is active or being read
+        self._slot = threading.RLock()
+        self._local = threading.local()
+        self._started = None
+
+    def start(self):
+        with self._lock:
+            if not self.enabled:
+                self._started = time.time()
+                self.enabled = True
+        LOG.info('Profiling plugins')
+
+    def stop(self):
+        with self._lock:
+            self.enabled = False
+        LOG.info('Stopped profiling plugins')
+
+    def reset(self):
+        with self._lock:
+            self._profiles.clear()
+            self._calls.clear()
+            self._times.clear()
+            self._started = time.time() if self.enabled else None
+
+    def wrap(self, name, func):
+        def profiled(*args, **kwargs):
+            return self.call(name, func, *args, **kwargs)
+        profiled.__name__ = getattr(func, '__name__', name)
+        profiled.__wrapped__ = func
+        return profiled
+
+    def call(self, name, func, *args, **kwargs):
+        if not self.enabled or getattr(self._local, 'active', False):
+            return func(*args, **kwargs)
+        if helpers.is_async(func):
+            return self._time_coroutine(name, func(*args, **kwargs))
+        if not self._slot.acquire(blocking=False):
+            return self._time(name, func, *args, **kwargs)
+        try:
+            with self._lock:
+                profile = self._profiles.get(name)
+                if profile is None:
+                    profile = self._profiles[name] = cProfile.Profile()
+                self._running = name
+            return self._time(name, profile.runcall, func, *args, **kwargs)
+        finally:
+            self._running = None
+            self._slot.release()
+
+    def _time(self, name, func, *args, **kwargs):
+        self._local.active = True
+        start_time = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._local.active = False
+            self._count(name, time.perf_counter() - start_time)
+
+    async def _time_coroutine(self, name, coroutine):
+        start_time = time.perf_counter()
+        try:
+            return await coroutine
+        finally:
+            self._count(name, time.perf_counter() - start_time)
+
+    def _count(self, name, elapsed):
+        with self._lock:
+            self._calls[name] += 1
+            self._times[name] += elapsed
+
+    def summary(self):
+        '''
+        The calls to and time spent in each profiled method, slowest first.
+        '''
+        with self._lock:
+            return sorted(((name, self._calls[name], self._times[name])
+                           for name in self._calls),
+                          key=lambda entry: entry[2], reverse=True)
+
+    def report(self, directory=None, top=20):
+        '''
+        Writes a pstats file per method and a summary.txt with the time spent
+        per plugin and method and their most expensive functions, into a new
+        directory under directory, and gives that directory.
+        '''
+        directory = directory or self.directory
+        path = os.path.join(directory, time.strftime('%Y%m%d-%H%M%S'))
+        os.makedirs(path, exist_ok=True)
+        out = io.StringIO()
+        # No other thread can start profiling while the profiles are read.
+        # The one in use can not be read, which is the one of the command
+        # asking for this report when it runs in this thread
+        with self._slot:
+            with self._lock:
+                profiles = {name: profile
+                            for name, profile in self._profiles.items()
+                            if name != self._running}
+                started = self._started
+            stats = {name: pstats.Stats(profile, stream=out)
+                     for name, profile in profiles.items()}
+        summary = self.summary()
+
+        per_plugin = collections.Counter()
+        for name, calls, seconds in summary:
+            per_plugin[name.split('.')[0]] += seconds
+
+        out.write('Profiled for {:.1f}s\n\n'.format(
+            time.time() - started if started else 0))
+        out.write('Per plugin\n')
+        for plugin, seconds in per_plugin.most_common():
+            out.write('  {:<40} {:10.4f}s\n'.format(plugin, seconds))
+        out.write('\nPer method\n')
+        for name, calls, seconds in summary:
+            out.write('  {:<40} {:8} calls {:10.4f}s\n'.format(
+                name, calls, seconds))
+        for name, calls, seconds in summary:
+            if name not in stats:
+                continue
+            stats[name].dump_stats(os.path.join(path, '{}.prof'.format(name)))
+            out.write('\n{}\n'.format(name))
+            stats[name].sort_stats('cumulative').print_stats(top)
+
+        with open(os.path.join(path, 'summary.txt'), 'w') as summary_file:
+            summary_file.write(out.getvalue())
+        LOG.info('Wrote profiling report to %s', path)
+        return path
@@ -4,6 +4,7 @@ import logging
 import queue
 import time
 from . import workers
+from autobot import metrics
 
 LOG = logging.getLogger(__name__)
 
@@ -14,6 +15,9 @@ class Scheduler(object):
         self._resolution = resolution
         self._scheduleq = scheduleq
         self._workq = workq
+        self._lag = metrics.histogram(
+            'autobot_scheduler_lag_seconds',
+            'How late scheduled events are handed to the workers')
 
     def boot(self):
         '''
@@ -52,6 +56,17 @@ class Scheduler(object):
         self._scheduleq.put(False)
         self._scheduleq.join()
 
+    def run_pending(self, scheduled_events, unix_time=None):
+        '''
+        Schedules the events waiting on the schedule queue and hands every
+        event due by unix_time to the work queue, for running the scheduler
+        without its loop.
+        '''
+        unix_time = time.time() if unix_time is None else unix_time
+        self._process_queue(scheduled_events)
+        while scheduled_events and scheduled_events[0].timestamp <= unix_time:
+            self._process_event(scheduled_events, unix_time)
+
     def _process_queue(self, scheduled_events):
         quit = False
         try:
@@ -79,6 +94,7 @@ class Scheduler(object):
         if unix_time >= exec_time:
             event = scheduled_events.pop(0)
             LOG.debug('Running scheduled event %s at: %d', event, unix_time)
+            self._lag.observe(unix_time - exec_time)
             callback = event.get_callback(self._factory)
             self._workq.put(workers.schedule_work(callback))
             event.get_next()
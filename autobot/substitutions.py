@@ -4,12 +4,10 @@ from .helpers import DictObj
 
 class Substitutions(DictObj):
     '''
-    The substitutions available for application on the matching strings are
-    static and only the ones available during the bootstrapping procedure.
-    This is roughly after the ALL_MODULES_LOADED event has fired.
-    The reason for this is that the regexp patterns are compiled at boot time
-    to be more efficient. The static nature of the matching strings is a
-    result of this.
+    The substitutions available for application on the matching strings.
+    They can be added but never changed, since the regexp patterns are
+    compiled once to be more efficient. A matcher using a substitution is
+    compiled when it is added, until then it matches nothing.
     '''
     def __set__(self, key, value):
         if key in self:
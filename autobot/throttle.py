@@ -0,0 +1,116 @@
+import threading
+import logging
+import time
+
+import autobot
+from .helpers import TokenBucket
+
+LOG = logging.getLogger(__name__)
+
+# Seconds between throwing away the buckets of authors and rooms that have
+# been quiet long enough for them to be full again
+PRUNE_INTERVAL = 60
+
+
+class Throttle(object):
+    '''
+    Keeps one author, or one room or user the messages come from, from
+    flooding the bot, by dropping their messages before they are matched
+    once they send more than rate messages per second on average, with
+    bursts of up to burst messages. A rate of 0 leaves them unlimited.
+    Names in exempt, of authors as well as of rooms and users, are never
+    throttled, like other bots or integrations that are known to be busy.
+    THROTTLING_STARTED is triggered when an author or room starts being
+    throttled, with its kind (author, room or user), its name and the
+    message that was dropped, and not again until it is allowed through.
+    '''
+    def __init__(self, author_rate=0, author_burst=10, room_rate=0,
+                 room_burst=20, exempt=()):
+        self._limits = {
+            'author': (author_rate, author_burst),
+            'room': (room_rate, room_burst),
+        }
+        self._exempt = frozenset(exempt)
+        self._buckets = {}
+        self._throttled = set()
+        self._lock = threading.Lock()
+        self._pruned = time.monotonic()
+        self._dropped = autobot.metrics.counter(
+            'autobot_messages_throttled_total',
+            'Messages dropped for coming too fast from one author or room')
+        autobot.metrics.gauge('autobot_throttled_sources',
+                              'Authors and rooms being throttled',
+                              function=lambda: len(self._throttled))
+
+    def allow(self, message):
+        '''
+        Whether a message may be processed, using up a token of its author
+        and of where it came from if so.
+        '''
+        now = time.monotonic()
+        sources = self._sources(message)
+        with self._lock:
+            self._prune(now)
+            buckets = [(source, self._bucket(source)) for source in sources]
+            throttled = [source for source, bucket in buckets
+                         if bucket.delay(now) > 0]
+            if not throttled:
+                for source, bucket in buckets:
+                    bucket.consume(now)
+                    self._throttled.discard(source)
+                return True
+            started = [source for source in throttled
+                       if source not in self._throttled]
+            self._throttled.update(throttled)
+
+        self._dropped.inc(kind=throttled[0][0])
+        for kind, name in started:
+            LOG.warning('Throttling %s %s, dropping messages until it '
+                        'slows down', kind, name)
+            autobot.event.trigger(autobot.event.THROTTLING_STARTED, self, {
+                'kind': kind,
+                'name': name,
+                'message': message,
+            })
+        return False
+
+    def _sources(self, message):
+        sources = []
+        if self._limits['author'][0] and message.author not in self._exempt:
+            sources.append(('author', message.author))
+        reply_path = message.reply_path
+        if (self._limits['room'][0] and reply_path is not None and
+                reply_path.name not in self._exempt):
+            sources.append((type(reply_path).__name__.lower(),
+                            reply_path.name))
+        return sources
+
+    def _bucket(self, source):
+        if source not in self._buckets:
+            kind = 'author' if source[0] == 'author' else 'room'
+            self._buckets[source] = TokenBucket(*self._limits[kind])
+        return self._buckets[source]
+
+    def _prune(self, now):
+        if now - self._pruned < PRUNE_INTERVAL:
+            return
+        self._pruned = now
+        for source, bucket in list(self._buckets.items()):
+            if bucket.full(now):
+                del self._buckets[source]
+                # Went quiet while throttled, which the gauge counts from
+                self._throttled.discard(source)
+
+
+def from_config(config):
+    '''
+    The throttle asked for by the throttle_* settings of config, or None
+    when neither authors nor rooms are limited.
+    '''
+    author_rate = config.get('throttle_author_rate', 0)
+    room_rate = config.get('throttle_room_rate', 0)
+    if not author_rate and not room_rate:
+        return None
+    return Throttle(author_rate, config.get('throttle_author_burst', 10),
+                    room_rate, config.get('throttle_room_burst', 20),
+                    config.get('throttle_exempt', ()))
@@ -0,0 +1,143 @@
+import collections
+import contextlib
+import contextvars
+import threading
+import logging
+import random
+import json
+import time
+import uuid
+
+LOG = logging.getLogger(__name__)
+
+
+class Trace(object):
+    '''
+    The stages a single message went through, each a span with the time it
+    started and ended. A trace is written once the brain is done with the
+    message and every reply it caused has been sent.
+    '''
+    def __init__(self, tracer, message):
+        self.id = uuid.uuid4().hex[:16]
+        self.text = str(message)[:200]
+        self.author = str(message.author)
+        self.started = message.received
+        self.spans = []
+        self._tracer = tracer
+        self._lock = threading.Lock()
+        self._pending = 1
+
+    def add(self, name, start, end, **attributes):
+        with self._lock:
+            self.spans.append((name, start, end, attributes))
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.time(), **attributes)
+
+    def hold(self):
+        '''
+        Keeps the trace from being written until release() is called, for
+        replies that are sent after the brain is done.
+        '''
+        with self._lock:
+            self._pending += 1
+
+    def release(self):
+        with self._lock:
+            self._pending -= 1
+            done = not self._pending
+        if done:
+            self._tracer.record(self)
+
+    def finish(self):
+        self.release()
+
+    @property
+    def duration(self):
+        if not self.spans:
+            return 0.0
+        return max(end for _, _, end, _ in self.spans) - self.started
+
+    def as_dict(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span[1])
+        return {
+            'trace_id': self.id,
+            'message': self.text,
+            'author': self.author,
+            'received': self.started,
+            'duration_ms': round(self.duration * 1000, 3),
+            'spans': [dict(attributes,
+                           name=name,
+                           start_ms=round((start - self.started) * 1000, 3),
+                           duration_ms=round((end - start) * 1000, 3))
+                      for name, start, end, attributes in spans],
+        }
+
+
+class Tracer(object):
+    '''
+    Decides which messages get traced, sample_rate being the share of them
+    from 0 to 1, and keeps the last keep finished traces in memory as well
+    as appending them to the JSON-lines file at path, if one is set.
+    The brain makes the trace of the message it is handling current for its
+    thread, or its task with the asyncio runtime, so replies sent from
+    callbacks end up in the right trace.
+    '''
+    def __init__(self, sample_rate=0.0, path=None, keep=100):
+        self.sample_rate = sample_rate
+        self.path = path
+        self._recent = collections.deque(maxlen=keep)
+        self._lock = threading.Lock()
+        self._current = contextvars.ContextVar('trace', default=None)
+
+    def configure(self, sample_rate=None, path=None, keep=None):
+        with self._lock:
+            if sample_rate is not None:
+                self.sample_rate = sample_rate
+            if path is not None:
+                self.path = path
+            if keep is not None:
+                self._recent = collections.deque(self._recent, maxlen=keep)
+
+    def start(self, message):
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        return Trace(self, message)
+
+    @contextlib.contextmanager
+    def activate(self, trace):
+        token = self._current.set(trace)
+        try:
+            yield trace
+        finally:
+            self._current.reset(token)
+
+    def current(self):
+        return self._current.get()
+
+    def record(self, trace):
+        entry = trace.as_dict()
+        with self._lock:
+            self._recent.append(entry)
+            if not self.path:
+                return
+            try:
+                with open(self.path, 'a') as sink:
+                    sink.write(json.dumps(entry) + '\n')
+            except (IOError, OSError) as e:
+                LOG.warning('Could not write trace to %s: %s', self.path, e)
+
+    def recent(self, count=None):
+        with self._lock:
+            traces = list(self._recent)
+        return traces[-count:] if count else traces
+
+    def slowest(self, count=1):
+        return sorted(self.recent(), key=lambda t: t['duration_ms'],
+                      reverse=True)[:count]
@@ -1,33 +1,76 @@
 import threading
 import multiprocessing
 import logging
+import time
+
+import autobot
 
 LOG = logging.getLogger(__name__)
 
+# Looked up once, as every matcher observes it for every message
+_matcher_time = autobot.metrics.histogram(
+    'autobot_matcher_seconds',
+    'Time taken to evaluate a matcher against a message')
+
 
 def schedule_work(func):
     return func
 
 
-def regex_work(matcher, message, matchq):
+def regex_work(matcher, message, matchq, regex):
     def processor():
         LOG.debug('Trying match with regex {}'.format(matcher.pattern))
+        start_time = time.time()
+        matched = False
         # We defer the condition matching to the workers knowing that it is
         # slightly more expensive. It is under the hopes that the loss of
-        # performance is offset by the gain of threading
-        if matcher.condition(message):
+        # performance is offset by the gain of threading. Matchers waiting
+        # for a substitution to be added are not compiled yet
+        if regex is not None and matcher.condition(message):
             message.process(matcher.preprocessor)
-            if matcher.regex.match(str(message)):
+            if regex.match(str(message)):
                 LOG.debug('Match found against {}!'.format(matcher.pattern))
                 matchq.put((matcher.priority, matcher))
+                matched = True
+        end_time = time.time()
+        _matcher_time.observe(end_time - start_time,
+                              matcher=matcher.full_name)
+        if message.trace:
+            message.trace.add('matcher', start_time, end_time,
+                              matcher=matcher.full_name, matched=matched)
     return processor
 
 
+class InlineQueue(object):
+    '''
+    Stands in for the work queue when running without a worker pool, doing
+    the work in the thread that puts it on the queue.
+    '''
+    def put(self, work):
+        autobot.helpers.complete(work())
+
+    def task_done(self):
+        pass
+
+    def join(self):
+        pass
+
+    def qsize(self):
+        return 0
+
+
 class WorkerPool(object):
     def __init__(self, workq, thread_count=None):
         self._workq = workq
         self._thread_pool = []
         self._thread_count = thread_count
+        self._busy = autobot.metrics.gauge(
+            'autobot_workers_busy', 'Worker threads running a work item')
+        self._done = autobot.metrics.counter(
+            'autobot_work_items_total', 'Work items run by the worker pool')
+        autobot.metrics.gauge('autobot_work_queue_size',
+                              'Work items waiting for a worker',
+                              function=workq.qsize)
 
     def start(self):
         try:
@@ -36,6 +79,9 @@ class WorkerPool(object):
         except NotImplementedError:
             self._thread_count = 4
         LOG.debug('Setting thread count to: {}.'.format(self._thread_count))
+        autobot.metrics.gauge('autobot_workers',
+                              'Worker threads in the pool').set(
+                                  self._thread_count)
 
         for i in range(self._thread_count):
             thread_name = '{}-{}'.format('worker', i+1)
@@ -49,12 +95,17 @@ class WorkerPool(object):
             if not work or not callable(work):
                 self._workq.task_done()
                 return True
-            work()
-            self._workq.task_done()
+            self._busy.inc()
+            try:
+                autobot.helpers.complete(work())
+            finally:
+                self._busy.dec()
+                self._done.inc()
+                self._workq.task_done()
 
     def shutdown(self):
         for thread in self._thread_pool:
             LOG.info('Closing thread %s', thread.name)
-            while thread.isAlive():
+            while thread.is_alive():
                 self._workq.put(False)
                 self._workq.join()
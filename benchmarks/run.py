@@ -0,0 +1,387 @@
+'''
+Benchmarks for the parts of autobot every message and job goes through:
+
+    brain      messages per second through the Brain and the worker pool
+               with 10, 100 and 1000 matchers
+    scheduler  how long it takes to get large numbers of jobs that are due
+               at the same time to the workers, and how late they run
+    events     the cost of Events.trigger with a growing number of handlers
+    storage    the cost of Storage.sync against the size of a namespace, for
+               the shelve, sqlite and journal backends
+
+Run all of them, or the ones named, from the root of the repository:
+
+    python benchmarks/run.py
+    python benchmarks/run.py brain storage
+
+The results are compared to benchmarks/baseline.json, and a metric that got
+worse by more than --threshold makes the run fail. --save writes the results
+as the new baseline. Timings only compare between runs on the same machine,
+so save a baseline on the machine the comparisons are made on before
+relying on them.
+'''
+import collections
+import statistics
+import functools
+import threading
+import platform
+import argparse
+import datetime
+import tempfile
+import shutil
+import queue
+import json
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import autobot  # NOQA
+import autobot.workers  # NOQA
+import autobot.core.shelve  # NOQA
+import autobot.core.sqlite  # NOQA
+import autobot.core.journal  # NOQA
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'baseline.json')
+
+
+class _Factory(object):
+    '''
+    Hands the plugin functions back as they are, as the benchmarks have no
+    plugin instances to bind them to.
+    '''
+    def __init__(self, storage=None):
+        self._storage = storage or _MemoryStorage()
+
+    def get_callback(self, func):
+        return functools.partial(func, None)
+
+    def get_storage(self):
+        return self._storage
+
+
+class _MemoryStorage(autobot.Storage):
+    def open(self):
+        return {}
+
+    def store(self, name, value):
+        self.data[name] = value
+
+    def close(self):
+        pass
+
+
+def _percentile(values, percent):
+    return autobot.helpers.percentile(values, percent) * 1000
+
+
+def _handler(plugin, message):
+    message.reply('ok')
+
+
+_handler._class_name = 'BenchmarkPlugin'
+
+
+def bench_brain(matcher_count, message_count):
+    '''
+    Every message matches one of the matchers, so each one has the whole
+    set of matchers tried against it and a reply sent.
+    '''
+    matchers = []
+    for i in range(matcher_count):
+        matcher = autobot.Matcher(_handler, r'^command{}\b'.format(i))
+        matcher.compile()
+        matchers.append(matcher)
+    messageq = queue.Queue()
+    workq = queue.Queue()
+    brain = autobot.brain.Brain(_Factory(), matchers, [], messageq, workq)
+    pool = autobot.workers.WorkerPool(workq)
+    latencies = []
+
+    def processed(context, event_args):
+        latencies.append(event_args['latency'])
+
+    autobot.event.register(autobot.event.MESSAGE_PROCESSED, processed)
+    pool.start()
+    brain_thread = threading.Thread(name='brain', target=brain.boot)
+    brain_thread.start()
+    # Replies are thrown away
+    sink = autobot.User('bench', reply_handler=lambda *args: None)
+    start_time = time.perf_counter()
+    for i in range(message_count):
+        messageq.put(autobot.Message(
+            'command{} with arguments'.format(i % matcher_count),
+            'bench', reply_path=sink))
+    brain.shutdown()
+    elapsed = time.perf_counter() - start_time
+    brain_thread.join()
+    pool.shutdown()
+    autobot.event.deregister(autobot.event.MESSAGE_PROCESSED, processed)
+    brain.deregister_events()
+    return {
+        'messages_per_second': message_count / elapsed,
+        'latency_p50_ms': _percentile(latencies, 50),
+        'latency_p95_ms': _percentile(latencies, 95),
+    }
+
+
+class _Due(object):
+    '''
+    A stand-in for croniter that is due once, at the given time, and then
+    not again for a year.
+    '''
+    def __init__(self, timestamp):
+        self._timestamp = timestamp
+        self.exprs = ['benchmark']
+
+    def get_next(self, ret_type):
+        timestamp, self._timestamp = (self._timestamp,
+                                      self._timestamp + 365 * 86400)
+        return ret_type.fromtimestamp(timestamp)
+
+
+def bench_scheduler(job_count, resolution=0.001):
+    '''
+    Schedules job_count jobs that are all due shortly after the scheduler
+    starts, and measures how long it takes until they have all run and how
+    late each of them ran.
+    '''
+    lags = []
+    done = threading.Event()
+    lock = threading.Lock()
+
+    def job(plugin):
+        with lock:
+            lags.append(time.time() - due)
+            if len(lags) == job_count:
+                done.set()
+
+    job._class_name = 'BenchmarkPlugin'
+    scheduleq = queue.Queue()
+    workq = queue.Queue()
+    due = time.time() + 0.1
+    start_time = time.perf_counter()
+    for i in range(job_count):
+        scheduleq.put(autobot.ScheduledCallback(job, _Due(due)))
+    scheduler = autobot.scheduler.Scheduler(_Factory(), resolution,
+                                            scheduleq, workq)
+    pool = autobot.workers.WorkerPool(workq)
+    pool.start()
+    scheduler_thread = threading.Thread(name='timer', target=scheduler.boot)
+    scheduler_thread.start()
+    scheduleq.join()
+    scheduled = time.perf_counter() - start_time
+    done.wait()
+    scheduler.shutdown()
+    scheduler_thread.join()
+    pool.shutdown()
+    return {
+        'schedule_ms': scheduled * 1000,
+        'jobs_per_second': job_count / (time.time() - due),
+        'lag_p50_ms': _percentile(lags, 50),
+        'lag_max_ms': max(lags) * 1000,
+    }
+
+
+def bench_events(handler_count, plugin_handlers=False, iterations=20000):
+    '''
+    Triggers an event with handler_count handlers registered, either plain
+    functions or plugin methods going through their EventCallback.
+    '''
+    events = autobot.Events()
+    events.add('BENCHMARK')
+    benchmark = events['BENCHMARK']
+    events.trigger(events.ALL_PLUGINS_LOADED, _Factory())
+
+    def handler(*args):
+        pass
+
+    handler._class_name = 'BenchmarkPlugin'
+    for i in range(handler_count):
+        if plugin_handlers:
+            events.add_handler(autobot.EventCallback(handler,
+                                                     benchmark))
+        else:
+            events.register(benchmark, handler)
+    start_time = time.perf_counter()
+    for i in range(iterations):
+        events.trigger(benchmark, None, {})
+    elapsed = time.perf_counter() - start_time
+    return {'trigger_us': elapsed / iterations * 1000000}
+
+
+def bench_storage(backend, key_count, syncs=20):
+    '''
+    Fills a namespace with key_count keys and measures the first sync,
+    which writes all of them, and then syncs after changing a single key.
+    '''
+    cls = {
+        'shelve': autobot.core.shelve.ShelveStorage,
+        'sqlite': autobot.core.sqlite.SQLiteStorage,
+        'journal': autobot.core.journal.JournalStorage,
+    }[backend]
+    directory = tempfile.mkdtemp(prefix='autobot-benchmark-')
+    try:
+        storage = cls(dict(cls.config_defaults,
+                           path=os.path.join(directory, backend)))
+        namespace = storage.namespace('BenchmarkPlugin')
+        for i in range(key_count):
+            namespace['key{}'.format(i)] = {'count': i, 'text': 'x' * 64}
+        start_time = time.perf_counter()
+        storage.sync()
+        full = time.perf_counter() - start_time
+        times = []
+        for i in range(syncs):
+            namespace['key{}'.format(i % key_count)] = {'count': -i}
+            start_time = time.perf_counter()
+            storage.sync()
+            times.append(time.perf_counter() - start_time)
+        storage.close()
+    finally:
+        shutil.rmtree(directory)
+    return {
+        'sync_all_ms': full * 1000,
+        'sync_one_key_ms': statistics.median(times) * 1000,
+    }
+
+
+def _benchmarks(quick):
+    scale = 10 if quick else 1
+    cases = collections.OrderedDict()
+    for count, messages in ((10, 2000), (100, 500), (1000, 100)):
+        cases['brain.matchers={}'.format(count)] = functools.partial(
+            bench_brain, count, max(messages // scale, 10))
+    for count in (100, 1000, 5000):
+        cases['scheduler.jobs={}'.format(count)] = functools.partial(
+            bench_scheduler, max(count // scale, 10))
+    for count in (0, 1, 10):
+        cases['events.handlers={}'.format(count)] = functools.partial(
+            bench_events, count, iterations=20000 // scale)
+    cases['events.plugin_handlers=10'] = functools.partial(
+        bench_events, 10, True, iterations=20000 // scale)
+    for backend in ('shelve', 'sqlite', 'journal'):
+        for count in (100, 1000, 10000):
+            cases['storage.{}.keys={}'.format(backend, count)] = (
+                functools.partial(bench_storage, backend,
+                                  max(count // scale, 10)))
+    return cases
+
+
+def run(names, repeat, quick):
+    '''
+    Runs the benchmarks whose names start with any of names, repeat times
+    each, and gives the median of every metric.
+    '''
+    results = collections.OrderedDict()
+    for name, benchmark in _benchmarks(quick).items():
+        if names and not any(name.startswith(n) for n in names):
+            continue
+        runs = [benchmark() for i in range(repeat)]
+        results[name] = {
+            metric: round(statistics.median(r[metric] for r in runs), 4)
+            for metric in runs[0]}
+        print('{:<32} {}'.format(name, ' '.join(
+            '{}={:.3f}'.format(metric, value)
+            for metric, value in results[name].items())), flush=True)
+    return results
+
+
+def _higher_is_better(metric):
+    return metric.endswith('_per_second')
+
+
+def compare(results, baseline, threshold):
+    '''
+    Prints how every metric changed against the baseline and gives the
+    ones that got worse by more than threshold, as a fraction.
+    '''
+    regressions = []
+    print('\n{:<32} {:<18} {:>12} {:>12} {:>8}'.format(
+        'benchmark', 'metric', 'baseline', 'current', 'change'))
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            base = baseline.get(name, {}).get(metric)
+            if not base:
+                continue
+            change = (value - base) / base
+            worse = -change if _higher_is_better(metric) else change
+            flag = ''
+            if worse > threshold:
+                flag = ' REGRESSION'
+                regressions.append((name, metric, base, value))
+            print('{:<32} {:<18} {:>12.3f} {:>12.3f} {:>+7.1%}{}'.format(
+                name, metric, base, value, change, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the brain, scheduler, events and storage')
+    parser.add_argument('benchmarks', nargs='*',
+                        help='Only run the benchmarks starting with these, '
+                        'like "brain" or "storage.sqlite"')
+    parser.add_argument('--baseline', default=BASELINE,
+                        help='The baseline to compare to or save')
+    parser.add_argument('--save', action='store_true',
+                        help='Save the results as the baseline')
+    parser.add_argument('--output', help='Also write the results here')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs per benchmark, the median is kept')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='How much worse a metric may get, as a '
+                        'fraction, before it counts as a regression')
+    parser.add_argument('--quick', action='store_true',
+                        help='Run a tenth of the work, for trying things '
+                        'out rather than for comparing')
+    args = parser.parse_args()
+
+    report = {
+        'created': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'quick': args.quick,
+        'results': run(args.benchmarks, args.repeat, args.quick),
+    }
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    if args.save:
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as previous:
+                # Keep the results of the benchmarks that were not run
+                results = json.load(previous)['results']
+            results.update(report['results'])
+            report['results'] = results
+        with open(args.baseline, 'w') as baseline:
+            json.dump(report, baseline, indent=2)
+            baseline.write('\n')
+        print('\nSaved baseline to {}'.format(args.baseline))
+        return
+    if not os.path.exists(args.baseline):
+        print('\nNo baseline at {}, save one with --save'.format(
+            args.baseline))
+        return
+
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    if baseline.get('quick') != args.quick:
+        print('\nThe baseline was {}made with --quick, the numbers will not '
+              'compare'.format('' if baseline.get('quick') else 'not '))
+    print('Baseline from {} on Python {}, {} with {} cpus'.format(
+        baseline['created'], baseline['python'], baseline['platform'],
+        baseline['cpus']))
+    regressions = compare(report['results'], baseline['results'],
+                          args.threshold)
+    if regressions:
+        print('\n{} metrics got more than {:.0%} worse'.format(
+            len(regressions), args.threshold))
+        sys.exit(1)
+    print('\nNo regressions')
+
+
+if __name__ == '__main__':
+    main()
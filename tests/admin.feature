@@ -0,0 +1,49 @@
+Feature: Admin commands
+    The commands looking into how the bot is doing are only for the authors
+    configured as admins of AdminPlugin
+
+    Scenario Outline: Using <command> as an admin
+        Given alice is an admin
+          And a bot
+         When 'autobot <command>' is sent to the bot by alice
+         Then the bot replies '<reply>'
+
+        Examples:
+            | command         | reply                              |
+            | metrics nothing | No metrics starting with nothing   |
+            | profile         | Profiling is off                   |
+            | memory stop     | Stopped tracing memory allocations |
+
+    Scenario Outline: Refusing <command> to others
+        Given alice is an admin
+          And a bot
+         When 'autobot <command>' is sent to the bot by bob
+         Then the bot replies 'Sorry, only admins can do that'
+
+        Examples:
+            | command     |
+            | metrics     |
+            | traces      |
+            | profile     |
+            | memory      |
+
+    Scenario: Having no admins unless configured
+        Given a bot
+         When 'autobot metrics' is sent to the bot by alice
+         Then the bot replies 'Sorry, only admins can do that'
+
+    Scenario Outline: Telling who is behind <nick> in a room
+        Given an XMPP service with history set to drop
+          And room lobby@conference.example shows alice as alice@example/laptop
+         When <nick> says hi in room lobby@conference.example
+         Then the message queued is hi from <nick>, vouched for as <identity>
+
+        Examples:
+            | nick    | identity      |
+            | alice   | alice@example |
+            | mallory | nobody        |
+
+    Scenario: Telling who sent a direct message
+        Given an XMPP service with history set to drop
+         When alice@example/laptop says hi directly
+         Then the message queued is hi from alice@example, vouched for as alice@example
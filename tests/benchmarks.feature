@@ -0,0 +1,28 @@
+Feature: Benchmarks
+    benchmarks/run.py measures the brain, scheduler, events and storage and
+    fails when a metric got worse than its baseline by more than a threshold
+
+    Scenario Outline: Comparing <metric> to the baseline
+        Given a baseline with <metric> at 100 for brain.matchers=10
+         When the benchmarks measure <metric> at <value> for brain.matchers=10
+         Then comparing with a threshold of 0.25 finds <regressions> regressions
+
+        Examples:
+            | metric              | value | regressions |
+            | messages_per_second | 80    | 0           |
+            | messages_per_second | 50    | 1           |
+            | messages_per_second | 200   | 0           |
+            | latency_p95_ms      | 120   | 0           |
+            | latency_p95_ms      | 150   | 1           |
+            | latency_p95_ms      | 50    | 0           |
+
+    Scenario Outline: Running the <benchmark> benchmark
+        Given the benchmark suite
+         When the <benchmark> benchmark is run once, quickly
+         Then it measured <metrics>
+
+        Examples:
+            | benchmark                | metrics                            |
+            | events.handlers=10       | trigger_us                         |
+            | storage.sqlite.keys=100  | sync_all_ms, sync_one_key_ms       |
+            | brain.matchers=10        | messages_per_second, latency_p50_ms, latency_p95_ms |
@@ -0,0 +1,18 @@
+Feature: In-process bot
+    autobot.Bot runs messages through the plugins in the calling thread,
+    without any threads or services
+
+    Scenario: Replying to a message
+        Given a bot
+         When 'hello autobot' is sent to the bot
+         Then the bot replies 'Hi, user!'
+
+    Scenario: Keeping state in memory
+        Given a bot
+         When 'hello autobot' is sent to the bot
+         Then no files were written
+
+    Scenario: Putting back the events and substitutions
+        Given a bot
+         When the bot is closed
+         Then the events and substitutions are as before the bot was made
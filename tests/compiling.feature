@@ -0,0 +1,56 @@
+Feature: Compiling matchers
+    Matchers are compiled once the substitutions their patterns use are
+    there, and adding a substitution only compiles the matchers using it,
+    without holding up the messages matched meanwhile
+
+    Background:
+        Given the plugin patterns in the plugins directory
+            """
+            import autobot
+
+
+            class PatternsPlugin(autobot.Plugin):
+                @autobot.hear('^{salute} {target}')
+                def salute(self, message):
+                    message.reply('saluted')
+
+                @autobot.hear('^{salute} everyone')
+                def everyone(self, message):
+                    message.reply('saluted everyone')
+
+                @autobot.hear('^twin')
+                def twin_a(self, message):
+                    message.reply('twin a')
+
+                @autobot.hear('^twin')
+                def twin_b(self, message):
+                    message.reply('twin b')
+            """
+          And a bot
+
+    Scenario: Waiting for every substitution a pattern uses
+         When the substitution salute is added as 'yo'
+          And 'yo world' is sent to the bot
+          And the substitution target is added as 'world'
+          And 'yo world' is sent to the bot
+         Then the bot replies 'saluted'
+
+    Scenario: Compiling only the matchers using a new substitution
+        Given the brain records the matchers it compiles
+         When the substitution salute is added as 'yo'
+          And 'yo everyone' is sent to the bot
+         Then PatternsPlugin.salute, PatternsPlugin.everyone were compiled
+          And the bot replies 'saluted everyone'
+
+    Scenario: Matching with the regexes compiled so far
+        Given the compiler of the bot falls behind
+         When the substitution salute is added as 'yo'
+          And the substitution target is added as 'there'
+          And 'yo there' is sent to the bot
+         Then the bot does not reply
+         When the compiler catches up
+          And 'yo there' is sent to the bot
+         Then the bot replies 'saluted'
+
+    Scenario: Sharing the regex of matchers with the same pattern
+         Then PatternsPlugin.twin_a and PatternsPlugin.twin_b share a regex
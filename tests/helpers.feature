@@ -0,0 +1,15 @@
+Feature: Async handlers
+    Coroutines of async handlers run outside of an asyncio loop are run on
+    one loop of their own thread, shared by all of them
+
+    Scenario: Completing coroutines from several threads
+        Given a loop thread
+         When coroutines are completed in each of 4 threads
+         Then they all ran on one loop outside of those threads
+          And their results were given back
+
+    Scenario: Stopping the loop thread
+        Given a loop thread
+         When coroutines are completed in each of 2 threads
+          And the loop thread is stopped
+         Then the loop thread is no longer running
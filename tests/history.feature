@@ -0,0 +1,38 @@
+Feature: Room history
+    Delayed messages, like the history a room replays when the bot joins
+    it, are kept away from the matchers so the bot does not answer them again
+
+    Scenario Outline: Handling room history with history set to <history>
+        Given an XMPP service with history set to <history>
+         When old is received from the history of room lobby@conference.example
+          And new is received in room lobby@conference.example
+         Then the service queues <queued>
+
+        Examples:
+            | history   | queued             |
+            | drop      | new                |
+            | eavesdrop | old (delayed), new |
+            | process   | old, new           |
+
+    Scenario: Keeping history away from the matchers
+        Given the plugin historian in the plugins directory
+            """
+            import autobot
+
+
+            class HistorianPlugin(autobot.Plugin):
+                @autobot.eavesdrop(history=True)
+                def remember(self, message):
+                    if message.delayed:
+                        message.reply('remembered {}'.format(message))
+            """
+          And a bot
+         When 'hi autobot' is sent to the bot as history
+         Then the bot replies 'remembered hi autobot'
+         When 'hi autobot' is sent to the bot
+         Then the bot replies 'Hi, user!'
+
+    Scenario: Skipping history nobody asked for
+        Given a bot
+         When 'hi autobot' is sent to the bot as history
+         Then the bot does not reply
@@ -0,0 +1,42 @@
+Feature: Message queue
+    Every service puts its messages on a channel of its own on the message
+    queue, and the brain takes turns between the channels
+
+    Scenario Outline: Shedding messages from a full channel
+        Given a message queue holding 2 messages per channel with policy <policy>
+         When messages <sent> are put on channel 'chat'
+         Then the brain gets messages <kept>
+          And <shed> messages were shed from channel 'chat'
+          And joining the message queue returns once they are done
+
+        Examples: Policies
+            | policy        | sent           | kept      | shed |
+            | drop-oldest   | m0,m1,m2,m3,m4 | m3,m4     | 3    |
+            | drop-priority | m0,@m1,m2,m3   | @m1,m3    | 2    |
+            | drop-priority | @m0,@m1,m2     | @m0,@m1   | 1    |
+            | drop-priority | @m0,@m1,@m2    | @m1,@m2   | 1    |
+
+    Scenario: Taking turns by weight
+        Given a message queue with the channels xmpp weighing 2, webhook weighing 1
+         When messages a1,a2,a3,a4,a5,a6 are put on channel 'xmpp'
+          And messages b1,b2,b3 are put on channel 'webhook'
+         Then the brain gets messages a1,b1,a2,a3,b2,a4,a5,b3,a6
+
+    Scenario: Not letting a flood starve a quiet service
+        Given a message queue with the channels xmpp weighing 1, webhook weighing 1
+         When messages a1,a2,a3,a4,a5,a6 are put on channel 'xmpp'
+          And messages b1 are put on channel 'webhook'
+         Then the brain gets messages a1,b1,a2,a3,a4,a5,a6
+
+    Scenario: Getting control items first
+        Given a message queue with the channels xmpp weighing 1
+         When messages a1,a2 are put on channel 'xmpp'
+          And stop is put on the message queue itself
+         Then the brain gets messages stop,a1,a2
+
+    Scenario: Making services wait for room on a full channel
+        Given a message queue holding 2 messages per channel with policy block
+         When messages m0,m1,m2,m3 are put on channel 'chat' from another thread
+         Then the service is waiting for room with 2 messages queued
+          And the brain gets messages m0,m1,m2,m3
+          And 0 messages were shed from channel 'chat'
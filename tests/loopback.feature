@@ -0,0 +1,30 @@
+Feature: Loopback XMPP
+    The loopback service runs the XMPP service against an in-process stand
+    in for the server, to test and load it without a network
+
+    Scenario: Injecting messages as the server would
+        Given a loopback service
+         When alice says 'autobot: hi' in the room
+          And bob says 'ping' directly
+          And carol says 'old news' in the room's history
+         Then the queued messages are
+            | text        | author       | identity       | mentions bot | direct |
+            | autobot: hi | alice        | alice@loopback | yes          | no     |
+            | ping        | bob@loopback | bob@loopback   | no           | yes    |
+
+    Scenario: Recording what the bot sends
+        Given a loopback service
+         When alice says 'hi' in the room
+          And the queued message is replied to with 'hello alice'
+         Then the loopback server got 'hello alice' for loadtest@conference.loopback
+
+    Scenario: Generating load
+        Given a loopback service generating 20 messages from 4 users
+         When the service is started with a brain taking every message
+         Then the load report has 20 of 20 messages processed
+          And user0, user1, user2, user3 are in the loopback room
+
+    Scenario: Waiting for the brain to finish the last message
+        Given a loopback service generating 3 messages from 1 users
+         When the service is started with a brain taking 0.3 seconds per message
+         Then the load report has 3 of 3 messages processed
@@ -0,0 +1,51 @@
+Feature: Match cache
+    The brain remembers which matchers matched the latest message texts and
+    forgets them whenever what would match might have changed
+
+    Background:
+        Given the plugin greeter in the plugins directory
+            """
+            import autobot
+
+
+            class GreeterPlugin(autobot.Plugin):
+                @autobot.hear('^ping')
+                def ping(self, message):
+                    message.reply('pong')
+
+                @autobot.hear('^{greeting} there')
+                def greet(self, message):
+                    message.reply('greeted')
+
+                @autobot.hear('^fragile')
+                def fragile(self, message):
+                    raise ImportError('fragile')
+            """
+          And a match cache of 2 messages
+          And a bot
+
+    Scenario: Remembering what matched
+         When 'ping' is sent to the bot
+          And 'ping' is sent to the bot
+         Then the bot replies 'pong'
+          And the match cache had 1 hits and 1 misses
+
+    Scenario: Keeping the latest messages
+         When 'ping' is sent to the bot
+          And 'one' is sent to the bot
+          And 'two' is sent to the bot
+          And 'ping' is sent to the bot
+         Then the bot replies 'pong'
+          And the match cache had 0 hits and 4 misses
+          And the match cache holds 2 messages
+
+    Scenario: Forgetting when a substitution is added
+         When 'hi there' is sent to the bot
+          And the substitution greeting is added as 'hi'
+          And 'hi there' is sent to the bot
+         Then the bot replies 'greeted'
+          And the match cache had 0 hits and 2 misses
+
+    Scenario: Forgetting when a matcher breaks
+         When 'fragile' is sent to the bot
+         Then the match cache holds 0 messages
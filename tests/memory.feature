@@ -0,0 +1,40 @@
+Feature: Memory accounting
+    The bot estimates the memory held by every plugin, storage namespace and
+    queue, and can trace the allocations made since asked to
+
+    Background:
+        Given the plugin hoarder in the plugins directory
+            """
+            import autobot
+
+
+            class HoarderPlugin(autobot.Plugin):
+                def __init__(self, factory):
+                    super().__init__(factory)
+                    self.hoard = []
+
+                @autobot.respond_to('^hoard')
+                def keep(self, message):
+                    self.hoard.append('x' * 200000)
+                    self.storage['hoard'] = ['y' * 100000]
+                    message.reply('hoarding')
+            """
+          And a bot
+
+    Scenario: Finding the plugin holding the most memory
+         When 'hoard autobot' is sent to the bot
+         Then hoarderplugin holds the most memory of the plugins
+          And plugin hoarderplugin holds at least 200000 bytes
+
+    Scenario: Sizing the namespaces read into memory
+         When 'hoard autobot' is sent to the bot
+         Then namespace HoarderPlugin holds the most memory of the namespaces
+
+    Scenario: Counting what is waiting in the queues
+        Given a queue named workq holding 3 items is tracked
+         Then queue workq has 3 items waiting
+
+    Scenario: Tracing allocations since asked to
+        Given memory allocations are traced
+         When 'hoard autobot' is sent to the bot
+         Then the top allocations include the hoarder plugin
@@ -0,0 +1,59 @@
+Feature: Metrics
+    The bot keeps counters, gauges and histograms of what it is doing and
+    renders them in the Prometheus text format, also over HTTP
+
+    Scenario: Counting by label
+        Given a metrics registry
+         When the counter requests_total is increased by 2 for service xmpp
+          And the counter requests_total is increased by 1 for service webhook
+          And the counter requests_total is increased by 1 for service xmpp
+         Then the metrics are rendered as
+            """
+            # HELP requests_total Requests seen
+            # TYPE requests_total counter
+            requests_total{service="webhook"} 1
+            requests_total{service="xmpp"} 3
+            """
+
+    Scenario: Reading a gauge when rendering
+        Given a metrics registry
+         When the gauge queue_size reads a queue holding 4 items
+         Then the metrics are rendered as
+            """
+            # HELP queue_size Items waiting
+            # TYPE queue_size gauge
+            queue_size 4
+            """
+
+    Scenario: Counting observations in buckets
+        Given a metrics registry
+         When the histogram latency_seconds with buckets 0.1, 1.0 observes 0.05, 0.5, 0.5, 3.0
+         Then the metrics are rendered as
+            """
+            # HELP latency_seconds Time taken
+            # TYPE latency_seconds histogram
+            latency_seconds_bucket{le="0.1"} 1
+            latency_seconds_bucket{le="1.0"} 3
+            latency_seconds_bucket{le="+Inf"} 4
+            latency_seconds_sum 4.05
+            latency_seconds_count 4
+            """
+
+    Scenario: Handing out the same metric by name
+        Given a metrics registry
+         When the counter requests_total is increased by 1 for service xmpp
+         Then asking for the counter requests_total again gives the same one
+          And asking for a gauge named requests_total fails
+
+    Scenario: Serving metrics for Prometheus
+        Given a metrics registry
+         When the counter requests_total is increased by 1 for service xmpp
+          And the metrics are served on a free port
+         Then getting /metrics gives requests_total{service="xmpp"} 1
+          And getting /other answers 404
+
+    Scenario: Handling messages without looking up metrics
+        Given a bot
+         When 'hello autobot' is sent to the bot while metric lookups are counted
+         Then no metric was looked up
+          And the histogram autobot_matcher_seconds has observations
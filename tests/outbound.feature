@@ -0,0 +1,33 @@
+Feature: Sending replies
+    Services send replies through an outbox, which keeps to a rate per room
+    or user, lets busy targets take turns and can join queued replies
+
+    Scenario: Keeping to the sending rate of a room
+        Given an outbox sending 20 replies per second in bursts of 2
+         When replies one, two, three, four are put for room 'lobby'
+         Then replies one, two, three, four are sent to room 'lobby'
+          And sending them took at least 0.1 seconds
+
+    Scenario: Letting busy rooms take turns
+        Given an outbox sending 20 replies per second in bursts of 1
+         When replies a1, a2, a3 are put for room 'busy'
+          And replies b1 are put for room 'quiet'
+         Then reply b1 was sent before reply a3
+
+    Scenario: Joining queued replies
+        Given an outbox joining replies into messages of up to 9 characters
+         When replies one, two, three, four are put for room 'lobby'
+         Then the messages sent to room 'lobby' are
+            | message   |
+            | one\ntwo  |
+            | three     |
+            | four      |
+
+    Scenario: Forgetting the buckets of rooms that went quiet
+        Given an outbox sending 50 replies per second in bursts of 1
+          And the outbox forgets quiet rooms at once
+         When replies one are put for room 'lobby'
+          And the bucket of room 'lobby' has refilled
+          And replies two are put for room 'hall'
+         Then replies two are sent to room 'hall'
+          And the outbox keeps a bucket for room 'hall' only
@@ -0,0 +1,15 @@
+Feature: Profiling plugins
+    The profiler runs plugin methods under cProfile while it is enabled, one
+    at a time, and times the ones running alongside
+
+    Scenario: Profiling methods running in several threads at once
+        Given an enabled profiler
+         When Plugin.work is called 5 times in each of 4 threads
+         Then Plugin.work was counted 20 times
+          And the report has a profile of Plugin.work
+
+    Scenario: Timing async handlers until they are done
+        Given an enabled profiler
+         When the async handler Plugin.wait sleeping 0.05 seconds is called
+         Then Plugin.wait was counted 1 times
+          And Plugin.wait took at least 0.05 seconds
@@ -0,0 +1,28 @@
+Feature: Rosters
+    The roster of a room indexes its users by name and finds the ones
+    mentioned in a message in one pass over the text
+
+    Scenario Outline: Finding the users mentioned in "<text>"
+        Given a room with the users alice, al, bob, bobby
+         Then the users mentioned in '<text>' are <mentioned>
+
+        Examples:
+            | text                   | mentioned      |
+            | hi alice and bob       | al, alice, bob |
+            | has anyone seen bobby? | bob, bobby     |
+            | @bob: ping             | bob            |
+            | nobody here            | nobody         |
+            |                        | nobody         |
+
+    Scenario: Following users coming and going
+        Given a room with the users alice, bob
+         When carol joins the room
+          And bob leaves the room
+         Then the users mentioned in 'alice, bob and carol' are alice, carol
+          And the room has the users alice, carol
+
+    Scenario: Keeping users by name
+        Given a room with the users alice, bob
+         When alice joins the room with the real name Alice Liddell
+         Then the room has the users alice, bob
+          And alice is called Alice Liddell in the room
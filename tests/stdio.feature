@@ -0,0 +1,10 @@
+Feature: Replaying transcripts
+    The stdio service can replay a transcript of messages to measure the
+    whole pipeline, and asks the bot to quit once they have been handled
+
+    Scenario: Waiting for a slow handler on the last message
+        Given a transcript of 3 messages
+          And a brain taking 1.5 seconds over the last message
+         When the stdio service replays the transcript
+         Then 3 messages were processed
+          And the bot was asked to quit
@@ -0,0 +1,58 @@
+from behave import *  # NOQA
+from hamcrest import *  # NOQA
+import importlib.util
+import contextlib
+import io
+import os
+
+RUN = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))), 'benchmarks', 'run.py')
+
+
+def _suite():
+    spec = importlib.util.spec_from_file_location('benchmarks_run', RUN)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@given(u'the benchmark suite')
+def benchmark_suite(context):
+    context.benchmarks = _suite()
+
+
+@given(u'a baseline with {metric} at {value:d} for {name}')
+def benchmark_baseline(context, metric, value, name):
+    context.benchmarks = _suite()
+    context.baseline = {name: {metric: value}}
+
+
+@when(u'the benchmarks measure {metric} at {value:d} for {name}')
+def benchmark_measured(context, metric, value, name):
+    context.results = {name: {metric: value}}
+
+
+@when(u'the {name} benchmark is run once, quickly')
+def benchmark_run(context, name):
+    with contextlib.redirect_stdout(io.StringIO()):
+        context.results = context.benchmarks.run([name], 1, True)
+    context.benchmark = name
+
+
+@then(u'comparing with a threshold of {threshold:g} finds {count:d} '
+      'regressions')
+def benchmark_compare(context, threshold, count):
+    with contextlib.redirect_stdout(io.StringIO()):
+        regressions = context.benchmarks.compare(
+            context.results, context.baseline, threshold)
+    assert_that(regressions, has_length(count))
+
+
+@then(u'it measured {metrics}')
+def benchmark_metrics(context, metrics):
+    assert_that(context.results, has_key(context.benchmark))
+    measured = context.results[context.benchmark]
+    assert_that(sorted(measured),
+                equal_to(sorted(m.strip() for m in metrics.split(','))))
+    for value in measured.values():
+        assert_that(value, greater_than_or_equal_to(0))
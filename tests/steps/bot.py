@@ -0,0 +1,96 @@
+from behave import *  # NOQA
+from hamcrest import *  # NOQA
+
+import os
+import shutil
+import tempfile
+import autobot
+
+
+def _handlers():
+    return {event: list(handlers)
+            for event, handlers in autobot.event.snapshot()[1].items()}
+
+
+def _directory(context):
+    '''
+    The directory the bot runs in, which is made the working directory.
+    '''
+    if not hasattr(context, 'directory'):
+        context.directory = tempfile.mkdtemp()
+        context.add_cleanup(shutil.rmtree, context.directory)
+        context.add_cleanup(os.chdir, os.getcwd())
+        os.chdir(context.directory)
+    return context.directory
+
+
+@given('the plugin {name} in the plugins directory')
+def plugin(context, name):
+    # Plugin modules stay imported, so every plugin needs a name of its own
+    plugins = os.path.join(_directory(context), 'plugins')
+    os.makedirs(plugins, exist_ok=True)
+    with open(os.path.join(plugins, name + '.py'), 'w') as module:
+        module.write(context.text)
+
+
+@given('a bot')
+def bot(context):
+    context.bot_config = getattr(context, 'bot_config', {})
+    _directory(context)
+    context.handlers = _handlers()
+    context.substitutions = dict(autobot.substitutions)
+    context.bot = autobot.Bot(context.bot_config)
+    context.add_cleanup(lambda: context.bot.closed or context.bot.close())
+    context.replies = []
+
+
+@when("'{text}' is sent to the bot")
+def send(context, text):
+    context.replies = context.bot.process(text)
+
+
+@when("'{text}' is sent to the bot by {author}")
+def send_by(context, text, author):
+    context.replies = context.bot.process(text, author=author)
+
+
+@when("'{text}' is sent to the bot as history")
+def send_history(context, text):
+    context.replies = context.bot.process(text, delayed=True)
+
+
+@when('the bot is closed')
+def close(context):
+    context.bot.close()
+
+
+@then("the bot replies '{reply}'")
+def replies(context, reply):
+    assert_that(context.replies, equal_to([reply]))
+
+
+@then('the bot does not reply')
+def no_reply(context):
+    assert_that(context.replies, equal_to([]))
+
+
+@then('no files were written')
+def no_files(context):
+    assert_that(os.listdir(_directory(context)), equal_to([]))
+
+
+@then('the events and substitutions are as before the bot was made')
+def restored(context):
+    assert_that(_handlers(), equal_to(context.handlers))
+    assert_that(dict(autobot.substitutions),
+                equal_to(context.substitutions))
+
+
+@given('{author} is an admin')
+def admin(context, author):
+    context.bot_config = {'AdminPlugin': {'admins': [author]}}
+
+
+@when("the substitution {key} is added as '{value}'")
+def substitution(context, key, value):
+    autobot.substitutions.add(key, value)
@@ -0,0 +1,50 @@
+from behave import *  # NOQA
+from hamcrest import *  # NOQA
+import queue
+
+
+def _matcher(context, name):
+    for matcher in context.bot.brain.matchers:
+        if matcher.full_name == name:
+            return matcher
+    raise AssertionError('No matcher {}'.format(name))
+
+
+@given('the brain records the matchers it compiles')
+def record_compiles(context):
+    brain = context.bot.brain
+    compile_ = brain._compile
+    context.compiled = []
+
+    def recording(matchers):
+        context.compiled.extend(m.full_name for m in matchers)
+        compile_(matchers)
+    brain._compile = recording
+
+
+@then('{names} were compiled')
+def compiled(context, names):
+    assert_that(context.compiled, contains_inanyorder(
+        *[name.strip() for name in names.split(',')]))
+
+
+@then('{first} and {second} share a regex')
+def share_regex(context, first, second):
+    regexes = context.bot.brain._regexes
+    first = regexes.get(id(_matcher(context, first)))
+    second = regexes.get(id(_matcher(context, second)))
+    assert_that(first, not_none())
+    assert_that(first, same_instance(second))
+
+
+@given('the compiler of the bot falls behind')
+def compiler_behind(context):
+    # Compiling is left on a queue until the compiler catches up
+    context.bot.brain._compileq = queue.Queue()
+
+
+@when('the compiler catches up')
+def compiler_catches_up(context):
+    compileq = context.bot.brain._compileq
+    while not compileq.empty():
+        compileq.get_nowait()()
@@ -0,0 +1,61 @@
+from behave import *  # NOQA
+from hamcrest import *  # NOQA
+
+import asyncio
+import threading
+import autobot.helpers
+
+
+async def _where(number):
+    await asyncio.sleep(0.01)
+    return number, asyncio.get_running_loop(), threading.current_thread()
+
+
+@given('a loop thread')
+def loop_thread(context):
+    context.loop_thread = autobot.helpers.loop_thread
+    context.add_cleanup(context.loop_thread.stop)
+
+
+@when('coroutines are completed in each of {threads:d} threads')
+def complete_in_threads(context, threads):
+    context.results = {}
+    context.threads = []
+
+    def complete(number):
+        context.results[number] = autobot.helpers.complete(_where(number))
+
+    for number in range(threads):
+        thread = threading.Thread(target=complete, args=(number,))
+        context.threads.append(thread)
+        thread.start()
+    for thread in context.threads:
+        thread.join()
+
+
+@when('the loop thread is stopped')
+def stop_loop_thread(context):
+    context.loop = next(iter(context.results.values()))[1]
+    context.loop_thread.stop()
+
+
+@then('they all ran on one loop outside of those threads')
+def ran_on_one_loop(context):
+    loops = set(loop for _, loop, _ in context.results.values())
+    threads = set(thread for _, _, thread in context.results.values())
+    assert_that(loops, has_length(1))
+    assert_that(threads, has_length(1))
+    assert_that(context.threads, is_not(has_item(threads.pop())))
+
+
+@then('their results were given back')
+def results_given_back(context):
+    assert_that(sorted(number for number, _, _ in context.results.values()),
+                equal_to(list(range(len(context.threads)))))
+
+
+@then('the loop thread is no longer running')
+def loop_thread_stopped(context):
+    assert_that(context.loop.is_closed(), equal_to(True))
+    assert_that([thread.name for thread in threading.enumerate()],
+                is_not(has_item('async')))
@@ -0,0 +1,84 @@
+from behave import *  # NOQA
+from hamcrest import *  # NOQA
+
+import threading
+import autobot
+import autobot.ingress
+
+
+def _message(text):
+    '''
+    A message, mentioning the bot when the text starts with @.
+    '''
+    room = autobot.Room('chat', reply_handler=lambda *args: None)
+    mentions = {autobot.SELF_MENTION} if text.startswith('@') else set()
+    return autobot.Message(text, 'user', reply_path=room, mentions=mentions)
+
+
+@given('a message queue holding {size:d} messages per channel with policy '
+       '{policy}')
+def bounded_queue(context, size, policy):
+    context.messageq = autobot.ingress.Ingress(size, policy)
+    context.channels = {}
+
+
+@when("messages {texts} are put on channel '{name}'")
+def put_messages(context, texts, name):
+    if name not in context.channels:
+        context.channels[name] = context.messageq.channel(name)
+    for text in texts.split(','):
+        context.channels[name].put(_message(text))
+
+
+@then('the brain gets messages {texts}')
+def get_messages(context, texts):
+    received = []
+    for _ in texts.split(','):
+        received.append(str(context.messageq.get()))
+        context.messageq.task_done()
+    assert_that(','.join(received), equal_to(texts))
+    assert_that(context.messageq.qsize(), equal_to(0))
+
+
+@then("{count:d} messages were shed from channel '{name}'")
+def shed_messages(context, count, name):
+    stats = context.messageq.stats()
+    assert_that(stats['channels'][name]['shed'], equal_to(count))
+
+
+@then('joining the message queue returns once they are done')
+def join_queue(context):
+    joined = threading.Thread(target=context.messageq.join)
+    joined.daemon = True
+    joined.start()
+    joined.join(2)
+    assert_that(joined.is_alive(), equal_to(False))
+
+
+@given('a message queue with the channels {specs}')
+def weighted_queue(context, specs):
+    context.messageq = autobot.ingress.Ingress()
+    context.channels = {}
+    for spec in specs.split(', '):
+        name, weight = spec.split(' weighing ')
+        context.channels[name] = context.messageq.channel(name, int(weight))
+
+
+@when("{text} is put on the message queue itself")
+def put_control(context, text):
+    context.messageq.put(text)
+
+
+@when("messages {texts} are put on channel '{name}' from another thread")
+def put_from_thread(context, texts, name):
+    context.putting = threading.Thread(
+        target=put_messages, args=(context, texts, name))
+    context.putting.daemon = True
+    context.putting.start()
+
+
+@then('the service is waiting for room with {count:d} messages queued')
+def waiting_for_room(context, count):
+    context.putting.join(0.2)
+    assert_that(context.putting.is_alive(), equal_to(True))
+    assert_that(context.messageq.qsize(), equal_to(count))
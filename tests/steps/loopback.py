@@ -0,0 +1,131 @@
+from behave import *  # NOQA
+from hamcrest import *  # NOQA
+
+import threading
+import queue
+import time
+import autobot
+from autobot.core.loopback import LoopbackService
+from autobot.core.xmpp import XMPPService
+
+
+def _service(context, **config):
+    defaults = dict(autobot.Service.config_defaults)
+    defaults.update(XMPPService.config_defaults)
+    defaults.update(LoopbackService.config_defaults)
+    defaults.update(config)
+    context.service = LoopbackService(defaults)
+    context.messageq = queue.Queue()
+    context.service.set_message_queue(context.messageq)
+
+
+@given('a loopback service')
+def loopback_service(context):
+    _service(context)
+    context.service.start()
+    context.add_cleanup(context.service.stop)
+
+
+@given('a loopback service generating {count:d} messages from {users:d} '
+       'users')
+def loading_loopback_service(context, count, users):
+    _service(context, load_messages=count, load_users=users)
+
+
+@when("{nick} says '{body}' in the room")
+def say(context, nick, body):
+    context.service.client.inject(body, nick=nick)
+
+
+@when("{nick} says '{body}' directly")
+def say_directly(context, nick, body):
+    context.service.client.inject(body, nick=nick, direct=True)
+
+
+@when("{nick} says '{body}' in the room's history")
+def say_in_history(context, nick, body):
+    context.service.client.inject(body, nick=nick, delayed=True)
+
+
+@when('the service is started with a brain taking every message')
+def start_with_brain(context):
+    _start_with_brain(context, 0)
+
+
+@when('the service is started with a brain taking {seconds:g} seconds per '
+      'message')
+def start_with_slow_brain(context, seconds):
+    _start_with_brain(context, seconds)
+
+
+def _start_with_brain(context, seconds):
+    events = autobot.event.snapshot()
+    substitutions = dict(autobot.substitutions)
+
+    def restore():
+        autobot.event.restore(events)
+        autobot.substitutions.clear()
+        autobot.substitutions.update(substitutions)
+    context.add_cleanup(restore)
+
+    def brain():
+        while True:
+            message = context.messageq.get()
+            if message is None:
+                break
+            time.sleep(seconds)
+            autobot.event.trigger(autobot.event.MESSAGE_PROCESSED, None, {
+                'message': message,
+                'latency': time.time() - message.received,
+            })
+            context.messageq.task_done()
+
+    thread = threading.Thread(target=brain)
+    thread.start()
+    context.add_cleanup(thread.join)
+    context.add_cleanup(context.messageq.put, None)
+    context.service.start()
+    context.add_cleanup(context.service.stop)
+
+
+@then('the queued messages are')
+def queued_messages(context):
+    expected = [(row['text'], row['author'], row['identity'],
+                 row['mentions bot'] == 'yes', row['direct'] == 'yes')
+                for row in context.table]
+    context.service.client.idle()
+    queued = []
+    while not context.messageq.empty():
+        message = context.messageq.get()
+        queued.append((str(message), message.author, message.identity,
+                       message.mentions_self(), message.direct_message()))
+    assert_that(queued, equal_to(expected))
+
+
+@then("the loopback server got '{body}' for {to}")
+def server_got(context, body, to):
+    client = context.service.client
+    deadline = time.time() + 5
+    while not client.sent and time.time() < deadline:
+        time.sleep(0.05)
+    sent = [(mto, mbody) for _, mto, mbody, _ in client.sent]
+    assert_that(sent, equal_to([(to, body)]))
+
+
+@then('the load report has {processed:d} of {injected:d} messages '
+      'processed')
+def load_report(context, processed, injected):
+    deadline = time.time() + 10
+    while context.service.load_report is None and time.time() < deadline:
+        time.sleep(0.05)
+    report = context.service.load_report
+    assert_that(report, is_not(None))
+    assert_that((report['processed'], report['injected']),
+                equal_to((processed, injected)))
+
+
+@then('{names} are in the loopback room')
+def in_room(context, names):
+    roster = context.service.default_room.roster
+    assert_that([user.name for user in roster],
+                has_items(*names.split(', ')))
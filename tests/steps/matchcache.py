@@ -0,0 +1,20 @@
+from behave import *  # NOQA
+from hamcrest import *  # NOQA
+
+
+@given('a match cache of {size:d} messages')
+def match_cache(context, size):
+    context.bot_config = getattr(context, 'bot_config', {})
+    context.bot_config['match_cache_size'] = size
+
+
+@then('the match cache had {hits:d} hits and {misses:d} misses')
+def match_cache_requests(context, hits, misses):
+    stats = context.bot.brain._match_cache.stats()
+    assert_that(stats, has_entries(hits=hits, misses=misses))
+
+
+@then('the match cache holds {count:d} messages')
+def match_cache_entries(context, count):
+    stats = context.bot.brain._match_cache.stats()
+    assert_that(stats['entries'], equal_to(count))
@@ -0,0 +1,57 @@
+from behave import *  # NOQA
+from hamcrest import *  # NOQA
+
+import queue
+from autobot.memory import Memory
+
+
+def _memory(context):
+    if not hasattr(context, 'memory'):
+        context.memory = Memory()
+    return context.memory
+
+
+@given('a queue named {name} holding {count:d} items is tracked')
+def tracked_queue(context, name, count):
+    items = queue.Queue()
+    for number in range(count):
+        items.put(number)
+    _memory(context).track(name, items)
+
+
+@given('memory allocations are traced')
+def trace_allocations(context):
+    _memory(context).start_tracing()
+    context.add_cleanup(context.memory.stop_tracing)
+
+
+@then('{name} holds the most memory of the plugins')
+def largest_plugin(context, name):
+    plugins = _memory(context).plugins(context.bot.factory)
+    assert_that(plugins[0][0], equal_to(name))
+
+
+@then('plugin {name} holds at least {size:d} bytes')
+def plugin_size(context, name, size):
+    plugins = dict(_memory(context).plugins(context.bot.factory))
+    assert_that(plugins[name], greater_than_or_equal_to(size))
+
+
+@then('namespace {name} holds the most memory of the namespaces')
+def largest_namespace(context, name):
+    storage = context.bot.factory.get_storage()
+    namespaces = _memory(context).namespaces(storage)
+    assert_that(namespaces[0][0], equal_to(name))
+
+
+@then('queue {name} has {count:d} items waiting')
+def queue_length(context, name, count):
+    queues = {queue_name: length for queue_name, length, _
+              in _memory(context).queues()}
+    assert_that(queues[name], equal_to(count))
+
+
+@then('the top allocations include the hoarder plugin')
+def top_allocations(context):
+    lines = [str(statistic) for statistic in _memory(context).top(10)]
+    assert_that(lines, has_item(contains_string('hoarder.py')))
@@ -0,0 +1,98 @@
+from behave import *  # NOQA
+from hamcrest import *  # NOQA
+
+import urllib.error
+import urllib.request
+from unittest import mock
+import autobot
+from autobot.metrics import Metrics
+
+
+@given('a metrics registry')
+def registry(context):
+    context.metrics = Metrics()
+    context.add_cleanup(context.metrics.shutdown)
+
+
+@when('the counter {name} is increased by {amount:d} for service '
+      '{service}')
+def increase(context, name, amount, service):
+    context.metrics.counter(name, 'Requests seen').inc(amount,
+                                                       service=service)
+
+
+@when('the gauge {name} reads a queue holding {count:d} items')
+def gauge_function(context, name, count):
+    items = list(range(count))
+    context.metrics.gauge(name, 'Items waiting', function=lambda: len(items))
+
+
+@when('the histogram {name} with buckets {buckets} observes {values}')
+def observe(context, name, buckets, values):
+    histogram = context.metrics.histogram(
+        name, 'Time taken', [float(bound) for bound in buckets.split(', ')])
+    for value in values.split(', '):
+        histogram.observe(float(value))
+
+
+@when('the metrics are served on a free port')
+def serve(context):
+    context.port = context.metrics.serve(0)
+
+
+@then('the metrics are rendered as')
+def rendered(context):
+    assert_that(context.metrics.render(), equal_to(context.text + '\n'))
+
+
+@then('asking for the counter {name} again gives the same one')
+def same_counter(context, name):
+    assert_that(context.metrics.counter(name),
+                same_instance(context.metrics[name]))
+
+
+@then('asking for a gauge named {name} fails')
+def gauge_fails(context, name):
+    assert_that(lambda: context.metrics.gauge(name), raises(ValueError))
+
+
+def _get(context, path):
+    return urllib.request.urlopen('http://127.0.0.1:{}{}'.format(
+        context.port, path), timeout=5)
+
+
+@then('getting /metrics gives {line}')
+def scraped(context, line):
+    with _get(context, '/metrics') as response:
+        body = response.read().decode('utf-8')
+    assert_that(body.splitlines(), has_item(line))
+
+
+@then('getting {path} answers {status:d}')
+def scrape_status(context, path, status):
+    try:
+        _get(context, path).close()
+        answered = 200
+    except urllib.error.HTTPError as e:
+        answered = e.code
+    assert_that(answered, equal_to(status))
+
+
+@when("'{text}' is sent to the bot while metric lookups are counted")
+def send_counting_lookups(context, text):
+    with mock.patch.object(autobot.metrics, '_get',
+                           wraps=autobot.metrics._get) as lookups:
+        context.replies = context.bot.process(text)
+    context.lookups = lookups.call_count
+
+
+@then('no metric was looked up')
+def no_lookups(context):
+    assert_that(context.lookups, equal_to(0))
+
+
+@then('the histogram {name} has observations')
+def has_observations(context, name):
+    histogram = autobot.metrics[name]
+    assert_that(sum(count for _, _, count in histogram._series.values()),
+                greater_than(0))
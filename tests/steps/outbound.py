@@ -0,0 +1,106 @@
+from behave import *  # NOQA
+from hamcrest import *  # NOQA
+
+import threading
+import time
+import autobot
+import autobot.outbound
+
+
+class _Sent(object):
+    def __init__(self):
+        self.messages = []
+        self.condition = threading.Condition()
+
+    def __call__(self, target, text):
+        with self.condition:
+            self.messages.append((target.name, text, time.monotonic()))
+            self.condition.notify_all()
+
+    def wait_for(self, count, timeout=5):
+        with self.condition:
+            self.condition.wait_for(lambda: len(self.messages) >= count,
+                                    timeout)
+        return self.messages
+
+
+def _outbox(context, **kwargs):
+    context.sent = _Sent()
+    context.put = 0
+    context.rooms = {}
+    context.outbox = autobot.outbound.Outbox('test', **kwargs)
+    context.add_cleanup(context.outbox.shutdown)
+
+
+@given('an outbox sending {rate:d} replies per second in bursts of {burst:d}')
+def rate_limited_outbox(context, rate, burst):
+    _outbox(context, rate=rate, burst=burst)
+    context.outbox.start()
+
+
+@given('an outbox joining replies into messages of up to {length:d} '
+       'characters')
+def coalescing_outbox(context, length):
+    # Started once everything is queued, so the replies are there to join
+    _outbox(context, coalesce_length=length)
+
+
+@given('the outbox forgets quiet rooms at once')
+def prune_at_once(context):
+    interval = autobot.outbound.PRUNE_INTERVAL
+    autobot.outbound.PRUNE_INTERVAL = 0
+
+    def restore():
+        autobot.outbound.PRUNE_INTERVAL = interval
+    context.add_cleanup(restore)
+
+
+@when('replies {texts} are put for room \'{name}\'')
+def put_replies(context, texts, name):
+    room = context.rooms.setdefault(name, autobot.Room(name))
+    if not context.put:
+        context.started = time.monotonic()
+    for text in texts.split(', '):
+        context.outbox.put(context.sent, room, text)
+        context.put += 1
+
+
+@when('the bucket of room \'{name}\' has refilled')
+def bucket_refilled(context, name):
+    context.sent.wait_for(context.put)
+    time.sleep(0.1)
+
+
+@then('replies {texts} are sent to room \'{name}\'')
+def replies_sent(context, texts, name):
+    messages = context.sent.wait_for(context.put)
+    assert_that([text for room, text, _ in messages if room == name],
+                equal_to(texts.split(', ')))
+
+
+@then('sending them took at least {seconds:f} seconds')
+def sending_took(context, seconds):
+    last = context.sent.messages[-1][2]
+    assert_that(last - context.started, greater_than_or_equal_to(seconds))
+
+
+@then('reply {first} was sent before reply {second}')
+def sent_before(context, first, second):
+    messages = context.sent.wait_for(context.put)
+    texts = [text for _, text, _ in messages]
+    assert_that(texts.index(first), less_than(texts.index(second)))
+
+
+@then('the messages sent to room \'{name}\' are')
+def messages_sent(context, name):
+    context.outbox.start()
+    expected = [row['message'].replace('\\n', '\n') for row in context.table]
+    context.outbox.shutdown()
+    assert_that([text for room, text, _ in context.sent.messages
+                 if room == name], equal_to(expected))
+
+
+@then('the outbox keeps a bucket for room \'{name}\' only')
+def kept_buckets(context, name):
+    assert_that(list(context.outbox._buckets),
+                equal_to([(context.sent, 'Room', name)]))
@@ -0,0 +1,65 @@
+from behave import *  # NOQA
+from hamcrest import *  # NOQA
+
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import time
+import autobot.profiling
+
+
+def _work():
+    total = 0
+    for i in range(10000):
+        total += i
+    time.sleep(0.005)
+    return total
+
+
+@given('an enabled profiler')
+def profiler(context):
+    context.directory = tempfile.mkdtemp()
+    context.add_cleanup(shutil.rmtree, context.directory)
+    context.profiler = autobot.profiling.Profiler(context.directory)
+    context.profiler.start()
+
+
+@when('{name} is called {count:d} times in each of {threads:d} threads')
+def call_in_threads(context, name, count, threads):
+    def calls():
+        for _ in range(count):
+            context.profiler.call(name, _work)
+
+    running = [threading.Thread(target=calls) for _ in range(threads)]
+    for thread in running:
+        thread.start()
+    for thread in running:
+        thread.join()
+
+
+@when('the async handler {name} sleeping {seconds:f} seconds is called')
+def call_async(context, name, seconds):
+    async def handler():
+        await asyncio.sleep(seconds)
+
+    asyncio.run(context.profiler.wrap(name, handler)())
+
+
+@then('{name} was counted {count:d} times')
+def counted(context, name, count):
+    calls = {entry[0]: entry[1] for entry in context.profiler.summary()}
+    assert_that(calls.get(name), equal_to(count))
+
+
+@then('{name} took at least {seconds:f} seconds')
+def took(context, name, seconds):
+    times = {entry[0]: entry[2] for entry in context.profiler.summary()}
+    assert_that(times.get(name), greater_than_or_equal_to(seconds))
+
+
+@then('the report has a profile of {name}')
+def report(context, name):
+    path = context.profiler.report()
+    assert_that(os.listdir(path), has_item('{}.prof'.format(name)))
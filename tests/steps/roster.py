@@ -0,0 +1,49 @@
+from behave import *  # NOQA
+from hamcrest import *  # NOQA
+
+import autobot
+
+
+def _names(names):
+    return [] if names == 'nobody' else names.split(', ')
+
+
+@given('a room with the users {names}')
+def room(context, names):
+    context.room = autobot.Room('lobby', roster=[
+        autobot.User(name) for name in _names(names)])
+
+
+@when('{name} joins the room')
+def join(context, name):
+    context.room.roster.append(autobot.User(name))
+
+
+@when('{name} joins the room with the real name {real_name}')
+def join_with_real_name(context, name, real_name):
+    context.room.roster.add(autobot.User(name, real_name))
+
+
+@when('{name} leaves the room')
+def leave(context, name):
+    context.room.roster.remove(name)
+
+
+@then("the users mentioned in '{text}' are {names}")
+@then("the users mentioned in '' are {names}")
+def mentioned(context, names, text=''):
+    assert_that(sorted(context.room.roster.mentions(text)),
+                equal_to(_names(names)))
+
+
+@then('the room has the users {names}')
+def has_users(context, names):
+    assert_that(sorted(user.name for user in context.room.roster),
+                equal_to(_names(names)))
+    assert_that(len(context.room.roster), equal_to(len(_names(names))))
+
+
+@then('{name} is called {real_name} in the room')
+def real_name(context, name, real_name):
+    assert_that(name in context.room.roster, equal_to(True))
+    assert_that(context.room.roster.get(name).real_name, equal_to(real_name))
@@ -0,0 +1,72 @@
+from behave import *  # NOQA
+from hamcrest import *  # NOQA
+
+import json
+import os
+import tempfile
+import threading
+import time
+import autobot
+import autobot.ingress
+from autobot.core.stdio import StdioService
+
+
+@given('a transcript of {count:d} messages')
+def transcript(context, count):
+    handle, context.transcript = tempfile.mkstemp(suffix='.jsonl')
+    with os.fdopen(handle, 'w') as transcript:
+        for i in range(count):
+            transcript.write(json.dumps({'author': 'alice',
+                                         'text': 'message {}'.format(i)}))
+            transcript.write('\n')
+    context.count = count
+    context.add_cleanup(os.remove, context.transcript)
+
+
+@given('a brain taking {seconds:f} seconds over the last message')
+def slow_brain(context, seconds):
+    context.messageq = autobot.ingress.Ingress()
+    context.processed = []
+
+    def think():
+        for i in range(context.count):
+            message = context.messageq.get()
+            if i == context.count - 1:
+                time.sleep(seconds)
+            context.processed.append(str(message))
+            autobot.event.trigger(autobot.event.MESSAGE_PROCESSED, None, {
+                'message': message,
+                'latency': time.time() - message.received,
+            })
+            context.messageq.task_done()
+
+    brain = threading.Thread(target=think)
+    brain.daemon = True
+    brain.start()
+
+
+@when('the stdio service replays the transcript')
+def replay(context):
+    context.quit = []
+
+    def quit_requested(event_context, event_args):
+        context.quit.append(event_context)
+
+    autobot.event.register(autobot.event.QUIT_REQUESTED, quit_requested)
+    context.add_cleanup(autobot.event.deregister,
+                        autobot.event.QUIT_REQUESTED, quit_requested)
+    config = dict(StdioService.config_defaults,
+                  mention_name='autobot', replay=context.transcript)
+    service = StdioService(config)
+    service.set_message_queue(context.messageq.channel('stdio'))
+    service._replay(context.transcript)
+
+
+@then('{count:d} messages were processed')
+def processed(context, count):
+    assert_that(len(context.processed), equal_to(count))
+
+
+@then('the bot was asked to quit')
+def asked_to_quit(context):
+    assert_that(len(context.quit), equal_to(1))
@@ -0,0 +1,454 @@
+from behave import *  # NOQA
+from hamcrest import *  # NOQA
+
+import ast
+import os
+import pickle
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from unittest import mock
+import autobot.migrate
+from autobot.cache import CachedStorage
+from autobot.factory import Factory
+from autobot.core.journal import JournalStorage
+from autobot.core.redis import RedisStorage
+from autobot.core.shelve import ShelveStorage
+from autobot.core.sqlite import SQLiteStorage
+
+# The storage classes by name, along with their settings, where paths are
+# relative to a directory of their own
+_BACKENDS = {
+    'shelve': (ShelveStorage, {'path': 'shelve'}),
+    'sqlite': (SQLiteStorage, {'path': 'autobot.sqlite'}),
+    'journal': (JournalStorage, {'path': 'autobot.journal'}),
+    'redis': (RedisStorage, {'client_class': 'fakeredis.FakeStrictRedis'}),
+}
+
+
+def _open(context):
+    context.storage = context.open_storage()
+    context.add_cleanup(context.storage.close)
+
+
+def _backend(context, backend):
+    '''
+    The class of a backend and a config keeping it in a directory, or under
+    a Redis prefix, of its own.
+    '''
+    directory = tempfile.mkdtemp()
+    context.add_cleanup(shutil.rmtree, directory)
+    storage_class, settings = _BACKENDS[backend]
+    config = dict(storage_class.config_defaults)
+    config.update(settings)
+    if 'path' in settings:
+        config['path'] = os.path.join(directory, settings['path'])
+    if 'prefix' in config:
+        # Keys of their own on the server shared by all scenarios
+        config['prefix'] = os.path.basename(directory)
+    return storage_class, config
+
+
+def _use_backend(context, storage_class, config):
+    context.storage_class = storage_class
+    context.storage_config = config
+    context.open_storage = lambda: storage_class(config)
+
+
+def _read_elsewhere(context, name, key):
+    '''
+    What another instance of the backend reads for key in a namespace.
+    '''
+    reader = context.storage_class(context.storage_config)
+    try:
+        return reader[name][key] if name in reader else None
+    finally:
+        reader.close()
+
+
+@given('a {backend} storage')
+def storage(context, backend):
+    _use_backend(context, *_backend(context, backend))
+    _open(context)
+
+
+@given('a journal storage compacting every {interval:f} seconds')
+def compacting_journal(context, interval):
+    storage_class, config = _backend(context, 'journal')
+    config.update(compact_interval=interval, compact_min_size=0)
+    _use_backend(context, storage_class, config)
+    _open(context)
+
+
+@given('a {backend} storage cached in {size:d} bytes in {mode} mode')
+def cached_storage(context, backend, size, mode):
+    context.storage_class, context.storage_config = _backend(context,
+                                                             backend)
+    context.open_storage = lambda: CachedStorage(
+        context.storage_class(context.storage_config), size, mode)
+    _open(context)
+
+
+@when("'{key}' is set to {value} in namespace '{name}'")
+def set_key(context, key, value, name):
+    context.storage.namespace(name)[key] = ast.literal_eval(value)
+
+
+@when("'{item}' is added to '{key}' in namespace '{name}'")
+def add_to_key(context, item, key, name):
+    context.storage[name][key].add(item)
+
+
+@when("'{key}' is deleted from namespace '{name}'")
+def delete_key(context, key, name):
+    del context.storage[name][key]
+
+
+@when("namespace '{name}' is deleted")
+def delete_namespace(context, name):
+    del context.storage[name]
+
+
+@when('the storage is synced')
+def sync(context):
+    context.storage.sync()
+
+
+@when('the storage is synced and opened again')
+def reopen(context):
+    context.storage.sync()
+    context.storage.close()
+    _open(context)
+
+
+@when("the storage is synced while another thread reads '{key}' in "
+      "namespace '{name}'")
+def sync_while_reading(context, key, name):
+    def read():
+        context.read = _read_elsewhere(context, name, key)
+
+    thread = threading.Thread(target=read)
+    thread.start()
+    context.storage.sync()
+    thread.join()
+
+
+@then("namespace '{name}' has '{key}' set to {value}")
+def key_set(context, name, key, value):
+    assert_that(context.storage[name][key],
+                equal_to(ast.literal_eval(value)))
+
+
+@then("namespace '{name}' has no '{key}'")
+def has_no_key(context, name, key):
+    assert_that(key in context.storage[name], equal_to(False))
+
+
+@then('the storage has the namespaces {names}')
+def has_namespaces(context, names):
+    assert_that(sorted(context.storage), equal_to(names.split(', ')))
+
+
+@then('the database has the tables {tables}')
+def has_tables(context, tables):
+    with sqlite3.connect(context.storage_config['path']) as conn:
+        rows = conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'")
+        assert_that(sorted(row[0] for row in rows),
+                    equal_to(tables.split(', ')))
+
+
+@then('the other thread read {first:d} or {second:d}')
+def read_either(context, first, second):
+    assert_that(context.read, is_in([first, second]))
+
+
+@when("namespace '{name}' is read")
+def read_namespace(context, name):
+    dict(context.storage[name])
+
+
+@then('the storage has not been opened')
+def not_opened(context):
+    assert_that(context.storage.opened, equal_to(False))
+
+
+@then('the storage has been opened')
+def opened(context):
+    assert_that(context.storage.opened, equal_to(True))
+
+
+@then('no file was written for it')
+def no_file(context):
+    directory = os.path.dirname(context.storage_config['path'])
+    assert_that(os.listdir(directory), equal_to([]))
+
+
+@then('the stats only have namespace {name}')
+def stats_only(context, name):
+    stats = context.storage.stats()
+    assert_that(list(stats), equal_to([name]))
+    assert_that(stats[name]['load_time'], greater_than_or_equal_to(0))
+
+
+@then('the stats have the stored size of namespace {name}')
+def stored_size(context, name):
+    assert_that(context.storage.stats()[name]['size'], greater_than(0))
+
+
+@when("{threads:d} threads add 1 to '{key}' in namespace '{name}' "
+      "{times:d} times while the storage syncs")
+def add_in_threads(context, threads, key, name, times):
+    namespace = context.storage[name]
+
+    def add():
+        for _ in range(times):
+            with namespace.transaction() as data:
+                data[key] += 1
+
+    running = [threading.Thread(target=add) for _ in range(threads)]
+    for thread in running:
+        thread.start()
+    while any(thread.is_alive() for thread in running):
+        context.storage.sync()
+    for thread in running:
+        thread.join()
+
+
+@when("namespace '{name}' is held in a transaction by another thread")
+def hold_transaction(context, name):
+    namespace = context.storage[name]
+    held = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with namespace.transaction():
+            held.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    context.add_cleanup(thread.join)
+    context.add_cleanup(release.set)
+    held.wait(5)
+
+
+@then("'{key}' can be set in namespace '{name}' meanwhile")
+def set_meanwhile(context, key, name):
+    done = threading.Event()
+
+    def set_key():
+        context.storage.namespace(name)[key] = True
+        done.set()
+
+    threading.Thread(target=set_key, daemon=True).start()
+    assert_that(done.wait(1), equal_to(True))
+
+
+@then("namespace '{name}' is locked meanwhile")
+def locked_meanwhile(context, name):
+    lock = context.storage.lock(name)
+    acquired = []
+    thread = threading.Thread(
+        target=lambda: acquired.append(lock.acquire(timeout=0.1)))
+    thread.start()
+    thread.join()
+    assert_that(acquired, equal_to([False]))
+
+
+@when('{count:d} numbers are kept in each of the namespaces {names}')
+def keep_numbers(context, count, names):
+    for name in names.split(', '):
+        context.storage.namespace(name)['numbers'] = list(range(count))
+
+
+@given('a factory handing out a {backend} storage cached in {size:d} '
+       'bytes')
+def factory_cached_storage(context, backend, size):
+    storage_class, config = _backend(context, backend)
+    context.factory = Factory({'storage_plugin': backend,
+                               'storage_cache_size': size,
+                               'storage_cache_mode': 'write-back'}, {})
+    context.factory._plugins[backend + 'storage'] = storage_class(config)
+
+
+@then('the factory hands out the same storage every time')
+def same_storage(context):
+    context.storage = context.factory.get_storage()
+    context.add_cleanup(context.storage.close)
+    assert_that(context.factory.get_storage(),
+                same_instance(context.storage))
+
+
+@then('the backend behind the cache has not been opened')
+def backend_not_opened(context):
+    assert_that(context.storage._backend.opened, equal_to(False))
+
+
+@then('the cache holds at most {size:d} bytes')
+def cache_size(context, size):
+    assert_that(context.storage.cache_stats()['size'],
+                less_than_or_equal_to(size))
+
+
+@then('the cache evicted namespaces {names}')
+def evicted(context, names):
+    names = names.split(', ')
+    assert_that(context.storage.cache_stats()['evictions'],
+                equal_to(len(names)))
+    assert_that(context.storage.memory_usage(),
+                is_not(any_of(*[has_key(name) for name in names])))
+
+
+@then('namespace {name} is cached again')
+def cached_again(context, name):
+    assert_that(context.storage.memory_usage(), has_key(name))
+
+
+@then('each of the namespaces {names} has its {count:d} numbers')
+def has_numbers(context, names, count):
+    for name in names.split(', '):
+        assert_that(context.storage[name]['numbers'],
+                    equal_to(list(range(count))))
+
+
+@then("the backend has '{key}' set to {value} in namespace '{name}'")
+def backend_has(context, key, value, name):
+    assert_that(_read_elsewhere(context, name, key),
+                equal_to(ast.literal_eval(value)))
+
+
+@when("'{key}' is counted up to {count:d} in namespace '{name}', syncing "
+      "every time")
+def count_up(context, key, count, name):
+    namespace = context.storage.namespace(name)
+    namespace[key] = 0
+    context.storage.sync()
+    for _ in range(count):
+        namespace[key] += 1
+        context.storage.sync()
+    context.journal_size = os.path.getsize(context.storage_config['path'])
+
+
+@when('the journal is compacted')
+def compact(context):
+    context.storage.data.compact()
+
+
+@when('the journal is left alone for {seconds:f} seconds')
+def leave_alone(context, seconds):
+    time.sleep(seconds)
+
+
+@when('half a record is written to the end of the journal')
+def torn_record(context):
+    context.storage.close()
+    with open(context.storage_config['path'], 'ab') as journal:
+        journal.write(b'\x00\x00\x00\x01\x01\x00')
+
+
+@when('the storage is opened again')
+def open_again(context):
+    _open(context)
+
+
+@then('the journal has shrunk')
+def shrunk(context):
+    size = os.path.getsize(context.storage_config['path'])
+    assert_that(size, less_than(context.journal_size))
+
+
+@then('syncing the storage executes one transaction writing {count:d} keys')
+def one_transaction(context, count):
+    client = context.storage.data.client
+    pipeline = client.pipeline
+    executed = []
+
+    def recording_pipeline():
+        recorded = pipeline()
+        execute = recorded.execute
+
+        def recording_execute():
+            executed.append([args for args, _ in recorded.command_stack])
+            return execute()
+        recorded.execute = recording_execute
+        return recorded
+
+    client.pipeline = recording_pipeline
+    context.storage.sync()
+    assert_that(executed, has_length(1))
+    # HSET takes the hash followed by pairs of fields and values
+    written = sum((len(args) - 2) // 2 for args in executed[0]
+                  if args[0] == 'HSET')
+    assert_that(written, equal_to(count))
+
+
+@given('a {backend} storage to migrate to')
+def destination(context, backend):
+    context.destination = _backend(context, backend)
+
+
+@given("a {backend} storage to migrate to, with '{key}' set to {value} in "
+       "namespace '{name}'")
+def filled_destination(context, backend, key, value, name):
+    context.destination = _backend(context, backend)
+    storage_class, config = context.destination
+    storage = storage_class(config)
+    storage.namespace(name)[key] = ast.literal_eval(value)
+    storage.sync()
+    storage.close()
+
+
+@when("{count:d} numbered keys are kept in namespace '{name}'")
+def keep_numbered_keys(context, count, name):
+    namespace = context.storage.namespace(name)
+    for number in range(count):
+        namespace['key{}'.format(number)] = number
+
+
+@when('the storage is migrated in chunks of {size:d} keys')
+def migrate(context, size):
+    destination = context.destination[0](context.destination[1])
+    context.progress = []
+    context.writes = []
+    store = destination.store
+
+    def recording_store(name, value):
+        context.writes.append(name)
+        store(name, value)
+    destination.store = recording_store
+    context.copied = autobot.migrate.migrate(
+        context.storage, destination, size, progress=context.progress.append)
+    context.storage.close()
+    destination.close()
+    _use_backend(context, *context.destination)
+    _open(context)
+
+
+@then("namespace '{name}' has its {count:d} numbered keys")
+def has_numbered_keys(context, name, count):
+    assert_that(dict(context.storage[name]), equal_to({
+        'key{}'.format(number): number for number in range(count)}))
+
+
+@then('the migration copied {count:d} keys of namespace {name} in '
+      '{chunks:d} chunks')
+def copied(context, count, name, chunks):
+    assert_that(context.copied[name], equal_to(count))
+    lines = [line for line in context.progress
+             if line.startswith('{}: '.format(name))]
+    assert_that(lines, has_length(chunks))
+
+
+@then('the migration wrote namespace {name} {count:d} times')
+def written_times(context, name, count):
+    assert_that(context.writes.count(name), equal_to(count))
+
+
+@then('syncing the storage pickles {count:d} values')
+def pickles(context, count):
+    with mock.patch('pickle.dumps', wraps=pickle.dumps) as dumps:
+        context.storage.sync()
+    assert_that(dumps.call_count, equal_to(count))
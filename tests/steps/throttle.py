@@ -0,0 +1,67 @@
+from behave import *  # NOQA
+from hamcrest import *  # NOQA
+from unittest import mock
+import time
+
+import autobot
+
+
+def _throttle_config(context, **settings):
+    context.bot_config = getattr(context, 'bot_config', {})
+    context.bot_config.update(settings)
+
+
+@given('a clock the test controls')
+def clock(context):
+    context.now = time.monotonic()
+    patcher = mock.patch('time.monotonic', lambda: context.now)
+    patcher.start()
+    context.add_cleanup(patcher.stop)
+
+
+@given('authors may send {rate:d} message per second in bursts of {burst:d}')
+def author_rate(context, rate, burst):
+    _throttle_config(context, throttle_author_rate=rate,
+                     throttle_author_burst=burst)
+
+
+@given('rooms may send {rate:d} message per second in bursts of {burst:d}')
+def room_rate(context, rate, burst):
+    _throttle_config(context, throttle_room_rate=rate,
+                     throttle_room_burst=burst)
+
+
+@given('{name} is never throttled')
+def exempt(context, name):
+    _throttle_config(context, throttle_exempt=[name])
+
+
+@given('the throttling events are recorded')
+def record_throttling(context):
+    context.throttling = []
+
+    def started(sender, event_args):
+        context.throttling.append((event_args['kind'], event_args['name']))
+    autobot.event.register(autobot.event.THROTTLING_STARTED, started)
+
+
+@when('{seconds:d} seconds pass')
+def seconds_pass(context, seconds):
+    context.now += seconds
+
+
+@then('throttling started once, for {kind} {name}')
+def throttling_started(context, kind, name):
+    assert_that(context.throttling, equal_to([(kind, name)]))
+
+
+@then('the throttle only keeps track of {name}')
+def throttle_tracks(context, name):
+    throttle = context.bot.brain._throttle
+    assert_that(list(throttle._buckets), equal_to([('author', name)]))
+
+
+@then('no one is being throttled')
+def no_one_throttled(context):
+    gauge = autobot.metrics.gauge('autobot_throttled_sources', '')
+    assert_that(gauge.value(), equal_to(0))
@@ -0,0 +1,98 @@
+from behave import *  # NOQA
+from hamcrest import *  # NOQA
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import autobot
+from autobot.tracing import Tracer
+
+
+def _message(text='hello'):
+    return autobot.Message(text, 'alice', reply_path=autobot.Room('lobby'))
+
+
+def _trace(context, message):
+    trace = context.tracer.start(message)
+    if trace:
+        trace.add('handle', message.received, time.time())
+    return trace
+
+
+@given('a tracer sampling {rate:f} of messages')
+def tracer(context, rate):
+    directory = tempfile.mkdtemp()
+    context.add_cleanup(shutil.rmtree, directory)
+    context.trace_file = os.path.join(directory, 'traces.jsonl')
+    context.tracer = Tracer(rate, context.trace_file)
+
+
+@given('every message is traced')
+def trace_everything(context):
+    context.tracer = autobot.tracer
+    sample_rate = context.tracer.sample_rate
+    context.tracer.configure(sample_rate=1.0)
+    context.add_cleanup(context.tracer.configure, sample_rate=sample_rate)
+
+
+@when('{count:d} messages are traced')
+def trace_messages(context, count):
+    for number in range(count):
+        trace = _trace(context, _message('message {}'.format(number)))
+        if trace:
+            trace.finish()
+
+
+@when('a message is traced with a reply held back')
+def trace_with_reply(context):
+    context.trace = _trace(context, _message())
+    context.trace.hold()
+    context.trace.finish()
+
+
+@when('the reply is sent')
+def send_reply(context):
+    with context.trace.span('send', target='lobby'):
+        pass
+    context.trace.release()
+
+
+@then('{count:d} traces were recorded')
+def recorded(context, count):
+    assert_that(context.tracer.recent(), has_length(count))
+
+
+@then('the trace file has {count:d} traces')
+def trace_file(context, count):
+    if not os.path.exists(context.trace_file):
+        assert_that(count, equal_to(0))
+        return
+    with open(context.trace_file) as traces:
+        assert_that([json.loads(line) for line in traces],
+                    has_length(count))
+
+
+@then('the latest trace has the spans {names}')
+def latest_spans(context, names):
+    trace = context.tracer.recent(1)[0]
+    assert_that([span['name'] for span in trace['spans']],
+                equal_to(names.split(', ')))
+
+
+@then('the latest trace went through {names}')
+def latest_stages(context, names):
+    trace = context.tracer.recent(1)[0]
+    stages = names.split(', ')
+    assert_that([span['name'] for span in trace['spans']
+                 if span['name'] in stages], equal_to(stages))
+
+
+@then('the latest trace has spans for every matcher and the reply')
+def latest_matchers(context):
+    trace = context.tracer.recent(1)[0]
+    names = [span['name'] for span in trace['spans']]
+    assert_that(names.count('matcher'),
+                equal_to(len(context.bot.brain.matchers)))
+    assert_that(names, has_item('say'))
@@ -0,0 +1,109 @@
+from behave import *  # NOQA
+from hamcrest import *  # NOQA
+
+import http.client
+import json
+import queue
+import socket
+from autobot.core.webhook import WebhookService
+
+
+@given('a webhook service')
+def webhook_service(context):
+    _webhook_service(context)
+
+
+@given('a webhook service with {setting} set to {value:d}')
+def configured_webhook_service(context, setting, value):
+    _webhook_service(context, **{setting: value})
+
+
+def _webhook_service(context, **settings):
+    config = dict(WebhookService.config_defaults)
+    config.update(mention_name='autobot', port=0)
+    config.update(settings)
+    context.service = WebhookService(config)
+    context.messageq = queue.Queue()
+    context.service.set_message_queue(context.messageq)
+    context.service.run()
+    context.add_cleanup(context.service.shutdown)
+    context.connection = http.client.HTTPConnection(
+        '127.0.0.1', context.service.port, timeout=5)
+    context.add_cleanup(context.connection.close)
+    context.sockets = set()
+
+
+def _request(context, method, path, body=None):
+    context.connection.request(method, path, body)
+    context.sockets.add(context.connection.sock)
+    response = context.connection.getresponse()
+    context.status = response.status
+    context.response = json.loads(response.read().decode('utf-8'))
+
+
+@when("'{payload}' is posted")
+def post(context, payload):
+    _request(context, 'POST', '/messages', payload.encode('utf-8'))
+
+
+@when("the queued message is replied to with '{text}'")
+def reply(context, text):
+    context.message = context.messageq.get(timeout=5)
+    context.message.reply(text)
+
+
+@when("the request line '{line}' is sent to the webhook")
+def send_request_line(context, line):
+    with socket.create_connection(
+            ('127.0.0.1', context.service.port), timeout=5) as client:
+        client.sendall(line.encode('latin-1') + b'\r\n\r\n')
+        response = client.makefile('rb').readline().decode('latin-1')
+    context.status = int(response.split()[1])
+
+
+@then('the webhook answers {status:d}')
+def answers(context, status):
+    assert_that(context.status, equal_to(status))
+
+
+@then('the message \'{text}\' from {author} in room {room} is queued')
+def queued(context, text, author, room):
+    context.message = context.messageq.get(timeout=5)
+    assert_that(str(context.message), equal_to(text))
+    assert_that(context.message.author, equal_to(author))
+    assert_that(context.message.reply_path.name, equal_to(room))
+
+
+@then('the queued message mentions {name}')
+def queued_mentions(context, name):
+    assert_that(context.message.mentions(name), equal_to(True))
+
+
+@then('no message is queued')
+def nothing_queued(context):
+    assert_that(context.messageq.qsize(), equal_to(0))
+
+
+@then('getting {path} gives the replies {replies}')
+def get_replies(context, path, replies):
+    _request(context, 'GET', path)
+    assert_that(context.status, equal_to(200))
+    assert_that(context.response['replies'], equal_to(replies.split(', ')))
+
+
+@then('getting {path} gives no replies')
+def get_no_replies(context, path):
+    _request(context, 'GET', path)
+    assert_that(context.status, equal_to(200))
+    assert_that(context.response['replies'], equal_to([]))
+
+
+@then('the webhook knows the rooms {names}')
+def known_rooms(context, names):
+    assert_that(list(context.service._rooms), equal_to(names.split(', ')))
+
+
+@then('both were posted over one connection')
+def one_connection(context):
+    assert_that(context.messageq.qsize(), equal_to(2))
+    assert_that(context.sockets, has_length(1))
@@ -0,0 +1,81 @@
+from behave import *  # NOQA
+from hamcrest import *  # NOQA
+
+import queue
+import sleekxmpp
+from autobot.core.xmpp import XMPPService
+
+
+@given('an XMPP service with history set to {history}')
+def xmpp_service(context, history):
+    config = dict(XMPPService.config_defaults)
+    config.update(server='example', username='autobot', password='secret',
+                  real_name='Autobot', mention_name='autobot',
+                  rooms=['lobby@conference.example'], history=history)
+    context.service = XMPPService(config)
+    context.messageq = queue.Queue()
+    context.service.set_message_queue(context.messageq)
+
+
+def _receive(context, body, room, delayed):
+    context.service._message_received({
+        'from': sleekxmpp.JID('{}/alice'.format(room)),
+        'type': 'groupchat',
+        'body': body,
+        'delay': {'stamp': '2016-01-01T00:00:00Z' if delayed else None},
+    })
+
+
+@when('{body} is received from the history of room {room}')
+def receive_history(context, body, room):
+    _receive(context, body, room, True)
+
+
+@when('{body} is received in room {room}')
+def receive(context, body, room):
+    _receive(context, body, room, False)
+
+
+@then('the service queues {messages}')
+def queues(context, messages):
+    queued = []
+    while not context.messageq.empty():
+        message = context.messageq.get()
+        queued.append('{} (delayed)'.format(message) if message.delayed
+                      else str(message))
+    assert_that(', '.join(queued), equal_to(messages))
+
+
+@given('room {room} shows {nick} as {jid}')
+def occupant_jid(context, room, nick, jid):
+    rooms = context.service._client._room_plugin.rooms
+    rooms.setdefault(room, {})[nick] = {'jid': sleekxmpp.JID(jid)}
+
+
+@when('{nick} says {body} in room {room}')
+def say_in_room(context, nick, body, room):
+    context.service._message_received({
+        'from': sleekxmpp.JID('{}/{}'.format(room, nick)),
+        'type': 'groupchat',
+        'body': body,
+        'delay': {'stamp': None},
+    })
+
+
+@when('{jid} says {body} directly')
+def say_directly(context, jid, body):
+    context.service._message_received({
+        'from': sleekxmpp.JID(jid),
+        'type': 'chat',
+        'body': body,
+        'delay': {'stamp': None},
+    })
+
+
+@then('the message queued is {body} from {author}, vouched for as {identity}')
+def queues_from(context, body, author, identity):
+    message = context.messageq.get_nowait()
+    assert_that(str(message), equal_to(body))
+    assert_that(message.author, equal_to(author))
+    assert_that(message.identity,
+                equal_to(None if identity == 'nobody' else identity))
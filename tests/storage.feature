@@ -0,0 +1,237 @@
+Feature: Storage
+    Storage plugins keep the namespaces of plugins across restarts, reading
+    and writing them through the Storage interface
+
+    Scenario Outline: Keeping namespaces across restarts with <backend>
+        Given a <backend> storage
+         When 'count' is set to 3 in namespace 'Counter'
+          And 'seen' is set to {'alice'} in namespace 'Hello'
+          And the storage is synced and opened again
+         Then namespace 'Counter' has 'count' set to 3
+          And namespace 'Hello' has 'seen' set to {'alice'}
+          And the storage has the namespaces Counter, Hello
+
+        Examples:
+            | backend |
+            | shelve  |
+            | sqlite  |
+            | journal |
+            | redis   |
+
+    Scenario Outline: Writing values changed in place with <backend>
+        Given a <backend> storage
+         When 'seen' is set to {'alice'} in namespace 'Hello'
+          And the storage is synced
+          And 'bob' is added to 'seen' in namespace 'Hello'
+          And the storage is synced and opened again
+         Then namespace 'Hello' has 'seen' set to {'alice', 'bob'}
+
+        Examples:
+            | backend |
+            | shelve  |
+            | sqlite  |
+            | journal |
+            | redis   |
+
+    Scenario Outline: Deleting keys and namespaces with <backend>
+        Given a <backend> storage
+         When 'count' is set to 3 in namespace 'Counter'
+          And 'seen' is set to {'alice'} in namespace 'Hello'
+          And 'other' is set to 1 in namespace 'Hello'
+          And the storage is synced
+          And 'seen' is deleted from namespace 'Hello'
+          And namespace 'Counter' is deleted
+          And the storage is synced and opened again
+         Then namespace 'Hello' has no 'seen'
+          And namespace 'Hello' has 'other' set to 1
+          And the storage has the namespaces Hello
+
+        Examples:
+            | backend |
+            | shelve  |
+            | sqlite  |
+            | journal |
+            | redis   |
+
+    Scenario Outline: Pickling only the keys used since the last sync with <backend>
+        Given a <backend> storage
+         When 100 numbered keys are kept in namespace 'Big'
+          And the storage is synced
+          And 'key1' is set to 5 in namespace 'Big'
+         Then syncing the storage pickles 1 values
+
+        Examples:
+            | backend |
+            | sqlite  |
+            | journal |
+            | redis   |
+
+    Scenario: Keeping every namespace in a table of its own
+        Given a sqlite storage
+         When 'count' is set to 3 in namespace 'Counter'
+          And 'seen' is set to {'alice'} in namespace 'Hello'
+          And the storage is synced
+         Then the database has the tables ns_Counter, ns_Hello
+
+    Scenario: Reading from another thread while syncing
+        Given a sqlite storage
+         When 'count' is set to 3 in namespace 'Counter'
+          And the storage is synced
+          And 'count' is set to 4 in namespace 'Counter'
+          And the storage is synced while another thread reads 'count' in namespace 'Counter'
+         Then the other thread read 3 or 4
+
+    Scenario: Opening the backend when it is first used
+        Given a sqlite storage
+         Then the storage has not been opened
+          And no file was written for it
+         When 'count' is set to 3 in namespace 'Counter'
+         Then the storage has been opened
+
+    Scenario: Loading only the namespaces that are used
+        Given a sqlite storage
+         When 'count' is set to 3 in namespace 'Counter'
+          And 'seen' is set to {'alice'} in namespace 'Hello'
+          And the storage is synced and opened again
+          And namespace 'Hello' is read
+         Then the stats only have namespace Hello
+          And the stats have the stored size of namespace Hello
+
+    Scenario Outline: Counting in transactions from several threads with <backend>
+        Given a <backend> storage
+         When 'count' is set to 0 in namespace 'Counter'
+          And 4 threads add 1 to 'count' in namespace 'Counter' 200 times while the storage syncs
+          And the storage is synced and opened again
+         Then namespace 'Counter' has 'count' set to 800
+
+        Examples:
+            | backend |
+            | shelve  |
+            | sqlite  |
+            | journal |
+            | redis   |
+
+    Scenario: Locking one namespace at a time
+        Given a sqlite storage
+         When 'count' is set to 0 in namespace 'Counter'
+          And namespace 'Counter' is held in a transaction by another thread
+         Then 'seen' can be set in namespace 'Hello' meanwhile
+          And namespace 'Counter' is locked meanwhile
+
+    Scenario Outline: Evicting the least recently used namespaces in <mode> mode
+        Given a sqlite storage cached in 10000 bytes in <mode> mode
+         When 100 numbers are kept in each of the namespaces N1, N2, N3, N4, N5
+          And the storage is synced
+         Then the cache holds at most 10000 bytes
+          And the cache evicted namespaces N1, N2, N3
+         When namespace 'N1' is read
+         Then namespace N1 is cached again
+         When the storage is synced and opened again
+         Then each of the namespaces N1, N2, N3, N4, N5 has its 100 numbers
+
+        Examples:
+            | mode          |
+            | write-back    |
+            | write-through |
+
+    Scenario: Handing out one cache before anything is stored
+        Given a factory handing out a sqlite storage cached in 100000 bytes
+         Then the factory hands out the same storage every time
+          And the backend behind the cache has not been opened
+
+    Scenario Outline: Writing to the backend in <mode> mode
+        Given a sqlite storage cached in 100000 bytes in <mode> mode
+         When 'count' is set to 3 in namespace 'Counter'
+          And the storage is synced
+          And 'count' is set to 4 in namespace 'Counter'
+         Then the backend has 'count' set to <before> in namespace 'Counter'
+         When the storage is synced
+         Then the backend has 'count' set to 4 in namespace 'Counter'
+
+        Examples:
+            | mode          | before |
+            | write-back    | 3      |
+            | write-through | 4      |
+
+    Scenario: Compacting the journal
+        Given a journal storage
+         When 'count' is counted up to 100 in namespace 'Counter', syncing every time
+          And 'seen' is set to {'alice'} in namespace 'Hello'
+          And the storage is synced
+          And the journal is compacted
+         Then the journal has shrunk
+         When the storage is synced and opened again
+         Then namespace 'Counter' has 'count' set to 100
+          And namespace 'Hello' has 'seen' set to {'alice'}
+
+    Scenario: Compacting the journal in the background
+        Given a journal storage compacting every 0.05 seconds
+         When 'count' is counted up to 100 in namespace 'Counter', syncing every time
+          And the journal is left alone for 0.2 seconds
+         Then the journal has shrunk
+          And namespace 'Counter' has 'count' set to 100
+
+    Scenario: Dropping a record torn by a crash
+        Given a journal storage
+         When 'count' is set to 3 in namespace 'Counter'
+          And the storage is synced
+          And half a record is written to the end of the journal
+          And the storage is opened again
+         Then namespace 'Counter' has 'count' set to 3
+         When 'count' is set to 4 in namespace 'Counter'
+          And the storage is synced and opened again
+         Then namespace 'Counter' has 'count' set to 4
+
+    Scenario: Sharing namespaces between bots through Redis
+        Given a redis storage
+         When 'count' is set to 3 in namespace 'Counter'
+         Then the backend has 'count' set to None in namespace 'Counter'
+         When the storage is synced
+         Then the backend has 'count' set to 3 in namespace 'Counter'
+
+    Scenario: Syncing every namespace in one transaction
+        Given a redis storage
+         When 'count' is set to 3 in namespace 'Counter'
+          And 'seen' is set to {'alice'} in namespace 'Hello'
+          And the storage is synced
+          And 'count' is set to 4 in namespace 'Counter'
+          And 'bob' is added to 'seen' in namespace 'Hello'
+         Then syncing the storage executes one transaction writing 2 keys
+
+    Scenario Outline: Migrating from <source> to <destination>
+        Given a <source> storage
+          And a <destination> storage to migrate to
+         When 250 numbered keys are kept in namespace 'Big'
+          And 'seen' is set to {'alice'} in namespace 'Hello'
+          And the storage is synced
+          And the storage is migrated in chunks of 100 keys
+          And the storage is synced and opened again
+         Then namespace 'Big' has its 250 numbered keys
+          And namespace 'Hello' has 'seen' set to {'alice'}
+          And the migration copied 250 keys of namespace Big in 3 chunks
+
+        Examples:
+            | source  | destination |
+            | shelve  | sqlite      |
+            | sqlite  | journal     |
+            | journal | redis       |
+            | redis   | shelve      |
+
+    Scenario: Writing whole namespaces once when migrating to shelve
+        Given a sqlite storage
+          And a shelve storage to migrate to
+         When 250 numbered keys are kept in namespace 'Big'
+          And the storage is synced
+          And the storage is migrated in chunks of 100 keys
+         Then the migration copied 250 keys of namespace Big in 3 chunks
+          And the migration wrote namespace Big 3 times
+          And namespace 'Big' has its 250 numbered keys
+
+    Scenario: Replacing namespaces when migrating
+        Given a shelve storage
+          And a sqlite storage to migrate to, with 'old' set to 1 in namespace 'Hello'
+         When 'seen' is set to {'alice'} in namespace 'Hello'
+          And the storage is synced
+          And the storage is migrated in chunks of 100 keys
+         Then namespace 'Hello' has no 'old'
+          And namespace 'Hello' has 'seen' set to {'alice'}
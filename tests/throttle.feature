@@ -0,0 +1,75 @@
+Feature: Throttling
+    Messages from an author or a room sending faster than the throttle_*
+    settings allow are dropped before they are matched
+
+    Background:
+        Given a clock the test controls
+
+    Scenario: Dropping messages over the burst
+        Given authors may send 1 message per second in bursts of 2
+          And a bot
+         When 'hello autobot' is sent to the bot by alice
+          And 'hello autobot' is sent to the bot by alice
+          And 'hello autobot' is sent to the bot by alice
+         Then the bot does not reply
+
+    Scenario: Letting authors through once they slow down
+        Given authors may send 1 message per second in bursts of 2
+          And a bot
+         When 'hello autobot' is sent to the bot by alice
+          And 'hello autobot' is sent to the bot by alice
+          And 'hello autobot' is sent to the bot by alice
+          And 1 seconds pass
+          And 'hello autobot' is sent to the bot by alice
+         Then the bot replies 'Hi, alice!'
+
+    Scenario: Throttling authors on their own
+        Given authors may send 1 message per second in bursts of 1
+          And a bot
+         When 'hello autobot' is sent to the bot by alice
+          And 'hello autobot' is sent to the bot by alice
+          And 'hello autobot' is sent to the bot by bob
+         Then the bot replies 'Hi, bob!'
+
+    Scenario: Throttling a room
+        Given rooms may send 1 message per second in bursts of 2
+          And a bot
+         When 'hello autobot' is sent to the bot by alice
+          And 'hello autobot' is sent to the bot by bob
+          And 'hello autobot' is sent to the bot by carol
+         Then the bot does not reply
+
+    Scenario: Never throttling exempt authors
+        Given authors may send 1 message per second in bursts of 1
+          And alice is never throttled
+          And a bot
+         When 'hello autobot' is sent to the bot by alice
+          And 'hello autobot' is sent to the bot by alice
+         Then the bot replies 'Hi, alice!'
+
+    Scenario: Telling when throttling starts
+        Given authors may send 1 message per second in bursts of 1
+          And a bot
+          And the throttling events are recorded
+         When 'hello autobot' is sent to the bot by alice
+          And 'hello autobot' is sent to the bot by alice
+          And 'hello autobot' is sent to the bot by alice
+         Then throttling started once, for author alice
+
+    Scenario: Forgetting authors that went quiet
+        Given authors may send 1 message per second in bursts of 2
+          And a bot
+         When 'hello autobot' is sent to the bot by alice
+          And 60 seconds pass
+          And 'hello autobot' is sent to the bot by bob
+         Then the throttle only keeps track of bob
+
+    Scenario: Forgetting throttled authors that went quiet
+        Given authors may send 1 message per second in bursts of 1
+          And a bot
+         When 'hello autobot' is sent to the bot by alice
+          And 'hello autobot' is sent to the bot by alice
+          And 60 seconds pass
+          And 'hello autobot' is sent to the bot by bob
+         Then the throttle only keeps track of bob
+          And no one is being throttled
@@ -0,0 +1,30 @@
+Feature: Tracing
+    A share of the messages is traced stage by stage, from the message queue
+    to the replies being sent
+
+    Scenario Outline: Sampling <rate> of the messages
+        Given a tracer sampling <rate> of messages
+         When 20 messages are traced
+         Then <count> traces were recorded
+          And the trace file has <count> traces
+
+        Examples:
+            | rate | count |
+            | 0.0  | 0     |
+            | 1.0  | 20    |
+
+    Scenario: Holding a trace open for a reply
+        Given a tracer sampling 1.0 of messages
+         When a message is traced with a reply held back
+         Then 0 traces were recorded
+         When the reply is sent
+         Then 1 traces were recorded
+          And the latest trace has the spans handle, send
+
+    Scenario: Tracing a message through the bot
+        Given every message is traced
+          And a bot
+         When 'hello autobot' is sent to the bot
+         Then the bot replies 'Hi, user!'
+          And the latest trace went through queue, dispatch, join, callbacks, sync
+          And the latest trace has spans for every matcher and the reply
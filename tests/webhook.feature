@@ -0,0 +1,76 @@
+Feature: Webhooks
+    The webhook service takes messages posted to it over HTTP, hands out the
+    replies to them and refuses what it cannot make sense of
+
+    Scenario: Posting a message
+        Given a webhook service
+         When '{"text": "build failed", "author": "ci", "room": "builds", "mentions": ["alice"]}' is posted
+         Then the webhook answers 202
+          And the message 'build failed' from ci in room builds is queued
+          And the queued message mentions alice
+
+    Scenario: Handing out replies
+        Given a webhook service
+         When '{"text": "deploy autobot", "user": "alice"}' is posted
+          And the queued message is replied to with 'deploying'
+         Then getting /users/alice gives the replies deploying
+
+    Scenario: Dropping the replies nobody came for
+        Given a webhook service with max_reply_buffers set to 2
+         When '{"text": "deploy autobot", "user": "alice"}' is posted
+          And the queued message is replied to with 'deploying'
+          And '{"text": "deploy autobot", "user": "bob"}' is posted
+          And the queued message is replied to with 'deploying'
+          And '{"text": "deploy autobot", "user": "carol"}' is posted
+          And the queued message is replied to with 'deploying'
+         Then getting /users/alice gives no replies
+          And getting /users/carol gives the replies deploying
+
+    Scenario: Forgetting the rooms used least recently
+        Given a webhook service with max_rooms set to 2
+         When '{"text": "one", "room": "builds"}' is posted
+          And '{"text": "two", "room": "deploys"}' is posted
+          And '{"text": "three", "room": "builds"}' is posted
+          And '{"text": "four", "room": "alerts"}' is posted
+         Then the webhook knows the rooms builds, alerts
+
+    Scenario: Refusing a batch that is too large before building its messages
+        Given a webhook service with max_batch set to 1
+         When '[{"text": "hi"}, {"text": 1}]' is posted
+         Then the webhook answers 413
+          And no message is queued
+
+    Scenario: Turning requests away while the queue is full before parsing them
+        Given a webhook service with max_pending set to 1
+         When '{"text": "one"}' is posted
+          And '{"author": "ci"}' is posted
+         Then the webhook answers 429
+
+    Scenario Outline: Refusing <what>
+        Given a webhook service
+         When '<payload>' is posted
+         Then the webhook answers 400
+          And no message is queued
+
+        Examples:
+            | what                        | payload                             |
+            | mentions that are text      | {"text": "hi", "mentions": "alice"} |
+            | mentions that are not names | {"text": "hi", "mentions": [1]}     |
+            | an author that is not text  | {"text": "hi", "author": ["ci"]}    |
+            | a room that is not text     | {"text": "hi", "room": 1}           |
+            | a mention that is text      | {"text": "hi", "mention": "yes"}    |
+            | a message without text      | {"author": "ci"}                    |
+            | a bad message in a batch    | [{"text": "hi"}, {"text": 1}]       |
+            | a body that is not JSON     | not json                            |
+
+    Scenario: Refusing a malformed request
+        Given a webhook service
+         When the request line 'HELLO' is sent to the webhook
+         Then the webhook answers 400
+
+    Scenario: Keeping the connection open
+        Given a webhook service
+         When '{"text": "one"}' is posted
+          And '{"text": "two"}' is posted
+         Then the webhook answers 202
+          And both were posted over one connection